@@ -26,10 +26,11 @@ from com.chinawayltd.api.gateway.sdk.auth import (
 
 
 class DefaultClient:
-    def __init__(self, app_key=None, app_secret=None, time_out=None):
+    def __init__(self, app_key=None, app_secret=None, time_out=None, pool=None):
         self.__app_key = app_key
         self.__app_secret = app_secret
         self.__time_out = time_out
+        self.__pool = pool
 
     def execute(self, request=None):
         try:
@@ -45,7 +46,8 @@ class DefaultClient:
                 protocol=request.get_protocol(),
                 content_type=request.get_content_type(),
                 content=request.get_body(),
-                time_out=request.get_time_out()
+                time_out=request.get_time_out(),
+                pool=self.__pool
             )
 
             if response.get_ssl_enable():
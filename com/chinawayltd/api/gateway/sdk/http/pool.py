@@ -0,0 +1,128 @@
+import http.client
+import socket
+import ssl
+import threading
+from collections import deque
+
+from com.chinawayltd.api.gateway.sdk.common import constant
+
+
+DEFAULT_POOL_SIZE = 10
+
+# errors of a kept alive connection the server closed meanwhile
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected, http.client.CannotSendRequest,
+    ConnectionResetError, BrokenPipeError
+)
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPS connection resuming the last TLS session of the host, so that a
+    new connection of the pool skips the full handshake
+    """
+    def __init__(self, host, port=None, pool=None, **kwargs):
+        http.client.HTTPSConnection.__init__(self, host, port, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        key = (self.host, self.port)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host,
+            session=self.pool.get_tls_session(key)
+        )
+        self.pool.set_tls_session(key, self.sock.session)
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections by protocol, host & port
+
+    Up to max_size idle connections are kept per host, a connection is
+    given to one request at a time. Connections are thread safe to get &
+    release, so a pool may be shared by the clients of all threads.
+    """
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, ssl_context=None):
+        self.max_size = max_size
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.__idle = {}
+        self.__tls_sessions = {}
+        self.__lock = threading.Lock()
+
+    def get_tls_session(self, key):
+        return self.__tls_sessions.get(key)
+
+    def set_tls_session(self, key, session):
+        if session is not None:
+            self.__tls_sessions[key] = session
+
+    def new_connection(self, protocol, host, port, time_out=None):
+        if protocol == constant.HTTPS:
+            return PooledHTTPSConnection(
+                host, port, pool=self, timeout=time_out, context=self.ssl_context
+            )
+
+        return http.client.HTTPConnection(host, port, timeout=time_out)
+
+    def get_connection(self, protocol, host, port, time_out=None):
+        """
+        Return (connection, reused), an idle connection of the host if any
+        """
+        with self.__lock:
+            idle = self.__idle.get((protocol, host, port))
+            if idle:
+                return idle.pop(), True
+
+        return self.new_connection(protocol, host, port, time_out), False
+
+    def release(self, protocol, host, port, connection, response=None):
+        """
+        Keep the connection for the next requests unless the server closes
+        it or the pool of the host is full
+        """
+        if response is None or response.will_close:
+            connection.close()
+            return
+
+        with self.__lock:
+            idle = self.__idle.setdefault((protocol, host, port), deque())
+            if len(idle) < self.max_size:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def request(self, protocol, host, port, method, url, body=None, headers={}, time_out=None):
+        """
+        Send the request on a kept alive connection, or a new one if it was
+        closed by the server meanwhile; return status, headers & body
+        """
+        while True:
+            connection, reused = self.get_connection(protocol, host, port, time_out)
+            try:
+                connection.request(method=method, url=url, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except (socket.error, http.client.HTTPException):
+                connection.close()
+                raise
+
+            self.release(protocol, host, port, connection, response)
+            return response.status, response.getheaders(), content
+
+    def close(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+default_pool = ConnectionPool()
@@ -6,6 +6,7 @@ import urllib.parse
 import urllib.error
 
 from com.chinawayltd.api.gateway.sdk.common import constant
+from com.chinawayltd.api.gateway.sdk.http.pool import default_pool
 
 
 class Response(Request):
@@ -13,7 +14,7 @@ class Response(Request):
         self, host=None, url=None, baseurl=None, queries=None,
         method=constant.GET, headers={}, protocol=constant.HTTP,
         content_type=None, content=None, port=None, key_file=None,
-        cert_file=None, time_out=None
+        cert_file=None, time_out=None, pool=None
     ):
         Request.__init__(
             self, host=host, protocol=protocol, url=url, baseurl=baseurl,
@@ -26,6 +27,7 @@ class Response(Request):
         self.__cert_file = cert_file
         self.__port = port
         self.__connection = None
+        self.__pool = pool or default_pool
         self.set_body(content)
         self.set_content_type(content_type)
 
@@ -53,30 +55,29 @@ class Response(Request):
         host, port = urllib.parse.splitport(host)
         return host
 
+    def get_time_out_seconds(self):
+        if self.get_time_out() is None:
+            return None
+
+        return self.get_time_out() / 1000
+
     def get_http_response(self):
         if self.__port is None or self.__port == "":
             self.__port = 80
         try:
-            self.__connection = http.client.HTTPConnection(
-                self.parse_host(), self.__port
-            )
-            self.__connection.connect()
-
             request_url = self.get_baseurl() + self.get_url() + "?"
 
             if self.get_queries() is not None:
                 request_url += urllib.parse.urlencode(self.get_queries())
 
-            self.__connection.request(
+            return self.__pool.request(
+                constant.HTTP, self.parse_host(), self.__port,
                 method=self.get_method(), url=request_url,
-                body=self.get_body(), headers=self.get_headers()
+                body=self.get_body(), headers=self.get_headers(),
+                time_out=self.get_time_out_seconds()
             )
-            response = self.__connection.getresponse()
-            return response.status, response.getheaders(), response.read()
         except Exception:
             return None, None, None
-        finally:
-            self.__close_connection()
 
     def get_http_response_object(self):
         if self.__port is None or self.__port == "":
@@ -102,11 +103,6 @@ class Response(Request):
     def get_https_response(self):
         try:
             self.__port = 443
-            self.__connection = http.client.HTTPSConnection(
-                self.parse_host(), self.__port,
-                cert_file=self.__cert_file, key_file=self.__key_file
-            )
-            self.__connection.connect()
             post_data = None
             if self.get_content_type() == constant.CONTENT_TYPE_FORM and \
                self.get_body():
@@ -116,16 +112,14 @@ class Response(Request):
 
             request_url = self.get_baseurl() + self.get_url() + "?" + \
                 urllib.parse.urlencode(self.get_queries())
-            self.__connection.request(
+            return self.__pool.request(
+                constant.HTTPS, self.parse_host(), self.__port,
                 method=self.get_method(), url=request_url,
-                body=post_data, headers=self.get_headers()
+                body=post_data, headers=self.get_headers(),
+                time_out=self.get_time_out_seconds()
             )
-            response = self.__connection.getresponse()
-            return response.status, response.getheaders(), response.read()
         except Exception:
             return None, None, None
-        finally:
-            self.__close_connection()
 
     def get_https_response_object(self):
         if self.__port is None or self.__port == "":
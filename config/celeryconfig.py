@@ -11,6 +11,16 @@ beat_schedule = {
     'remind_expires_events': {
         'task': 'tms.notification.tasks.remind_expires_events',
         'schedule': crontab(minute=0, hour=0),
+    },
+    # fallback of the dispatch_notifications service, see notification/outbox.py
+    'dispatch_notification_outbox': {
+        'task': 'tms.notification.tasks.dispatch_notification_outbox',
+        'schedule': 5.0,
+    },
+    # yesterday's G7 tracks replace the bridge ones, see vehicle/tracks.py
+    'backfill_vehicle_tracks': {
+        'task': 'tms.vehicle.tasks.backfill_vehicle_tracks',
+        'schedule': crontab(minute=30, hour=0),
     }
 }
 
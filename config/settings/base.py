@@ -204,6 +204,9 @@ G7_HTTP_VEHICLE_BASIC_SECRET = env.str('G7_HTTP_VEHICLE_BASIC_SECRET')
 G7_HTTP_VEHICLE_DATA_ACCESS_ID = env.str('G7_HTTP_VEHICLE_DATA_ACCESS_ID')
 G7_HTTP_VEHICLE_DATA_SECRET = env.str('G7_HTTP_VEHICLE_DATA_SECRET')
 
+# idle keep-alive connections kept to G7
+G7_HTTP_POOL_SIZE = env.int('G7_HTTP_POOL_SIZE', default=10)
+
 G7_MQTT_HOST = env.str('G7_MQTT_HOST')
 G7_MQTT_POSITION_TOPIC = env.str('G7_MQTT_POSITION_TOPIC')
 G7_MQTT_POSITION_CLIENT_ID = env.str('G7_MQTT_POSITION_CLIENT_ID')
@@ -233,4 +236,11 @@ CHANNEL_LAYERS = {
             "hosts": [('127.0.0.1', 6379)],
         },
     },
-}
\ No newline at end of file
+}
+
+# minimum seconds between position messages sent to one monitor socket
+MONITOR_POSITION_INTERVAL = env.float('MONITOR_POSITION_INTERVAL', default=1.0)
+
+# seconds the live vehicle states of the position bridge are used by the
+# vehicle position apis before asking G7, see tms/g7/states.py
+VEHICLE_STATE_MAX_AGE = env.float('VEHICLE_STATE_MAX_AGE', default=60.0)
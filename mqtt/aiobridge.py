@@ -0,0 +1,224 @@
+"""
+Asyncio bridge mode for G7 MQTT messages
+
+The paho network thread only enqueues raw payloads onto a bounded queue, so a
+slow database, channel layer or push call never blocks the next MQTT packet.
+A pool of async workers decodes the frames, fans them out on the channel layer
+and hands them to the frame processor (geofencing, db writes and pushes).
+
+The frame processor runs on a single thread, in queue order, so the
+per-vehicle enter & exit state is updated in the same order as frames arrive.
+Fan-outs run one at a time in queue order too, so the sequenced positions
+reach the channel layer in sequence order.
+
+When the queue is full, the overflow policy decides what happens:
+ - drop-oldest: the oldest queued frame is discarded
+ - drop-newest: the incoming frame is discarded
+ - merge: the incoming frame is merged into the newest queued frame
+"""
+import asyncio
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_MERGE = 'merge'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_MERGE)
+
+logger = logging.getLogger('mqtt.position')
+
+
+class BridgeMetrics:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_queue_depth = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def record_latency(self, latency):
+        self.processed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self, queue_depth):
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'avg_latency_ms': round(self.total_latency / self.processed * 1000, 2) if self.processed else 0,
+            'max_latency_ms': round(self.max_latency * 1000, 2),
+        }
+
+
+class FrameQueue:
+    """
+    Bounded frame queue; put() must be called on the event loop thread
+    """
+    def __init__(self, maxsize, overflow, decode, merge, metrics):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.decode = decode
+        self.merge = merge
+        self.metrics = metrics
+        self.items = collections.deque()
+        self.not_empty = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, received_at, payload):
+        self.metrics.received += 1
+        item = {'received_at': received_at, 'payload': payload, 'frame': None}
+
+        if len(self.items) >= self.maxsize:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self.metrics.dropped += 1
+                return
+
+            if self.overflow == OVERFLOW_MERGE and self.merge is not None:
+                newest = self.items[-1]
+                try:
+                    old_frame = newest['frame'] if newest['frame'] is not None else self.decode(newest['payload'])
+                    new_frame = self.decode(payload)
+                except ValueError:
+                    self.metrics.dropped += 1
+                    return
+
+                newest['frame'] = self.merge(old_frame, new_frame)
+                self.metrics.merged += 1
+                return
+
+            self.items.popleft()
+            self.metrics.dropped += 1
+
+        self.items.append(item)
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, len(self.items))
+        self.not_empty.set()
+
+    async def get(self):
+        while not self.items:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        return self.items.popleft()
+
+
+class AsyncBridge:
+    """
+    decode(payload) returns the frame or None; it must be cheap.
+    fan_out(frame) is a coroutine sending the frame on the channel layer.
+    process(frame) is a blocking callable run on the frame processor thread.
+    merge(old_frame, new_frame) returns the merged frame for merge policy.
+    """
+    def __init__(self, decode, fan_out, process, merge=None, workers=4, queue_size=100,
+                 overflow=OVERFLOW_DROP_OLDEST, metrics_interval=60, report=None, debug=False):
+        self.decode = decode
+        self.fan_out = fan_out
+        self.process = process
+        self.workers = workers
+        self.metrics = BridgeMetrics()
+        self.metrics_interval = metrics_interval
+        self.report = report
+        self.debug = debug
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = FrameQueue(queue_size, overflow, decode, merge, self.metrics)
+        self.processor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frame-processor')
+
+        # waiters get the lock in the order they asked for it
+        self.fan_out_lock = asyncio.Lock()
+        self.tasks = []
+
+    def submit(self, payload):
+        """
+        Enqueue the payload, may be called from any thread
+        """
+        self.loop.call_soon_threadsafe(self.queue.put, time.monotonic(), payload)
+
+    def on_message(self, client, userdata, message):
+        """
+        paho on_message callback, called on the paho network thread
+        """
+        self.submit(message.payload)
+
+    async def worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                frame = item['frame'] if item['frame'] is not None else self.decode(item['payload'])
+                if frame is None:
+                    continue
+
+                # submitted before the first await, so frames are processed in queue order
+                processed = self.loop.run_in_executor(self.processor, self.process, frame)
+
+                # asked before the first await too, so the frame is fanned out
+                # after the earlier ones are sent
+                async with self.fan_out_lock:
+                    await self.fan_out(frame)
+                await processed
+                self.metrics.record_latency(time.monotonic() - item['received_at'])
+            except Exception as e:
+                self.metrics.failed += 1
+                if self.debug:
+                    print(f'[Bridge]: {e}')
+
+                logger.exception('[Bridge]: %s', e)
+
+    async def report_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            metrics = self.metrics.snapshot(len(self.queue))
+            self.metrics.reset()
+            if self.report is not None:
+                self.report(metrics)
+
+    def serve(self):
+        """
+        Run the workers on the calling thread until stop() is called
+        """
+        asyncio.set_event_loop(self.loop)
+        self.tasks = [self.loop.create_task(self.worker()) for _ in range(self.workers)]
+        self.tasks.append(self.loop.create_task(self.report_metrics()))
+        try:
+            self.loop.run_until_complete(asyncio.gather(*self.tasks))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.processor.shutdown()
+
+    def stop(self):
+        """
+        Stop the workers, may be called from any thread
+        """
+        def cancel():
+            for task in self.tasks:
+                task.cancel()
+
+        self.loop.call_soon_threadsafe(cancel)
+
+    def run(self, mqtt_client):
+        """
+        Start paho network thread and run the workers forever
+        """
+        mqtt_client.on_message = self.on_message
+        mqtt_client.loop_start()
+        try:
+            self.serve()
+        finally:
+            mqtt_client.loop_stop()
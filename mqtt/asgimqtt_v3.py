@@ -5,31 +5,68 @@
 
 """
 import argparse
+import asyncio
 import redis
+import time
 import sys
-import datetime
 import importlib
 import json
+import logging
 import paho.mqtt.client as paho
 import psycopg2
 from asgiref.sync import async_to_sync
-from geopy import distance
-from aliyunsdkpush.request.v20160801 import PushRequest
-from aliyunsdkcore import client
+from channels.exceptions import ChannelFull
+from geoindex import BlackDotIndex
+from geodistance import pairwise_distances
+from dbpool import DatabasePool
+import bridgelog
+from aiobridge import AsyncBridge, OVERFLOW_POLICIES, OVERFLOW_DROP_OLDEST
+from fanout import PositionFanout
+from snapshot import PositionSnapshot
+from vehiclestate import VehicleStateStore
+from trackstore import TrackBuffer
+from notificationcounts import COUNTS_KEY, INCREMENT_SCRIPT
+from subscriptions import SubscriptionIndex, POSITION_GROUP
+from sharding import ShardDispatcher, shard_of
+from invalidation import (
+    InvalidationSubscriber, PendingInvalidations, INVALIDATION_RESET,
+    INVALIDATION_STATION, INVALIDATION_JOB, INVALIDATION_VEHICLE
+)
 
 
 r = redis.StrictRedis(host='localhost', port=6379, db=15)
+logger = logging.getLogger('mqtt.position')
+
+# unread notification counters of django, see notificationcounts.py
+increment_notification_counts = r.register_script(INCREMENT_SCRIPT)
 
 
 class Config:
     blackdots = []
+    blackdot_index = BlackDotIndex()
     vehicles = {}
-    aliyun_client = None
-    aliyun_request = None
-    ALIYUN_MOBILE_PUSH_APP_KEY = ''
-    ALIYUN_MOBILE_PUSH_APP_SECRET = ''
-    ALIYUN_ACCESS_KEY_ID = ''
-    ALIYUN_ACCESS_KEY_SECRET = ''
+    db_pool = None
+
+    # ShardDispatcher in the bridge process of sharded mode, see sharding.py
+    dispatcher = None
+
+    # PositionFanout coalescing the monitor group positions, see fanout.py
+    fanout = None
+
+    # PositionSnapshot recording the sent positions, see snapshot.py
+    snapshot = None
+
+    # SubscriptionIndex of the viewport scoped sockets, see subscriptions.py
+    subscriptions = None
+
+    # VehicleStateStore recording the live state of vehicles, see vehiclestate.py
+    states = None
+
+    # TrackBuffer recording the vehicle tracks, see trackstore.py
+    tracks = None
+    invalidations = PendingInvalidations(
+        types=(INVALIDATION_STATION, INVALIDATION_JOB, INVALIDATION_VEHICLE)
+    )
     DB_URL = ''
     HOST = ''
     PORT = ''
@@ -41,37 +78,43 @@ class Config:
     DEBUG = False
     LOG_FILEPATH = ''
     TEST_MODE = False
+
+    # next station enter & exit events move the jobs on, off unless --fence
+    # as in asgimqtt.py which ran before the bridge
+    STATION_CHECK = False
     VEHICLE_OUT_AREA = 0
     VEHICLE_IN_AREA = 1
+    STATION_TYPE_BLACK_DOT = 5
     ENTER_STATION_EVENT = 4
     EXIT_STATION_EVENT = 5
     ENTER_BLACK_DOT_EVENT = 6
     EXIT_BLACK_DOT_EVENT = 7
 
-    # this sql is used for retrieving vehicle-driving driver&escort channel and device token
-    CHANNEL_NAME_QUERY = """
-        SELECT au.id, au.channel_name, au.device_token
-        FROM (
-            SELECT *
-            FROM vehicle_vehicleworkerbind vdb
-            WHERE get_off IS NULL
-        ) AS tmp
-        LEFT JOIN vehicle_vehicle vv ON tmp.vehicle_id = vv.id
-        LEFT JOIN account_user au ON tmp.worker_id = au.id
-        WHERE vv.plate_num='{}'
-        """
+    # vehicles being driven, i.e. driver or escort on, or under wheel
+    ACTIVE_VEHICLE_STATUS = (1, 2, 3)
+
+    # full reload of the vehicles is done periodically to catch any drift
+    # of the incrementally patched vehicles
+    RECONCILE_INTERVAL = 600
+    last_reconciled = 0
+
+    # vehicles of this shard only are loaded in the sharded mode worker
+    SHARD_INDEX = 0
+    SHARD_COUNT = 1
 
     # this sql is used for retriving job progress and next station location
+    # of the vehicles; job_filter and vehicle_filter restrict the result to
+    # the changed vehicles on incremental refresh
     VEHICLES_JOBS_QUERY = """
-        SELECT vv.plate_num, tmp.*
+        SELECT vv.plate_num, tmp.*, vv.id, vv.status
         FROM vehicle_vehicle vv
         LEFT JOIN (
             SELECT oo.is_same_station, oj.progress, oj.id, ojs.step, ist.id,
-            ist.longitude, ist.latitude, ist.radius,oj.vehicle_id
+            ist.gps_longitude, ist.gps_latitude, ist.radius,oj.vehicle_id, oj.order_id
             FROM (
                 SELECT id, order_id, vehicle_id, progress
                 FROM order_job
-                WHERE id IN ({})
+                WHERE progress > 1 {job_filter}
             ) oj
             LEFT JOIN order_order oo ON oj.order_id=oo.id
             LEFT JOIN (
@@ -83,7 +126,7 @@ class Config:
             LEFT JOIN info_station ist ON ojs.station_id=ist.id
         ) as tmp
         ON vv.id = tmp.vehicle_id
-        WHERE vv.status IN (1, 2, 3)
+        WHERE {vehicle_filter}
     """
 
     @classmethod
@@ -94,14 +137,6 @@ class Config:
                 key_value = line.split('=')
                 if key_value[0] == 'DATABASE_URL':
                     cls.DB_URL = key_value[1][:-1]
-                if key_value[0] == 'ALIYUN_MOBILE_PUSH_APP_KEY':
-                    cls.ALIYUN_MOBILE_PUSH_APP_KEY = key_value[1][:-1]
-                if key_value[0] == 'ALIYUN_MOBILE_PUSH_APP_SECRET':
-                    cls.ALIYUN_MOBILE_PUSH_APP_SECRET = key_value[1][:-1]
-                if key_value[0] == 'ALIYUN_ACCESS_KEY_ID':
-                    cls.ALIYUN_ACCESS_KEY_ID = key_value[1][:-1]
-                if key_value[0] == 'ALIYUN_ACCESS_KEY_SECRET':
-                    cls.ALIYUN_ACCESS_KEY_SECRET = key_value[1][:-1]
                 elif key_value[0] == 'G7_MQTT_HOST':
                     cls.HOST = key_value[1][:-1]
                 elif key_value[0] == 'G7_MQTT_PORT':
@@ -121,10 +156,6 @@ class Config:
 
         if Config.DEBUG:
             print('DATABASE_URL', Config.DB_URL)
-            print('ALIYUN_MOBILE_PUSH_APP_KEY', Config.ALIYUN_MOBILE_PUSH_APP_KEY)
-            print('ALIYUN_MOBILE_PUSH_APP_SECRET', Config.ALIYUN_MOBILE_PUSH_APP_SECRET)
-            print('ALIYUN_ACCESS_KEY_ID', Config.ALIYUN_ACCESS_KEY_ID)
-            print('ALIYUN_ACCESS_KEY_SECRET', Config.ALIYUN_ACCESS_KEY_SECRET)
             print('G7_MQTT_HOST', Config.HOST)
             print('G7_MQTT_PORT', Config.PORT)
             print('G7_MQTT_POSITION_TOPIC', Config.TOPIC)
@@ -133,44 +164,58 @@ class Config:
             print('G7_MQTT_POSITION_SECRET', Config.PASSWORD)
             print('G7_MQTT_QOS', Config.QOS)
 
-        if Config.LOG_FILEPATH:
-            with open(Config.LOG_FILEPATH, 'a') as f:
-                now_time = datetime.datetime.now()
-                time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f'{time_fmt} [Settings] DATABASE_URL: {Config.DB_URL}\n')
-                f.write(f'{time_fmt} [Settings] ALIYUN_MOBILE_PUSH_APP_KEY: {Config.ALIYUN_MOBILE_PUSH_APP_KEY}\n')
-                f.write(f'{time_fmt} [Settings] ALIYUN_MOBILE_PUSH_APP_SECRET: {Config.ALIYUN_MOBILE_PUSH_APP_SECRET}\n')
-                f.write(f'{time_fmt} [Settings] ALIYUN_ACCESS_KEY_ID: {Config.ALIYUN_ACCESS_KEY_ID}\n')
-                f.write(f'{time_fmt} [Settings] ALIYUN_ACCESS_KEY_SECRET: {Config.ALIYUN_ACCESS_KEY_SECRET}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_HOST: {Config.HOST}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_PORT: {Config.PORT}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_POSITION_TOPIC: {Config.TOPIC}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_POSITION_CLIENT_ID: {Config.CLIENT_ID}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_POSITION_ACCESS_ID: {Config.USERNAME}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_POSITION_SECRET: {Config.PASSWORD}\n')
-                f.write(f'{time_fmt} [Settings] G7_MQTT_QOS: {Config.QOS}\n')
+        logger.debug('[Settings]: %s', {
+            'DATABASE_URL': Config.DB_URL,
+            'G7_MQTT_HOST': Config.HOST,
+            'G7_MQTT_PORT': Config.PORT,
+            'G7_MQTT_POSITION_TOPIC': Config.TOPIC,
+            'G7_MQTT_POSITION_CLIENT_ID': Config.CLIENT_ID,
+            'G7_MQTT_QOS': Config.QOS,
+        })
 
     @classmethod
     def load_data_from_db(cls):
-        is_blackdots_updated = r.get('blackdot') == b'updated'
-        is_vehicles_updated = r.get('vehicle') == b'updated'
-        updated_jobs = r.smembers('jobs')
-        if not is_blackdots_updated and not is_vehicles_updated and not updated_jobs:
+        is_reconcile_due = time.monotonic() - cls.last_reconciled > cls.RECONCILE_INTERVAL
+
+        # invalidation messages are received on the subscriber thread,
+        # so no redis round-trip is needed when nothing has changed
+        if not cls.invalidations and not is_reconcile_due:
             return
 
+        is_blackdots_updated = is_reconcile_due
+        is_vehicles_reloaded = is_reconcile_due
+        updated_vehicle_ids = set()
+        for message in cls.invalidations.drain():
+            if message['type'] == INVALIDATION_RESET:
+                is_blackdots_updated = True
+                is_vehicles_reloaded = True
+            elif message['type'] == INVALIDATION_STATION:
+                if message['station_type'] == cls.STATION_TYPE_BLACK_DOT or\
+                   cls.blackdot_index.get(message['id']) is not None:
+                    is_blackdots_updated = True
+
+                # vehicles heading to the updated station
+                for data in cls.vehicles.values():
+                    if data['progress'] is not None and data['station_id'] == message['id']:
+                        updated_vehicle_ids.add(data['vehicle_id'])
+            elif message['type'] == INVALIDATION_JOB:
+                if message.get('vehicle') is None:
+                    is_vehicles_reloaded = True
+                else:
+                    updated_vehicle_ids.add(message['vehicle'])
+            elif message['type'] == INVALIDATION_VEHICLE:
+                updated_vehicle_ids.add(message['id'])
+
+        connection = None
         try:
-            connection = psycopg2.connect(cls.DB_URL)
+            connection = cls.db_pool.getconn()
             cursor = connection.cursor()
             if is_blackdots_updated:
                 cls.blackdots = []
                 if Config.DEBUG:
                     print('[Load Data]: Loading blackdots...')
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        f.write(f'{time_fmt} [Load Data]: Loading blackdots...\n')
+                logger.info('[Load Data]: Loading blackdots...')
 
                 cursor.execute("""
                     SELECT id, latitude, longitude, radius
@@ -186,115 +231,109 @@ class Config:
                         'radius': row[3]
                     })
 
+                cls.blackdot_index = BlackDotIndex(cls.blackdots)
+
                 if Config.DEBUG:
                     print('[Load Data]: ', cls.blackdots)
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        for blackdot in cls.blackdots:
-                            f.write(
-                                f"{time_fmt} [Blackdot]: "
-                                f"station_id: {blackdot['station_id']} "
-                                f"latitude: {blackdot['latitude']} "
-                                f"longitude: {blackdot['longitude']} "
-                                f"radius: {blackdot['radius']}\n")
-
-                r.set('blackdot', 'read')
-
-            if is_vehicles_updated or updated_jobs:
-                if Config.DEBUG:
-                    print('[Load Data]: Loading updated vehicles...')
+                if logger.isEnabledFor(logging.DEBUG):
+                    for blackdot in cls.blackdots:
+                        logger.debug('[Blackdot]: %s', blackdot)
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
+            if is_vehicles_reloaded:
+                if Config.DEBUG:
+                    print('[Load Data]: Loading all vehicles...')
 
-                        f.write(
-                            f"{time_fmt} "
-                            f'[Load Data]: Loading updated vehicles...\n')
+                logger.info('[Load Data]: Loading all vehicles...')
 
-                current_updated_jobs = []
-                for updated_job in updated_jobs:
-                    current_updated_jobs.append(
-                        updated_job.decode('utf-8')
+                cursor.execute(Config.VEHICLES_JOBS_QUERY.format(
+                    job_filter='',
+                    vehicle_filter='vv.status IN ({})'.format(
+                        ', '.join(str(status) for status in cls.ACTIVE_VEHICLE_STATUS)
                     )
-                current_updated_job_ids = ', '.join(current_updated_jobs)
-
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        f.write(
-                            f"{time_fmt} "
-                            f'[Load Data]: Loading updated jobs: {current_updated_job_ids}...\n')
-
-                if current_updated_job_ids:
-                    query_str = Config.VEHICLES_JOBS_QUERY.format(
-                        current_updated_job_ids
-                    )
-                    cursor.execute(query_str)
-                    results = cursor.fetchall()
-                    for row in results:
-                        plate_num = row[0]
-                        if plate_num not in cls.vehicles:
-                            cls.vehicles[plate_num] = {
-                                'blackdotposition': cls.VEHICLE_OUT_AREA,
-                                'stationposition': cls.VEHICLE_OUT_AREA,
-                                'is_same_station': row[1],
-                                'job_id': row[3],
-                            }
-                        cls.vehicles[plate_num]['progress'] = row[2]
-                        cls.vehicles[plate_num]['step'] = row[4]
-                        cls.vehicles[plate_num]['station_id'] = row[5]
-                        cls.vehicles[plate_num]['longitude'] = row[6]
-                        cls.vehicles[plate_num]['latitude'] = row[7]
-                        cls.vehicles[plate_num]['radius'] = row[8]
+                ))
+                cls.patch_vehicles(cursor.fetchall())
+                cls.last_reconciled = time.monotonic()
 
-                    if Config.DEBUG:
-                        print('[Load Data]: ', cls.vehicles)
-
-                    if Config.LOG_FILEPATH:
-                        with open(Config.LOG_FILEPATH, 'a') as f:
-                            now_time = datetime.datetime.now()
-                            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                            for plate_num, data in cls.vehicles.items():
-                                f.write(
-                                    f"{time_fmt} [Load Data]: "
-                                    f"{plate_num}: "
-                                    f"blackdotposition: {data['blackdotposition']} "
-                                    f"stationposition: {data['stationposition']} "
-                                    f"is_same_station: {data['is_same_station']} "
-                                    f"progress: {data['progress']} "
-                                    f"job_id: {data['job_id']} "
-                                    f"step: {data['step']} "
-                                    f"station_id: {data['station_id']} "
-                                    f"longitude: {data['longitude']} "
-                                    f"latitude: {data['latitude']} "
-                                    f"radius: {data['radius']}\n")
-
-                if is_vehicles_updated:
-                    r.set('vehicle', 'read')
-
-                for job in current_updated_jobs:
-                    r.srem('jobs', job)
+            elif updated_vehicle_ids:
+                vehicle_ids = ', '.join(str(int(vehicle_id)) for vehicle_id in updated_vehicle_ids)
+                if Config.DEBUG:
+                    print(f'[Load Data]: Loading updated vehicles: {vehicle_ids}...')
+
+                logger.info('[Load Data]: Loading updated vehicles: %s...', vehicle_ids)
+
+                cursor.execute(Config.VEHICLES_JOBS_QUERY.format(
+                    job_filter=f'AND vehicle_id IN ({vehicle_ids})',
+                    vehicle_filter=f'vv.id IN ({vehicle_ids})'
+                ))
+                cls.patch_vehicles(cursor.fetchall(), updated_vehicle_ids)
 
             cursor.close()
         except psycopg2.DatabaseError:
-            pass
+            # drained changes are not applied, reload everything next time
+            cls.invalidations({'type': INVALIDATION_RESET})
         finally:
             if connection is not None:
-                connection.close()
+                Config.db_pool.putconn(connection)
                 if Config.DEBUG:
-                    print('[Load Data]: Database connection closed.')
+                    print('[Load Data]: Database connection released.')
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        f.write(f'{time_fmt} [Load Data]: Database connection closed.\n')
+                logger.debug('[Load Data]: Database connection released.')
+
+    @classmethod
+    def owns(cls, plate_num):
+        return cls.SHARD_COUNT == 1 or shard_of(plate_num, cls.SHARD_COUNT) == cls.SHARD_INDEX
+
+    @classmethod
+    def patch_vehicles(cls, rows, vehicle_ids=None):
+        """
+        Apply VEHICLES_JOBS_QUERY rows to the vehicles in place
+
+        If vehicle_ids is None, rows are the whole active fleet and any other
+        vehicle is dropped, otherwise only the given vehicles are patched.
+        Enter & exit state is kept unless the vehicle started another job.
+        """
+        plate_nums = set()
+        for row in rows:
+            plate_num = row[0]
+            if row[12] not in cls.ACTIVE_VEHICLE_STATUS or not cls.owns(plate_num):
+                continue
+
+            plate_nums.add(plate_num)
+            if plate_num not in cls.vehicles:
+                cls.vehicles[plate_num] = {
+                    'blackdotposition': cls.VEHICLE_OUT_AREA,
+                    'blackdot_id': None,
+                    'stationposition': cls.VEHICLE_OUT_AREA,
+                    'job_id': None,
+                }
+            elif cls.vehicles[plate_num]['job_id'] != row[3]:
+                cls.vehicles[plate_num]['stationposition'] = cls.VEHICLE_OUT_AREA
+
+            current_vehicle = cls.vehicles[plate_num]
+            current_vehicle['vehicle_id'] = row[11]
+            current_vehicle['order_id'] = row[10]
+            current_vehicle['is_same_station'] = row[1]
+            current_vehicle['job_id'] = row[3]
+            current_vehicle['progress'] = row[2]
+            current_vehicle['step'] = row[4]
+            current_vehicle['station_id'] = row[5]
+            current_vehicle['longitude'] = row[6]
+            current_vehicle['latitude'] = row[7]
+            current_vehicle['radius'] = row[8]
+
+            logger.debug('[Load Data]: %s: %s', plate_num, current_vehicle)
+
+        # drop vehicles which are not driven anymore or whose plate changed
+        for plate_num, data in list(cls.vehicles.items()):
+            if plate_num in plate_nums:
+                continue
+
+            if vehicle_ids is None or data['vehicle_id'] in vehicle_ids:
+                del cls.vehicles[plate_num]
+
+        if Config.DEBUG:
+            print('[Load Data]: ', cls.vehicles)
 
 
 def get_channel_layer(channel_name):
@@ -311,188 +350,399 @@ def _on_connect(client, userdata, flags, rc):
     if Config.DEBUG:
         print('[G7]: Connected to MQTT Server')
 
-    if Config.LOG_FILEPATH:
-        with open(Config.LOG_FILEPATH, 'a') as f:
-            now_time = datetime.datetime.now()
-            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f'{time_fmt} [G7]: Connected to MQTT Server\n')
+    logger.info('[G7]: Connected to MQTT Server')
 
     client.subscribe(userdata['topic'], userdata['qos'])
 
 
-def _on_message(client, userdata, message):
+def checks_station(current_vehicle):
+    return Config.STATION_CHECK and current_vehicle['progress'] is not None
+
+
+def calculate_frame_distances(vehicles):
+    """
+    Calculate black dot and next station distances of the whole frame at once
+
+    Returns a list of (vehicle, current_vehicle, blackdot_distances, station_distance)
+    where blackdot_distances is the list of (blackdot, distance) pairs to check
+    and station_distance is None if the vehicle has no job in progress or
+    the station check is off
+    """
+    tracked = []
+    for vehicle in vehicles:
+        if not Config.TEST_MODE:
+            if int(vehicle['speed']) == 0:
+                continue
+
+        current_vehicle = Config.vehicles.get(vehicle['plateNum'])
+        if current_vehicle is None:
+            continue
+
+        # only the black dots close to the vehicle are checked, or the one
+        # the vehicle is currently in so that the exit event can be detected
+        if Config.TEST_MODE:
+            blackdots = Config.blackdots
+        elif current_vehicle['blackdotposition'] == Config.VEHICLE_IN_AREA:
+            blackdot = Config.blackdot_index.get(current_vehicle['blackdot_id'])
+            if blackdot is None:
+                # black dot was removed while the vehicle was in it
+                current_vehicle['blackdotposition'] = Config.VEHICLE_OUT_AREA
+                current_vehicle['blackdot_id'] = None
+                blackdots = Config.blackdot_index.candidates(vehicle['lat'], vehicle['lng'])
+            else:
+                blackdots = [blackdot]
+        else:
+            blackdots = Config.blackdot_index.candidates(vehicle['lat'], vehicle['lng'])
+
+        tracked.append((vehicle, current_vehicle, blackdots))
+
+    if Config.TEST_MODE:
+        # in test mode distances are controlled from redis
+        blackdot_delta_distance = None
+        station_delta_distance = None
+        for vehicle, current_vehicle, blackdots in tracked:
+            try:
+                if blackdots and blackdot_delta_distance is None:
+                    key = 'blackdot_delta_distance'
+                    blackdot_delta_distance = int(r.get(key).decode('utf-8'))
+
+                if checks_station(current_vehicle) and station_delta_distance is None:
+                    key = 'station_delta_distance'
+                    station_delta_distance = int(r.get(key).decode('utf-8'))
+            except Exception:
+                print(f'[Error]: Check redis "{key}" key')
+                return None
+
+        return [
+            (
+                vehicle, current_vehicle,
+                [(blackdot, blackdot_delta_distance) for blackdot in blackdots],
+                station_delta_distance if checks_station(current_vehicle) else None
+            )
+            for vehicle, current_vehicle, blackdots in tracked
+        ]
+
+    # build one (position, target) pair list for the whole frame
+    lats, lngs, target_lats, target_lngs = [], [], [], []
+    for vehicle, current_vehicle, blackdots in tracked:
+        for blackdot in blackdots:
+            lats.append(vehicle['lat'])
+            lngs.append(vehicle['lng'])
+            target_lats.append(blackdot['latitude'])
+            target_lngs.append(blackdot['longitude'])
+
+        if checks_station(current_vehicle):
+            lats.append(vehicle['lat'])
+            lngs.append(vehicle['lng'])
+            target_lats.append(current_vehicle['latitude'])
+            target_lngs.append(current_vehicle['longitude'])
+
+    distances = pairwise_distances(lats, lngs, target_lats, target_lngs).tolist()
+
+    ret = []
+    k = 0
+    for vehicle, current_vehicle, blackdots in tracked:
+        blackdot_distances = list(zip(blackdots, distances[k:k + len(blackdots)]))
+        k += len(blackdots)
+        station_distance = None
+        if checks_station(current_vehicle):
+            station_distance = distances[k]
+            k += 1
+
+        ret.append((vehicle, current_vehicle, blackdot_distances, station_distance))
+
+    return ret
+
+
+def decode_position_frame(payload):
+    """
+    Return the vehicles of G7 position message, or None if there is no data
+    """
     if Config.DEBUG:
         print('[G7]: Received message')
 
-    response = json.loads(message.payload.decode('utf-8'))
+    response = json.loads(payload.decode('utf-8'))
     vehicles = response.get('data', None)
 
     if Config.DEBUG:
         print('[G7]: ', vehicles)
 
-    if Config.LOG_FILEPATH:
-        with open(Config.LOG_FILEPATH, 'a') as f:
-            now_time = datetime.datetime.now()
-            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"{time_fmt} [G7]: Received message: {message.payload.decode('utf-8')}\n")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('[G7]: Received message: %s', payload.decode('utf-8'))
+
+    return vehicles
+
+
+def get_positions(vehicles):
+    return [
+        {
+            'plateNum': vehicle['plateNum'],
+            'lnglat': [vehicle['lng'], vehicle['lat']],
+            'speed': vehicle['speed']
+        }
+        for vehicle in vehicles
+    ]
 
-    if vehicles is None:
-        return
 
-    positions = []
+def moving_positions(positions):
+    return [position for position in positions if float(position['speed']) > 0]
+
+
+def position_message(positions):
+    return {
+        'type': 'notify_monitor',
+        'notification_type': 'position',
+        'data': positions
+    }
+
+
+def monitor_message(positions):
+    """
+    Message to send to the monitor group for the positions of the frame, or
+    None; only moving vehicles are sent but the snapshot records all of them
+    """
+    if Config.fanout is not None:
+        message = Config.fanout.add(positions)
+    else:
+        moving = moving_positions(positions)
+        message = position_message(moving) if len(moving) else None
+
+    if Config.snapshot is not None:
+        message = Config.snapshot.publish(message, positions)
+
+    return message
+
+
+def order_positions(vehicles):
+    """
+    Positions of the frame by order group of the vehicles' jobs in progress
+    """
+    orders = {}
     for vehicle in vehicles:
-        if int(vehicle['speed']) == 0:
+        current_vehicle = Config.vehicles.get(vehicle['plateNum'])
+        if current_vehicle is None or current_vehicle.get('order_id') is None:
             continue
 
-        positions.append({
+        orders.setdefault(f"order-{current_vehicle['order_id']}", []).append({
             'plateNum': vehicle['plateNum'],
             'lnglat': [vehicle['lng'], vehicle['lat']],
             'speed': vehicle['speed']
         })
 
-    if len(positions):
+    return orders
+
+
+async def send_order_positions(orders):
+    for group, positions in orders.items():
+        await channel_layer.group_send(group, {
+            'type': 'notify_order',
+            'data': positions
+        })
+
+
+def merge_position_frames(old_vehicles, new_vehicles):
+    """
+    Merge two frames keeping the latest position of every vehicle
+    """
+    vehicles = {vehicle['plateNum']: vehicle for vehicle in old_vehicles or []}
+    for vehicle in new_vehicles or []:
+        vehicles[vehicle['plateNum']] = vehicle
+
+    return list(vehicles.values())
+
+
+async def send_monitor_message(message):
+    """
+    Send the positions to the sockets without subscription and to every
+    subscribed socket the positions of its subscription
+    """
+    await channel_layer.group_send(POSITION_GROUP, message)
+    if Config.subscriptions is None:
+        return
+
+    # redis calls are blocking, keep them off the event loop
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, Config.subscriptions.refresh, r)
+    except redis.RedisError as e:
+        logger.warning('[Subscription]: %s', e)
+
+    for channel_name, positions in Config.subscriptions.match(message['data']).items():
+        try:
+            await channel_layer.send(channel_name, dict(message, data=positions))
+        except ChannelFull:
+            # nobody reads the channel anymore
+            logger.info('[Subscription]: %s expired', channel_name)
+            try:
+                await loop.run_in_executor(None, Config.subscriptions.expire, r, channel_name)
+            except redis.RedisError as e:
+                logger.warning('[Subscription]: %s', e)
+
+
+def record_vehicle_states(vehicles):
+    if Config.states is not None:
+        Config.states.update(vehicles)
+
+
+def record_positions(vehicles):
+    """
+    Record the vehicle states & snapshot of the frame, return the message to
+    send to the monitor group or None
+    """
+    record_vehicle_states(vehicles)
+    return monitor_message(get_positions(vehicles))
+
+
+async def fan_out_positions(vehicles):
+    # states & snapshot are recorded with blocking redis calls
+    message = await asyncio.get_event_loop().run_in_executor(None, record_positions, vehicles)
+    if message is not None:
+        await send_monitor_message(message)
+
+
+def report_bridge_metrics(metrics):
+    if Config.DEBUG:
+        print('[Bridge]: ', metrics)
+
+    logger.info('[Bridge]: metrics', extra=metrics)
+
+
+def _on_message(client, userdata, message):
+    handle_message(message.payload)
+
+
+def handle_message(payload):
+    vehicles = decode_position_frame(payload)
+    if vehicles is None:
+        return
+
+    message = record_positions(vehicles)
+    if message is not None:
         # send current vehicle position to position consumer
         # in order to display on frontend
-        async_to_sync(channel_layer.group_send)(
-            'monitor',
-            {
-                'type': 'notify_monitor',
-                'notification_type': 'position',
-                'data': positions
-            }
-        )
+        async_to_sync(send_monitor_message)(message)
+
+    if Config.dispatcher is not None:
+        Config.dispatcher.dispatch(vehicles)
+    else:
+        process_geofences(vehicles)
+
+
+def count_unread_notification(user_id):
+    try:
+        increment_notification_counts(keys=[COUNTS_KEY.format(user_id)], args=[1, 0])
+    except redis.RedisError as e:
+        logger.warning('[Notification]: %s', e)
+
+
+def record_tracks(vehicles, flush=False):
+    if Config.tracks is None:
+        return
 
+    Config.tracks.add(vehicles)
+    if flush or Config.tracks.is_due():
+        Config.tracks.flush(Config.db_pool)
+
+
+def process_geofences(vehicles):
+    """
+    Check black dot and next station enter & exit events of the frame
+    """
     Config.load_data_from_db()
+    record_tracks(vehicles)
+
+    # customers track the vehicles of their orders
+    orders = order_positions(vehicles)
+    if orders:
+        async_to_sync(send_order_positions)(orders)
 
     # area enter & exit event
-    for vehicle in vehicles:
-        if not Config.TEST_MODE:
-            if int(vehicle['speed']) == 0:
-                continue
+    frame = calculate_frame_distances(vehicles)
+    if frame is None:
+        return
 
+    for vehicle, current_vehicle, blackdot_distances, station_distance in frame:
         plate_num = vehicle['plateNum']
 
-        if plate_num not in Config.vehicles:
-            continue
-
-        current_vehicle = Config.vehicles[plate_num]
-
-        vehicle_pos = (vehicle['lat'], vehicle['lng'])
         if Config.DEBUG:
             print('[GeoPy]: Current {} Position - ({}, {})'.format(
                 plate_num, vehicle['lat'], vehicle['lng']
             ))
 
-        if Config.LOG_FILEPATH:
-            with open(Config.LOG_FILEPATH, 'a') as f:
-                now_time = datetime.datetime.now()
-                time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                f.write(
-                    f"{time_fmt} [GeoPy]: Current {plate_num} Position - ({vehicle['lat']}, {vehicle['lng']})\n"
-                )
+        logger.debug('[GeoPy]: Current %s Position - (%s, %s)', plate_num, vehicle['lat'], vehicle['lng'])
 
         # check if the vehicle enter or exit black dot
-        for blackdot in Config.blackdots:
-            blackdot_pos = (blackdot['latitude'], blackdot['longitude'])
+        for blackdot, delta_distance in blackdot_distances:
             enter_exit_event = 0
 
-            if Config.TEST_MODE:
-                try:
-                    delta_distance = int(
-                        r.get('blackdot_delta_distance').decode('utf-8')
-                    )
-                except Exception:
-                    print('[Error]: Check redis "blackdot_delta_distance" key')
-                    return
-
-            else:
-                delta_distance = distance.distance(vehicle_pos, blackdot_pos).m
-
             if Config.DEBUG:
                 print('[GeoPy]: Distance with ({}, {}) is {}'.format(
                     blackdot['latitude'], blackdot['longitude'],
                     delta_distance
                 ))
 
-            if Config.LOG_FILEPATH:
-                with open(Config.LOG_FILEPATH, 'a') as f:
-                    now_time = datetime.datetime.now()
-                    time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                    f.write(f"{time_fmt} [GeoPy]: Current {plate_num} "
-                            f"Position - ({vehicle['lat']}, {vehicle['lng']})\n")
+            logger.debug(
+                '[GeoPy]: Distance with (%s, %s) is %s',
+                blackdot['latitude'], blackdot['longitude'], delta_distance
+            )
 
             if delta_distance < blackdot['radius'] and current_vehicle['blackdotposition'] == Config.VEHICLE_OUT_AREA:
                 current_vehicle['blackdotposition'] = Config.VEHICLE_IN_AREA
+                current_vehicle['blackdot_id'] = blackdot['station_id']
                 enter_exit_event = Config.ENTER_BLACK_DOT_EVENT
                 if Config.DEBUG:
                     print('[GeoPy]: {} enter into ({}, {})'.format(
                         plate_num, blackdot['latitude'], blackdot['longitude']
                     ))
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        f.write(f"{time_fmt} [GeoPy]: {plate_num} "
-                                f"enter into ({blackdot['latitude']}, {blackdot['longitude']})\n")
+                logger.info(
+                    '[GeoPy]: %s enter into (%s, %s)', plate_num, blackdot['latitude'], blackdot['longitude'],
+                    extra={'event': 'enter_blackdot', 'plate_num': plate_num, 'station_id': blackdot['station_id']}
+                )
 
-            if delta_distance > blackdot['radius'] and current_vehicle['blackdotposition'] == Config.VEHICLE_IN_AREA:
+            if delta_distance > blackdot['radius'] and current_vehicle['blackdotposition'] == Config.VEHICLE_IN_AREA and\
+               current_vehicle['blackdot_id'] == blackdot['station_id']:
                 current_vehicle['blackdotposition'] = Config.VEHICLE_OUT_AREA
+                current_vehicle['blackdot_id'] = None
                 enter_exit_event = Config.EXIT_BLACK_DOT_EVENT
                 if Config.DEBUG:
                     print('[G7]: {} exit from ({}, {})'.format(
                         plate_num, blackdot['latitude'], blackdot['longitude']
                     ))
 
-                if Config.LOG_FILEPATH:
-                    with open(Config.LOG_FILEPATH, 'a') as f:
-                        now_time = datetime.datetime.now()
-                        time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                        f.write(f"{time_fmt} [GeoPy]: {plate_num} "
-                                f"exit from ({blackdot['latitude']}, {blackdot['longitude']})\n")
+                logger.info(
+                    '[GeoPy]: %s exit from (%s, %s)', plate_num, blackdot['latitude'], blackdot['longitude'],
+                    extra={'event': 'exit_blackdot', 'plate_num': plate_num, 'station_id': blackdot['station_id']}
+                )
 
             if enter_exit_event:
+                connection = None
                 try:
-                    connection = psycopg2.connect(Config.DB_URL)
+                    connection = Config.db_pool.getconn()
                     cursor = connection.cursor()
-                    cursor.execute(
-                        Config.CHANNEL_NAME_QUERY.format(plate_num)
-                    )
+                    Config.db_pool.execute(cursor, 'workers', (plate_num, ))
                     results = cursor.fetchall()
                     if len(results) == 0:
                         if Config.DEBUG:
                             print('[Error]: Vehicle and user not bind')
 
-                        if Config.LOG_FILEPATH:
-                            with open(Config.LOG_FILEPATH, 'a') as f:
-                                now_time = datetime.datetime.now()
-                                time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                                f.write(f"{time_fmt} [Error]: vehicle and user not bind\n")
+                        logger.warning('[Error]: vehicle and user not bind', extra={'plate_num': plate_num})
                         continue
 
                     # load black dot message
-                    cursor.execute("""
-                    SELECT notification_message
-                    FROM info_station WHERE id={}
-                    """.format(blackdot['station_id']))
+                    Config.db_pool.execute(cursor, 'station_notification_message', (blackdot['station_id'], ))
                     notification_message = cursor.fetchone()[0]
                     message = {
                         'notification': notification_message
                     }
 
+                    title = 'In Blackdot' if enter_exit_event == Config.ENTER_BLACK_DOT_EVENT else 'Out Black dot'
                     for result in results:
                         worker_id = result[0]
-                        channel_name = result[1]
-                        device_token = result[2]
-
-                        cursor.execute("""
-                        INSERT INTO notification_notification
-                            (msg_type, message, user_id, is_read, is_deleted, sent_on)
-                        VALUES ('{}', '{}', '{}', False, False, now()) RETURNING sent_on;
-                        """.format(
-                            enter_exit_event, json.dumps(message), worker_id
-                        ))
-                        connection.commit()
+
+                        Config.db_pool.execute(
+                            cursor, 'insert_notification', (enter_exit_event, json.dumps(message), worker_id)
+                        )
                         sent_on = cursor.fetchone()[0]
                         data = {
                             'msg_type': enter_exit_event,
@@ -501,62 +751,35 @@ def _on_message(client, userdata, message):
                             'sent_on': sent_on.strftime('%Y-%m-%d %H:%M')
                         }
 
-                        if channel_name:
-                            async_to_sync(channel_layer.send)(
-                                channel_name,
-                                {
-                                    'type': 'notify',
-                                    'data': data
-                                }
-                            )
-
-                        if device_token:
-                            title = 'In Blackdot' if Config.ENTER_STATION_EVENT else 'Out Black dot'
-                            body = 'In Blackdot' if Config.ENTER_STATION_EVENT else 'Out Black dot'
-                            Config.aliyun_request.set_Title(title)
-                            Config.aliyun_request.set_Body(body)
-                            Config.aliyun_request.set_TargetValue(device_token)
-                            Config.aliyun_client.do_action(Config.aliyun_request)
+                        # sent to the worker's sockets and device by the
+                        # notification outbox dispatcher
+                        Config.db_pool.execute(
+                            cursor, 'enqueue_notification', (worker_id, json.dumps(data), title, title)
+                        )
+                        connection.commit()
+                        count_unread_notification(worker_id)
 
                     cursor.close()
                 except psycopg2.DatabaseError:
                     pass
                 finally:
                     if connection is not None:
-                        connection.close()
+                        Config.db_pool.putconn(connection)
                         if Config.DEBUG:
                             print(
-                                '[Enter & Exit]: Database connection closed.'
+                                '[Enter & Exit]: Database connection released.'
                             )
 
-                        if Config.LOG_FILEPATH:
-                            with open(Config.LOG_FILEPATH, 'a') as f:
-                                now_time = datetime.datetime.now()
-                                time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                                f.write("[Enter & Exit]: Database connection closed.\n")
+                        logger.debug('[Enter & Exit]: Database connection released.')
 
         # check if the vehicle enter or exit next station
-        if current_vehicle['progress'] is None:
-            return
+        if station_distance is None:
+            continue
 
-        next_station_pos = (
-            current_vehicle['latitude'],
-            current_vehicle['longitude']
-        )
         next_station_radius = current_vehicle['radius']
+        delta_distance = station_distance
         enter_exit_event = 0
 
-        if Config.TEST_MODE:
-            try:
-                delta_distance = int(
-                    r.get('station_delta_distance').decode('utf-8')
-                )
-            except Exception:
-                print('[Error]: Check redis "station_delta_distance" key')
-                return
-        else:
-            delta_distance = distance.distance(vehicle_pos, next_station_pos).m
-
         if Config.DEBUG:
             print('[GeoPy]: Distance with ({}, {}) is {}'.format(
                 current_vehicle['latitude'],
@@ -564,12 +787,10 @@ def _on_message(client, userdata, message):
                 delta_distance
             ))
 
-        if Config.LOG_FILEPATH:
-            with open(Config.LOG_FILEPATH, 'a') as f:
-                now_time = datetime.datetime.now()
-                time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f"[GeoPy]: Distance with ({current_vehicle['latitude']}, {current_vehicle['longitude']})"
-                        f" is {delta_distance}\n")
+        logger.debug(
+            '[GeoPy]: Distance with (%s, %s) is %s',
+            current_vehicle['latitude'], current_vehicle['longitude'], delta_distance
+        )
 
         if delta_distance < next_station_radius and \
            current_vehicle['stationposition'] == Config.VEHICLE_OUT_AREA:
@@ -581,12 +802,11 @@ def _on_message(client, userdata, message):
                     current_vehicle['longitude']
                 ))
 
-            if Config.LOG_FILEPATH:
-                with open(Config.LOG_FILEPATH, 'a') as f:
-                    now_time = datetime.datetime.now()
-                    time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                    f.write(f"[GeoPy]: {plate_num} enter into "
-                            f"({current_vehicle['latitude']}, {current_vehicle['longitude']})\n")
+            logger.info(
+                '[GeoPy]: %s enter into (%s, %s)',
+                plate_num, current_vehicle['latitude'], current_vehicle['longitude'],
+                extra={'event': 'enter_station', 'plate_num': plate_num, 'station_id': current_vehicle['station_id']}
+            )
 
         if delta_distance > next_station_radius and \
            current_vehicle['stationposition'] == Config.VEHICLE_IN_AREA:
@@ -598,22 +818,20 @@ def _on_message(client, userdata, message):
                     current_vehicle['longitude']
                 ))
 
-            if Config.LOG_FILEPATH:
-                with open(Config.LOG_FILEPATH, 'a') as f:
-                    now_time = datetime.datetime.now()
-                    time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                    f.write(f"[GeoPy]: {plate_num} exit from "
-                            f"({current_vehicle['latitude']}, {current_vehicle['longitude']})\n")
+            logger.info(
+                '[GeoPy]: %s exit from (%s, %s)',
+                plate_num, current_vehicle['latitude'], current_vehicle['longitude'],
+                extra={'event': 'exit_station', 'plate_num': plate_num, 'station_id': current_vehicle['station_id']}
+            )
 
         if enter_exit_event:
+            connection = None
             try:
-                connection = psycopg2.connect(Config.DB_URL)
+                connection = Config.db_pool.getconn()
                 cursor = connection.cursor()
 
                 # Get the current job progress
-                cursor.execute("""
-                SELECT progress FROM order_job WHERE id={}
-                """.format(current_vehicle['job_id']))
+                Config.db_pool.execute(cursor, 'job_progress', (current_vehicle['job_id'], ))
                 current_progress = cursor.fetchone()[0]
                 step = current_vehicle['step']
                 job_id = current_vehicle['job_id']
@@ -631,26 +849,14 @@ def _on_message(client, userdata, message):
                     if Config.DEBUG:
                         print("Driver didn't update the progress")
 
-                    if Config.LOG_FILEPATH:
-                        with open(Config.LOG_FILEPATH, 'a') as f:
-                            now_time = datetime.datetime.now()
-                            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                            f.write(f"{time_fmt} Driver didn't update the progress\n")
+                    logger.info("Driver didn't update the progress", extra={'plate_num': plate_num, 'job_id': job_id})
 
                     if enter_exit_event == Config.ENTER_STATION_EVENT:
                         # update jobstation model
-                        cursor.execute("""
-                        UPDATE order_jobstation
-                        SET arrived_station_on=now()
-                        WHERE job_id={} AND step={}
-                        """.format(job_id, step))
+                        Config.db_pool.execute(cursor, 'arrive_job_station', (job_id, step))
 
                         # update job progress
-                        cursor.execute("""
-                        UPDATE order_job
-                        SET progress={}
-                        WHERE id={}
-                        """.format(expected_progress, job_id))
+                        Config.db_pool.execute(cursor, 'update_job_progress', (job_id, expected_progress))
                         current_vehicle['progress'] = expected_progress
                         connection.commit()
                     elif enter_exit_event == Config.EXIT_STATION_EVENT:
@@ -658,45 +864,22 @@ def _on_message(client, userdata, message):
                         if quality_station_exit:
                             next_step = 2
 
-                        cursor.execute("""
-                        SELECT step, station_id
-                        FROM order_jobstation
-                        WHERE job_id={} and step={} and is_completed=False
-                        """.format(job_id, next_step))
+                        Config.db_pool.execute(cursor, 'next_job_station', (job_id, next_step))
                         result = cursor.fetchone()
 
                         # update job station model
-                        cursor.execute("""
-                        UPDATE order_jobstation
-                        SET departure_station_on=now(),
-                            is_completed=True
-                        WHERE job_id={} AND step={}
-                        """.format(job_id, step))
+                        Config.db_pool.execute(cursor, 'depart_job_station', (job_id, step))
 
                         if quality_station_exit:
-                            cursor.execute("""
-                            UPDATE order_jobstation
-                            SET departure_station_on=now(),
-                                is_completed=True
-                            WHERE job_id={} AND step={}
-                            """.format(job_id, step))
-                            cursor.execute("""
-                            UPDATE order_jobstation
-                            SET departure_station_on=now(),
-                                is_completed=True
-                            WHERE job_id={} AND step={}
-                            """.format(job_id, step+1))
+                            Config.db_pool.execute(cursor, 'depart_job_station', (job_id, step))
+                            Config.db_pool.execute(cursor, 'depart_job_station', (job_id, step + 1))
 
                         if result is None:
-                            cursor.execute("""
-                            UPDATE order_job
-                            SET progress=0,
-                                finished_on=now()
-                            WHERE id={}
-                            """.format(job_id))
+                            Config.db_pool.execute(cursor, 'finish_job', (job_id, ))
                             current_vehicle['is_same_station'] = None
                             current_vehicle['progress'] = None
                             current_vehicle['job_id'] = None
+                            current_vehicle['order_id'] = None
                             current_vehicle['step'] = None
                             current_vehicle['longitude'] = None
                             current_vehicle['latitude'] = None
@@ -705,17 +888,8 @@ def _on_message(client, userdata, message):
                             next_step = result[0]
                             next_station_id = result[1]
 
-                            cursor.execute("""
-                            UPDATE order_job
-                            SET progress={}
-                            WHERE id={};
-                            """.format(expected_progress, job_id))
-
-                            cursor.execute("""
-                            SELECT id, longitude, latitude, radius
-                            FROM info_station
-                            WHERE id={}
-                            """.format(next_station_id))
+                            Config.db_pool.execute(cursor, 'update_job_progress', (job_id, expected_progress))
+                            Config.db_pool.execute(cursor, 'station', (next_station_id, ))
 
                             station_info = cursor.fetchone()
                             current_vehicle['progress'] = expected_progress
@@ -727,97 +901,90 @@ def _on_message(client, userdata, message):
 
                         connection.commit()
 
-                cursor.execute(
-                    Config.CHANNEL_NAME_QUERY.format(plate_num)
-                )
+                Config.db_pool.execute(cursor, 'workers', (plate_num, ))
                 results = cursor.fetchall()
                 if len(results) == 0:
                     if Config.DEBUG:
                         print('[Error]: Vehicle and user not bind')
 
-                    if Config.LOG_FILEPATH:
-                        with open(Config.LOG_FILEPATH, 'a') as f:
-                            now_time = datetime.datetime.now()
-                            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                            f.write(f"{time_fmt} [Error]: vehicle and user not bind\n")
+                    logger.warning('[Error]: vehicle and user not bind', extra={'plate_num': plate_num})
                     continue
 
                 # Get Station address
-                cursor.execute("""
-                SELECT address
-                FROM info_station WHERE id={}
-                """.format(station_id))
+                Config.db_pool.execute(cursor, 'station_address', (station_id, ))
 
                 notification_message = cursor.fetchone()[0]
                 message = {
                     'notification': notification_message
                 }
 
+                title = 'In Station' if enter_exit_event == Config.ENTER_STATION_EVENT else 'Out Station'
                 for result in results:
                     worker_id = result[0]
-                    channel_name = result[1]
-                    device_token = result[2]
-
-                    cursor.execute("""
-                    INSERT INTO notification_notification
-                        (msg_type, message, user_id, is_read, is_deleted, sent_on)
-                    VALUES ('{}', '{}', '{}', False, False, now()) RETURNING sent_on;
-                    """.format(
-                        enter_exit_event, json.dumps(message), worker_id
-                    ))
-                    connection.commit()
 
-                    if channel_name:
-                        sent_on = cursor.fetchone()[0]
-                        data = {
-                            'msg_type': enter_exit_event,
-                            'message': message,
-                            'is_read': False,
-                            'sent_on': sent_on.strftime('%Y-%m-%d %H:%M')
-                        }
-                        async_to_sync(channel_layer.send)(
-                            channel_name,
-                            {
-                                'type': 'notify',
-                                'data': data
-                            }
-                        )
+                    Config.db_pool.execute(
+                        cursor, 'insert_notification', (enter_exit_event, json.dumps(message), worker_id)
+                    )
+                    sent_on = cursor.fetchone()[0]
+                    data = {
+                        'msg_type': enter_exit_event,
+                        'message': message,
+                        'is_read': False,
+                        'sent_on': sent_on.strftime('%Y-%m-%d %H:%M')
+                    }
 
-                    if device_token:
-                        title = 'In Station' if Config.ENTER_STATION_EVENT else 'Out Station'
-                        body = 'In Station' if Config.ENTER_STATION_EVENT else 'Out Station'
-                        Config.aliyun_request.set_Title(title)
-                        Config.aliyun_request.set_Body(body)
-                        Config.aliyun_request.set_TargetValue(device_token)
-                        Config.aliyun_client.do_action(Config.aliyun_request)
+                    # sent to the worker's sockets and device by the
+                    # notification outbox dispatcher
+                    Config.db_pool.execute(
+                        cursor, 'enqueue_notification', (worker_id, json.dumps(data), title, title)
+                    )
+                    connection.commit()
+                    count_unread_notification(worker_id)
 
                 cursor.close()
             except psycopg2.DatabaseError:
                 pass
             finally:
                 if connection is not None:
-                    connection.close()
+                    Config.db_pool.putconn(connection)
                     if Config.DEBUG:
                         print(
-                            '[Enter & Exit]: Database connection closed.'
+                            '[Enter & Exit]: Database connection released.'
                         )
 
-                    if Config.LOG_FILEPATH:
-                        with open(Config.LOG_FILEPATH, 'a') as f:
-                            now_time = datetime.datetime.now()
-                            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-                            f.write(f"{time_fmt} [Enter & Exit]: Database connection closed.\n")
+                    logger.debug('[Enter & Exit]: Database connection released.')
 
 
 def _on_disconnect(client, userdata, rc):
     if Config.DEBUG:
         print('[G7]: Disconnected')
 
-    if Config.LOG_FILEPATH:
-        with open(Config.LOG_FILEPATH, 'a') as f:
-            now_time = datetime.datetime.now()
-            time_fmt = now_time.strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"{time_fmt} [G7]: Disconnected\n")
+    logger.info('[G7]: Disconnected')
+
+
+def setup(layer, db_pool, subscriber):
+    """
+    Prepare position handling on the given channel layer, db pool and
+    invalidation subscriber; read_env() must be called before
+    """
+    global channel_layer
+    channel_layer = layer
+
+    Config.db_pool = db_pool
+    Config.tracks = TrackBuffer(debug=Config.DEBUG)
+    subscriber.add_listener(Config.invalidations)
+    Config.load_data_from_db()
+
+
+def setup_sharded(layer, shards, options, queue_size=100):
+    """
+    Prepare sharded mode, geofences are processed by the shard workers
+    """
+    global channel_layer
+    channel_layer = layer
+
+    Config.dispatcher = ShardDispatcher(shards, options, queue_size=queue_size, debug=Config.DEBUG)
+    Config.dispatcher.start()
 
 
 class ASGIMQTTClient(object):
@@ -840,11 +1007,14 @@ class ASGIMQTTClient(object):
         self.username = username
         self.password = password
 
-    def run(self):
+    def connect(self):
         if self.username:
             self.client.username_pw_set(self.username, self.password)
 
         self.client.connect(self.host, self.port, keepalive=60)
+
+    def run(self):
+        self.connect()
         self.client.loop_forever()
 
 
@@ -860,10 +1030,43 @@ if __name__ == '__main__':
     ap.add_argument(
         '-l', '--log', help='Specify log file path',
     )
+    bridgelog.add_arguments(ap)
     ap.add_argument(
         '-t', '--test', help='Set test mode',
         action='store_true'
     )
+    ap.add_argument(
+        '-f', '--fence', help='Set fence mode, check the next station enter & exit',
+        action='store_true'
+    )
+    ap.add_argument(
+        '--mode', help='sync runs everything on the mqtt network thread, '
+        'async only enqueues messages there', choices=('sync', 'async'), default='sync'
+    )
+    ap.add_argument(
+        '--queue-size', help='Max queued messages in async mode', type=int, default=100
+    )
+    ap.add_argument(
+        '--workers', help='Number of async workers', type=int, default=4
+    )
+    ap.add_argument(
+        '--overflow', help='What to do when the queue is full in async mode',
+        choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP_OLDEST
+    )
+    ap.add_argument(
+        '--metrics-interval', help='Seconds between async mode metrics reports', type=int, default=60
+    )
+    ap.add_argument(
+        '--fanout-window', help='Seconds to coalesce monitor positions over, 0 sends every frame',
+        type=float, default=1.0
+    )
+    ap.add_argument(
+        '--fanout-threshold', help='Meters a vehicle must move to be sent again', type=float, default=10
+    )
+    ap.add_argument(
+        '--shards', help='Number of geofence worker processes, plate numbers are hashed to them',
+        type=int, default=1
+    )
     ap.add_argument(
         'channel_layer', help='ASGI channel layer instance'
     )
@@ -874,22 +1077,44 @@ if __name__ == '__main__':
     Config.DEBUG = args.debug
     Config.LOG_FILEPATH = args.log
     Config.TEST_MODE = args.test
+    Config.STATION_CHECK = args.fence
+    bridgelog.configure_from_args(args)
     Config.read_env(args.settings)
-    Config.load_data_from_db()
-
-    Config.aliyun_client = client.AcsClient(
-        Config.ALIYUN_ACCESS_KEY_ID,
-        Config.ALIYUN_ACCESS_KEY_SECRET,
-        'cn-hangzhou'
-    )
-    Config.aliyun_request = PushRequest.PushRequest()
-    Config.aliyun_request.set_AppKey(Config.ALIYUN_MOBILE_PUSH_APP_KEY)
-    Config.aliyun_request.set_Target('ALL')
-    Config.aliyun_request.set_DeviceType('ANDROID')
-    Config.aliyun_request.set_PushType('NOTICE')
+    if args.fanout_window > 0:
+        Config.fanout = PositionFanout(window=args.fanout_window, threshold=args.fanout_threshold)
+    Config.snapshot = PositionSnapshot(r, debug=Config.DEBUG)
+    Config.subscriptions = SubscriptionIndex()
+    Config.states = VehicleStateStore(r, debug=Config.DEBUG)
+
+    if args.shards > 1:
+        setup_sharded(channel_layer, args.shards, vars(args), queue_size=args.queue_size)
+    else:
+        subscriber = InvalidationSubscriber(r, debug=Config.DEBUG)
+        setup(channel_layer, DatabasePool(Config.DB_URL), subscriber)
+        subscriber.start()
 
     asgi_client = ASGIMQTTClient(
         Config.HOST, Config.PORT, Config.CLIENT_ID, Config.USERNAME,
         Config.PASSWORD, Config.TOPIC, Config.QOS, channel_layer
     )
-    asgi_client.run()
+
+    if args.mode == 'async':
+        bridge = AsyncBridge(
+            decode_position_frame, fan_out_positions,
+            Config.dispatcher.dispatch if Config.dispatcher is not None else process_geofences,
+            merge=merge_position_frames, workers=args.workers, queue_size=args.queue_size,
+            overflow=args.overflow, metrics_interval=args.metrics_interval,
+            report=report_bridge_metrics, debug=Config.DEBUG
+        )
+
+    try:
+        if args.mode == 'async':
+            asgi_client.connect()
+            bridge.run(asgi_client.client)
+        else:
+            asgi_client.run()
+    finally:
+        if Config.dispatcher is not None:
+            Config.dispatcher.stop()
+        else:
+            record_tracks([], flush=True)
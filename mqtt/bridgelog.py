@@ -0,0 +1,122 @@
+"""
+Non-blocking file logging for the MQTT bridges
+
+Bridge code logs with the standard logging module:
+
+    logger = logging.getLogger('mqtt.position')
+    logger.debug('[GeoPy]: Current %s Position - (%s, %s)', plate_num, lat, lng)
+
+configure() attaches a queue handler to the 'mqtt' logger. Records are put on
+a bounded in-memory queue and written by a background thread, so message
+handling never waits for the disk. When the queue is full the record is
+dropped and counted rather than blocking the bridge.
+
+Records are written as json lines and the file is rotated by size, or by
+time when --log-rotate-when is given. Records below --log-level are discarded
+before they are formatted, so per vehicle debug records cost nothing at the
+default INFO level.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+
+LOGGER_NAME = 'mqtt'
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 10
+LOG_QUEUE_SIZE = 10000
+
+# attributes of every LogRecord, anything else was passed with extra=
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which drops the record instead of blocking when full
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure(filepath, level='INFO', max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+              rotate_when=None, queue_size=LOG_QUEUE_SIZE):
+    """
+    Send 'mqtt' logger records to filepath through a background writer
+    """
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            filepath, when=rotate_when, backupCount=backup_count, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            filepath, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    log_queue = queue.Queue(queue_size)
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.addHandler(DroppingQueueHandler(log_queue))
+
+    return listener
+
+
+def add_arguments(ap):
+    ap.add_argument(
+        '--log-level', help='Minimum level written to the log file',
+        choices=LOG_LEVELS, default='INFO'
+    )
+    ap.add_argument(
+        '--log-max-bytes', help='Rotate the log file at this size', type=int,
+        default=LOG_MAX_BYTES
+    )
+    ap.add_argument(
+        '--log-backup-count', help='Number of rotated log files to keep', type=int,
+        default=LOG_BACKUP_COUNT
+    )
+    ap.add_argument(
+        '--log-rotate-when', help='Rotate the log file by time instead of size, e.g. midnight',
+    )
+
+
+def configure_from_args(args):
+    if args.log:
+        configure(
+            args.log, level=args.log_level, max_bytes=args.log_max_bytes,
+            backup_count=args.log_backup_count, rotate_when=args.log_rotate_when
+        )
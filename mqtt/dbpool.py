@@ -0,0 +1,204 @@
+"""
+Shared PostgreSQL connection pool for G7 MQTT bridges
+
+Connections are kept open between messages instead of connecting for every
+message. A connection which was idle for a while is health checked before it
+is handed out, and broken connections are discarded so that the next checkout
+reconnects.
+
+Fixed queries are registered in STATEMENTS and prepared once per connection:
+
+    connection = db_pool.getconn()
+    cursor = connection.cursor()
+    db_pool.execute(cursor, 'workers', (plate_num, ))
+    ...
+    db_pool.putconn(connection)
+"""
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+
+STATEMENTS = {
+    # this sql is used for retrieving vehicle-driving driver&escort
+    'workers': """
+        SELECT au.id
+        FROM (
+            SELECT *
+            FROM vehicle_vehicleworkerbind vdb
+            WHERE get_off IS NULL
+        ) AS tmp
+        LEFT JOIN vehicle_vehicle vv ON tmp.vehicle_id = vv.id
+        LEFT JOIN account_user au ON tmp.worker_id = au.id
+        WHERE vv.plate_num=$1
+    """,
+
+    # geofence enter & exit handling, see asgimqtt_v3.process_geofences
+    'station': """
+        SELECT id, gps_longitude, gps_latitude, radius
+        FROM info_station
+        WHERE id=$1
+    """,
+
+    'station_address': """
+        SELECT address
+        FROM info_station
+        WHERE id=$1
+    """,
+
+    'station_notification_message': """
+        SELECT notification_message
+        FROM info_station
+        WHERE id=$1
+    """,
+
+    'job_progress': """
+        SELECT progress
+        FROM order_job
+        WHERE id=$1
+    """,
+
+    'update_job_progress': """
+        UPDATE order_job
+        SET progress=$2
+        WHERE id=$1
+    """,
+
+    'finish_job': """
+        UPDATE order_job
+        SET progress=0, finished_on=now()
+        WHERE id=$1
+    """,
+
+    'next_job_station': """
+        SELECT step, station_id
+        FROM order_jobstation
+        WHERE job_id=$1 AND step=$2 AND is_completed=False
+    """,
+
+    'arrive_job_station': """
+        UPDATE order_jobstation
+        SET arrived_station_on=now()
+        WHERE job_id=$1 AND step=$2
+    """,
+
+    'depart_job_station': """
+        UPDATE order_jobstation
+        SET departure_station_on=now(), is_completed=True
+        WHERE job_id=$1 AND step=$2
+    """,
+
+    'insert_notification': """
+        INSERT INTO notification_notification
+            (msg_type, message, user_id, is_read, is_deleted, sent_on)
+        VALUES ($1, $2, $3, False, False, now())
+        RETURNING sent_on
+    """,
+
+    # notifications are sent to the sockets and devices by the django
+    # notification outbox dispatcher
+    'enqueue_notification': """
+        INSERT INTO notification_notificationoutbox
+            (user_id, data, push_title, push_body, created_on, attempts, last_error)
+        VALUES ($1, $2, $3, $4, now(), 0, '')
+    """,
+
+    # points of the position frames buffered by trackstore.py, one row per
+    # flush; none is added to the complete tracks got from G7
+    'append_track': """
+        INSERT INTO vehicle_vehicletrack
+            (plate_num, day, start, points, is_complete, updated_on)
+        SELECT $1::varchar, $2::date, $3::integer, $4::bytea, false, now()
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM vehicle_vehicletrack
+            WHERE plate_num=$1 AND day=$2 AND is_complete
+        )
+    """,
+}
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Connection which remembers its prepared statements and last usage
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+class DatabasePool:
+
+    def __init__(self, dsn, minconn=1, maxconn=8, health_check_interval=30,
+                 connection_factory=PooledConnection):
+        self.dsn = dsn
+        self.health_check_interval = health_check_interval
+        self.pool = ThreadedConnectionPool(
+            minconn, maxconn, dsn, connection_factory=connection_factory
+        )
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+
+        if time.monotonic() - connection.last_used < self.health_check_interval:
+            return True
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        # retry once per pooled connection in case all of them went stale,
+        # e.g. after postgres restart
+        for _ in range(self.pool.maxconn + 1):
+            connection = self.pool.getconn()
+            if self.is_healthy(connection):
+                return connection
+
+            self.pool.putconn(connection, close=True)
+
+        raise psycopg2.OperationalError('Unable to get healthy database connection')
+
+    def putconn(self, connection):
+        if connection is None:
+            return
+
+        connection.last_used = time.monotonic()
+        broken = connection.closed or \
+            connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        self.pool.putconn(connection, close=broken)
+
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+    def execute(self, cursor, name, params=()):
+        """
+        Execute prepared statement, preparing it first on this connection
+        """
+        connection = cursor.connection
+        if name not in connection.prepared:
+            cursor.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+            connection.prepared.add(name)
+
+        if params:
+            placeholders = ', '.join(['%s'] * len(params))
+            cursor.execute(f'EXECUTE {name} ({placeholders})', params)
+        else:
+            cursor.execute(f'EXECUTE {name}')
+
+    def closeall(self):
+        self.pool.closeall()
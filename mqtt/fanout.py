@@ -0,0 +1,126 @@
+"""
+Coalesced delta fan-out of vehicle positions to the monitor group
+
+Instead of sending every G7 frame with the whole fleet, frames are coalesced
+over WINDOW seconds and only moving vehicles which moved more than THRESHOLD
+meters since they were last sent go out, as a delta:
+
+    {'type': 'notify_monitor', 'notification_type': 'position',
+     'delta': True, 'data': [...changed vehicles...]}
+
+Every KEYFRAME_INTERVAL seconds the last position of every vehicle seen in
+the last STALE_AFTER seconds, stopped ones included, is sent with
+'delta': False, so that clients which missed deltas are brought up to date.
+
+PositionFanout only decides what to send; the caller sends the returned
+message, so it works the same from sync and async bridges.
+"""
+import math
+import threading
+import time
+
+
+WINDOW = 1.0
+THRESHOLD = 10
+KEYFRAME_INTERVAL = 60
+STALE_AFTER = 300
+
+# meters per degree of latitude
+METERS_PER_DEGREE = 111195
+
+
+def moved_distance(lnglat, other_lnglat):
+    """
+    Equirectangular approximation in meters, good enough for small moves
+    """
+    lng, lat = float(lnglat[0]), float(lnglat[1])
+    other_lng, other_lat = float(other_lnglat[0]), float(other_lnglat[1])
+    x = (lng - other_lng) * math.cos(math.radians((lat + other_lat) / 2))
+    y = lat - other_lat
+    return math.hypot(x, y) * METERS_PER_DEGREE
+
+
+class PositionFanout:
+
+    def __init__(self, window=WINDOW, threshold=THRESHOLD,
+                 keyframe_interval=KEYFRAME_INTERVAL, stale_after=STALE_AFTER):
+        self.window = window
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.stale_after = stale_after
+        self.pending = {}
+        self.sent = {}
+        self.seen = {}
+        self.last_flushed = 0
+        self.last_keyframe = 0
+        self.lock = threading.Lock()
+
+        # frames, vehicles received and vehicles sent, for metrics
+        self.frames = 0
+        self.received = 0
+        self.delivered = 0
+
+    def add(self, positions, now=None):
+        """
+        Add frame positions, return the message to send to monitor group or None
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.frames += 1
+            self.received += len(positions)
+            for position in positions:
+                self.pending[position['plateNum']] = position
+                self.seen[position['plateNum']] = now
+
+            if now - self.last_keyframe >= self.keyframe_interval:
+                return self._keyframe(now)
+
+            if now - self.last_flushed >= self.window:
+                return self._delta(now)
+
+        return None
+
+    def _delta(self, now):
+        changed = []
+        for plate_num, position in self.pending.items():
+            if float(position['speed']) <= 0:
+                continue
+
+            last = self.sent.get(plate_num)
+            if last is None or moved_distance(position['lnglat'], last['lnglat']) >= self.threshold:
+                changed.append(position)
+                self.sent[plate_num] = position
+
+        self.pending = {}
+        self.last_flushed = now
+        if not changed:
+            return None
+
+        self.delivered += len(changed)
+        return self._message(changed, True)
+
+    def _keyframe(self, now):
+        self.sent.update(self.pending)
+
+        # forget vehicles which stopped reporting, e.g. parked
+        for plate_num, seen_at in list(self.seen.items()):
+            if now - seen_at > self.stale_after:
+                del self.seen[plate_num]
+                self.sent.pop(plate_num, None)
+
+        self.pending = {}
+        self.last_flushed = now
+        self.last_keyframe = now
+
+        positions = list(self.sent.values())
+        self.delivered += len(positions)
+        return self._message(positions, False)
+
+    @staticmethod
+    def _message(positions, delta):
+        return {
+            'type': 'notify_monitor',
+            'notification_type': 'position',
+            'delta': delta,
+            'data': positions
+        }
@@ -0,0 +1,368 @@
+"""
+Single G7 MQTT bridge for position, stop, idle and ems topics
+
+One process subscribes to every G7 topic and routes each message by topic to
+its handler:
+ - position: asgimqtt_v3.handle_message (positions & black dot events, next
+   station events with --fence)
+ - stop, idle, ems: g7events.EventHandler
+
+G7 issues credentials per topic, so one MQTT client is connected for every
+distinct credential; topics sharing a credential share the client.
+All handlers share one db connection pool, one invalidation subscriber, one
+vehicle worker cache and one event buffer. Per topic metrics are reported
+every METRICS_INTERVAL seconds and kept in redis hash METRICS_KEY.
+
+With --mode async the position messages are only enqueued on the paho thread
+and handled by asgimqtt_v3 on an asyncio bridge thread, see aiobridge.py.
+
+    python mqtt/g7bridge.py --settings .env config.asgi:channel_layer
+"""
+import argparse
+import redis
+import signal
+import sys
+import threading
+import time
+import importlib
+import json
+import logging
+import paho.mqtt.client as paho
+import bridgelog
+from aiobridge import AsyncBridge, BridgeMetrics, OVERFLOW_POLICIES, OVERFLOW_DROP_OLDEST
+from dbpool import DatabasePool
+from g7events import EventHandler, EVENT_STOP, EVENT_IDLE, EVENT_EMS
+from ingestion import EventBuffer, VehicleWorkerCache
+from invalidation import InvalidationSubscriber
+from fanout import PositionFanout
+from snapshot import PositionSnapshot
+from vehiclestate import VehicleStateStore
+from subscriptions import SubscriptionIndex
+from replay import PayloadRecorder
+import asgimqtt_v3
+
+
+r = redis.StrictRedis(host='localhost', port=6379, db=15)
+logger = logging.getLogger('mqtt.bridge')
+
+
+class Config:
+    DB_URL = ''
+    HOST = ''
+    PORT = ''
+    QOS = ''
+    DEBUG = False
+    LOG_FILEPATH = ''
+    TOPIC_NAMES = ('position', 'stop', 'idle', 'ems')
+
+    # topic name -> G7_MQTT_<NAME>_TOPIC, _CLIENT_ID, _ACCESS_ID & _SECRET
+    TOPICS = {}
+
+    METRICS_KEY = 'g7bridge:metrics'
+    METRICS_INTERVAL = 60
+
+    @classmethod
+    def read_env(cls, filename):
+        with open(filename, 'r') as fd:
+            line = fd.readline()
+            while line:
+                key_value = line.split('=')
+                if key_value[0] == 'DATABASE_URL':
+                    cls.DB_URL = key_value[1][:-1]
+                elif key_value[0] == 'G7_MQTT_HOST':
+                    cls.HOST = key_value[1][:-1]
+                elif key_value[0] == 'G7_MQTT_PORT':
+                    cls.PORT = int(key_value[1][:-1])
+                elif key_value[0] == 'G7_MQTT_QOS':
+                    cls.QOS = int(key_value[1][:-1])
+                else:
+                    for name in cls.TOPIC_NAMES:
+                        prefix = f'G7_MQTT_{name.upper()}_'
+                        if key_value[0].startswith(prefix):
+                            topic = cls.TOPICS.setdefault(name, {})
+                            topic[key_value[0][len(prefix):]] = key_value[1][:-1]
+
+                line = fd.readline()
+
+        if Config.DEBUG:
+            print('DATABASE_URL', Config.DB_URL)
+            print('G7_MQTT_HOST', Config.HOST)
+            print('G7_MQTT_PORT', Config.PORT)
+            print('G7_MQTT_QOS', Config.QOS)
+            for name, topic in Config.TOPICS.items():
+                print(f'G7_MQTT_{name.upper()}', topic)
+
+
+def get_channel_layer(channel_name):
+    sys.path.insert(0, ".")
+    module_path, object_path = channel_name.split(":", 1)
+    channel_layer = importlib.import_module(module_path)
+    for bit in object_path.split("."):
+        channel_layer = getattr(channel_layer, bit)
+
+    return channel_layer
+
+
+def log(message, level=logging.INFO, **extra):
+    if Config.DEBUG:
+        print(message, extra) if extra else print(message)
+
+    logger.log(level, message, extra=extra)
+
+
+class G7Bridge:
+
+    def __init__(self, host, port, qos):
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.clients = {}
+        self.topics = {}
+        self.handlers = {}
+        self.metrics = {}
+
+        # PayloadRecorder, to save received payloads for replay.py
+        self.recorder = None
+
+    def add_handler(self, name, topic, client_id, username, password, handler):
+        credential = (client_id, username, password)
+        if credential not in self.clients:
+            self.topics[credential] = []
+            client = paho.Client(client_id=client_id, userdata={'topics': self.topics[credential]})
+            if username:
+                client.username_pw_set(username, password)
+            client.on_connect = self._on_connect
+            client.on_message = self._on_message
+            client.on_disconnect = self._on_disconnect
+            self.clients[credential] = client
+
+        self.topics[credential].append(topic)
+        self.handlers[topic] = (name, handler)
+        self.metrics[name] = BridgeMetrics()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        log(f"[G7]: Connected to MQTT Server, {', '.join(userdata['topics'])}")
+        client.subscribe([(topic, self.qos) for topic in userdata['topics']])
+
+    def _on_disconnect(self, client, userdata, rc):
+        log(f"[G7]: Disconnected, {', '.join(userdata['topics'])}")
+
+    def route(self, topic):
+        if topic in self.handlers:
+            return self.handlers[topic]
+
+        for subscription, route in self.handlers.items():
+            if paho.topic_matches_sub(subscription, topic):
+                return route
+
+        return None, None
+
+    def _on_message(self, client, userdata, message):
+        name, handler = self.route(message.topic)
+        if handler is None:
+            log(f'[G7]: No handler for {message.topic}', logging.WARNING)
+            return
+
+        if self.recorder is not None:
+            self.recorder(name, message.payload)
+
+        metrics = self.metrics[name]
+        metrics.received += 1
+        started = time.monotonic()
+        try:
+            handler(message.payload)
+            metrics.record_latency(time.monotonic() - started)
+        except Exception as e:
+            metrics.failed += 1
+            log(f'[Error]: {name} {e}', logging.ERROR, topic=name)
+
+    def report_metrics(self):
+        report = {}
+        for name, metrics in self.metrics.items():
+            report[name] = metrics.snapshot(0)
+            metrics.reset()
+
+        log('[Bridge]: metrics', metrics=report)
+        try:
+            r.hmset(Config.METRICS_KEY, {
+                name: json.dumps(dict(snapshot, reported=int(time.time())))
+                for name, snapshot in report.items()
+            })
+        except redis.RedisError:
+            pass
+
+    def run(self, metrics_interval=None):
+        for client in self.clients.values():
+            client.connect(self.host, self.port, keepalive=60)
+            client.loop_start()
+
+        try:
+            while True:
+                time.sleep(metrics_interval or Config.METRICS_INTERVAL)
+                self.report_metrics()
+        finally:
+            for client in self.clients.values():
+                client.disconnect()
+                client.loop_stop()
+
+
+if __name__ == '__main__':
+
+    ap = argparse.ArgumentParser(description='Multiplexed G7 MQTT bridge for our ASGI')
+    ap.add_argument(
+        '-s', '--settings', help='Location to django env file, .env'
+    )
+    ap.add_argument(
+        '-d', '--debug', help='Set debug mode', action='store_true'
+    )
+    ap.add_argument(
+        '-l', '--log', help='Specify log file path',
+    )
+    bridgelog.add_arguments(ap)
+    ap.add_argument(
+        '-t', '--test', help='Set position test mode, see asgimqtt_v3.py',
+        action='store_true'
+    )
+    ap.add_argument(
+        '-f', '--fence', help='Check the next station enter & exit of the jobs, see asgimqtt_v3.py',
+        action='store_true'
+    )
+    ap.add_argument(
+        '--topics', help='Comma separated topics to bridge',
+        default=','.join(Config.TOPIC_NAMES)
+    )
+    ap.add_argument(
+        '--fanout-window', help='Seconds to coalesce monitor positions over, 0 sends every frame',
+        type=float, default=1.0
+    )
+    ap.add_argument(
+        '--fanout-threshold', help='Meters a vehicle must move to be sent again', type=float, default=10
+    )
+    ap.add_argument(
+        '--position-shards', help='Number of position geofence worker processes, see sharding.py',
+        type=int, default=1
+    )
+    ap.add_argument(
+        '--mode', help='sync handles positions on the mqtt network thread, '
+        'async only enqueues them there', choices=('sync', 'async'), default='sync'
+    )
+    ap.add_argument(
+        '--queue-size', help='Max queued position messages in async mode', type=int, default=100
+    )
+    ap.add_argument(
+        '--workers', help='Number of async workers', type=int, default=4
+    )
+    ap.add_argument(
+        '--overflow', help='What to do when the queue is full in async mode',
+        choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP_OLDEST
+    )
+    ap.add_argument(
+        '--record', help='Save received payloads to this file, see replay.py',
+    )
+    ap.add_argument(
+        '--metrics-interval', help='Seconds between metrics reports', type=int,
+        default=Config.METRICS_INTERVAL
+    )
+    ap.add_argument(
+        'channel_layer', help='ASGI channel layer instance'
+    )
+    args = ap.parse_args()
+
+    channel_layer = get_channel_layer(args.channel_layer)
+
+    Config.DEBUG = args.debug
+    Config.LOG_FILEPATH = args.log
+    bridgelog.configure_from_args(args)
+    Config.read_env(args.settings)
+
+    topic_names = [name for name in args.topics.split(',') if name]
+    for name in topic_names:
+        if name not in Config.TOPICS or not Config.TOPICS[name].get('TOPIC'):
+            ap.error(f'G7_MQTT_{name.upper()}_TOPIC is not set')
+
+    db_pool = DatabasePool(Config.DB_URL)
+    subscriber = InvalidationSubscriber(r, debug=Config.DEBUG)
+    vehicle_workers = VehicleWorkerCache(db_pool)
+    subscriber.add_listener(vehicle_workers.invalidations)
+    event_buffer = EventBuffer(db_pool, debug=Config.DEBUG)
+
+    # AsyncBridge of the position messages in async mode
+    position_bridge = None
+
+    handlers = {
+        'stop': EventHandler(
+            EVENT_STOP, 'stopEvent', channel_layer, vehicle_workers, event_buffer, debug=Config.DEBUG
+        ),
+        'idle': EventHandler(
+            EVENT_IDLE, 'idleEvent', channel_layer, vehicle_workers, event_buffer, debug=Config.DEBUG
+        ),
+        'ems': EventHandler(
+            EVENT_EMS, 'emsEvent', channel_layer, vehicle_workers, event_buffer, debug=Config.DEBUG
+        ),
+    }
+
+    if 'position' in topic_names:
+        asgimqtt_v3.Config.DEBUG = args.debug
+        asgimqtt_v3.Config.LOG_FILEPATH = args.log
+        asgimqtt_v3.Config.TEST_MODE = args.test
+        asgimqtt_v3.Config.STATION_CHECK = args.fence
+        asgimqtt_v3.Config.read_env(args.settings)
+        if args.fanout_window > 0:
+            asgimqtt_v3.Config.fanout = PositionFanout(
+                window=args.fanout_window, threshold=args.fanout_threshold
+            )
+        asgimqtt_v3.Config.snapshot = PositionSnapshot(r, debug=Config.DEBUG)
+        asgimqtt_v3.Config.subscriptions = SubscriptionIndex()
+        asgimqtt_v3.Config.states = VehicleStateStore(r, debug=Config.DEBUG)
+        if args.position_shards > 1:
+            asgimqtt_v3.setup_sharded(channel_layer, args.position_shards, vars(args))
+        else:
+            asgimqtt_v3.setup(channel_layer, db_pool, subscriber)
+
+        if args.mode == 'async':
+            position_bridge = AsyncBridge(
+                asgimqtt_v3.decode_position_frame, asgimqtt_v3.fan_out_positions,
+                asgimqtt_v3.Config.dispatcher.dispatch if asgimqtt_v3.Config.dispatcher is not None
+                else asgimqtt_v3.process_geofences,
+                merge=asgimqtt_v3.merge_position_frames, workers=args.workers, queue_size=args.queue_size,
+                overflow=args.overflow, metrics_interval=args.metrics_interval,
+                report=asgimqtt_v3.report_bridge_metrics, debug=Config.DEBUG
+            )
+            threading.Thread(target=position_bridge.serve, name='position-bridge', daemon=True).start()
+            handlers['position'] = position_bridge.submit
+        else:
+            handlers['position'] = asgimqtt_v3.handle_message
+
+    subscriber.start()
+
+    bridge = G7Bridge(Config.HOST, Config.PORT, Config.QOS)
+    if args.record:
+        bridge.recorder = PayloadRecorder(args.record)
+
+    for name in topic_names:
+        topic = Config.TOPICS[name]
+        bridge.add_handler(
+            name, topic['TOPIC'], topic.get('CLIENT_ID', ''), topic.get('ACCESS_ID', ''),
+            topic.get('SECRET', ''), handlers[name]
+        )
+
+    # systemd stops the service with SIGTERM, exit normally so that
+    # buffered events are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        bridge.run(args.metrics_interval)
+    finally:
+        if bridge.recorder is not None:
+            bridge.recorder.close()
+
+        if position_bridge is not None:
+            position_bridge.stop()
+
+        if asgimqtt_v3.Config.dispatcher is not None:
+            asgimqtt_v3.Config.dispatcher.stop()
+        else:
+            asgimqtt_v3.record_tracks([], flush=True)
+
+        event_buffer.close()
+        db_pool.closeall()
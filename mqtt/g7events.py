@@ -0,0 +1,78 @@
+"""
+Handlers of G7 stop, idle and ems events
+
+The three event topics publish the same message format, so one handler class
+serves all of them. Handlers share the vehicle worker cache and the event
+buffer (see ingestion.py).
+"""
+import json
+import logging
+from datetime import datetime
+import psycopg2
+from asgiref.sync import async_to_sync
+
+
+EVENT_STOP = 0
+EVENT_IDLE = 1
+EVENT_EMS = 2
+
+logger = logging.getLogger('mqtt.bridge')
+
+
+class EventHandler:
+
+    def __init__(self, event_type, notification_type, channel_layer,
+                 vehicle_workers, event_buffer, debug=False):
+        self.event_type = event_type
+        self.notification_type = notification_type
+        self.channel_layer = channel_layer
+        self.vehicle_workers = vehicle_workers
+        self.event_buffer = event_buffer
+        self.debug = debug
+
+    @staticmethod
+    def format_timestamp(timestamp):
+        if not timestamp:
+            return None
+
+        return datetime.fromtimestamp(int(timestamp)/1000).strftime('%Y-%m-%d %H:%M:%S')
+
+    def __call__(self, payload):
+        response = json.loads(payload.decode('utf-8'))
+        if self.debug:
+            print(f'[G7]: Received {self.notification_type} message', response)
+
+        data = response.get('data')
+        push_time = self.format_timestamp(response['pushTime'])
+        start_time = self.format_timestamp(data['startTime'])
+        end_time = self.format_timestamp(data['endTime'])
+
+        plate_num = data['plateNum']
+        try:
+            workers = self.vehicle_workers.get(plate_num)
+        except psycopg2.Error as e:
+            # the changes are reloaded on the next event, the monitor is
+            # notified of this one all the same
+            logger.warning('[G7]: Vehicle workers not reloaded: %s', e)
+            workers = self.vehicle_workers.get_cached(plate_num)
+
+        if workers is not None:
+            vehicle, driver, escort = workers
+            # stop event is published with lower cased endlng & endlat
+            self.event_buffer.add((
+                self.event_type, push_time, vehicle, driver, escort, start_time, end_time,
+                data['seconds'], data['startLng'], data['startLat'],
+                data.get('endLng', data.get('endlng')), data.get('endLat', data.get('endlat'))
+            ))
+        else:
+            if self.debug:
+                print(f"[Error]: {plate_num} is not registered")
+
+        async_to_sync(self.channel_layer.group_send)(
+            'monitor',
+            {
+                'type': 'notify_monitor',
+                'notification_type': self.notification_type,
+                'data': data
+            }
+        )
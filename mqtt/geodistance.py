@@ -0,0 +1,99 @@
+"""
+Batch geo distance calculation for MQTT position frames
+
+Distances are calculated with the haversine formula on the mean earth radius.
+Compared with the WGS-84 geodesic distance geopy returns, the error is below
+0.5% of the distance (at most 0.5m for a 100m geofence radius), which is far
+below the GPS accuracy of the G7 devices.
+
+Run this module directly to benchmark it against the per-pair geopy loop:
+
+    python mqtt/geodistance.py --vehicles 500 --geofences 1000
+"""
+import argparse
+import time
+import numpy as np
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def _as_radians(values):
+    return np.radians(np.asarray(values, dtype=np.float64))
+
+
+def distance_matrix(lats, lngs, target_lats, target_lngs):
+    """
+    Return the N x M matrix of distances in meters between
+    N positions and M targets
+    """
+    lat1 = _as_radians(lats)[:, np.newaxis]
+    lng1 = _as_radians(lngs)[:, np.newaxis]
+    lat2 = _as_radians(target_lats)[np.newaxis, :]
+    lng2 = _as_radians(target_lngs)[np.newaxis, :]
+    return _haversine(lat1, lng1, lat2, lng2)
+
+
+def pairwise_distances(lats, lngs, target_lats, target_lngs):
+    """
+    Return the distances in meters between positions[i] and targets[i]
+    """
+    return _haversine(
+        _as_radians(lats), _as_radians(lngs),
+        _as_radians(target_lats), _as_radians(target_lngs)
+    )
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    sin_dlat = np.sin((lat2 - lat1) * 0.5)
+    sin_dlng = np.sin((lng2 - lng1) * 0.5)
+    a = sin_dlat * sin_dlat + np.cos(lat1) * np.cos(lat2) * sin_dlng * sin_dlng
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def benchmark(vehicles, geofences, frames, sample_pairs):
+    from geopy import distance
+
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(30, 40, vehicles)
+    lngs = rng.uniform(110, 120, vehicles)
+    target_lats = rng.uniform(30, 40, geofences)
+    target_lngs = rng.uniform(110, 120, geofences)
+
+    # geopy is too slow to run over the whole frame, so measure a sample
+    # of pairs and extrapolate to vehicles x geofences pairs per frame
+    pairs = min(sample_pairs, vehicles * geofences)
+    start = time.perf_counter()
+    for k in range(pairs):
+        i, j = k % vehicles, k % geofences
+        distance.distance((lats[i], lngs[i]), (target_lats[j], target_lngs[j])).m
+    per_pair = (time.perf_counter() - start) / pairs
+    geopy_fps = 1 / (per_pair * vehicles * geofences)
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        matrix = distance_matrix(lats, lngs, target_lats, target_lngs)
+    numpy_fps = frames / (time.perf_counter() - start)
+
+    max_error = 0
+    for k in range(min(pairs, 1000)):
+        i, j = k % vehicles, k % geofences
+        expected = distance.distance((lats[i], lngs[i]), (target_lats[j], target_lngs[j])).m
+        max_error = max(max_error, abs(matrix[i, j] - expected) / expected)
+
+    print(f'{vehicles} vehicles x {geofences} geofences')
+    print(f'geopy: {geopy_fps:.4f} frames/sec (extrapolated from {pairs} pairs)')
+    print(f'numpy: {numpy_fps:.2f} frames/sec ({frames} frames)')
+    print(f'max relative error: {max_error * 100:.3f}%')
+
+
+if __name__ == '__main__':
+
+    ap = argparse.ArgumentParser(description='Benchmark batch geo distance')
+    ap.add_argument('--vehicles', type=int, default=500)
+    ap.add_argument('--geofences', type=int, default=1000)
+    ap.add_argument('--frames', type=int, default=20)
+    ap.add_argument('--sample-pairs', type=int, default=20000)
+    args = ap.parse_args()
+
+    benchmark(args.vehicles, args.geofences, args.frames, args.sample_pairs)
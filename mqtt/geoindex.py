@@ -0,0 +1,82 @@
+"""
+Grid based spatial index for black dots
+
+Every black dot is registered in each grid cell its bounding box overlaps,
+so a position lookup only needs to read the single cell the vehicle is in
+and run a cheap bounding-box test before the exact geodesic distance check.
+"""
+import math
+
+
+# approximate length of one degree of latitude in meters
+METERS_PER_DEGREE = 111320.0
+
+# default cell size in degrees, around 1.1km on latitude axis
+DEFAULT_CELL_SIZE = 0.01
+
+# bounding box is widened a little so that the ellipsoid vs. sphere
+# difference never filters out a black dot which geopy considers inside
+BBOX_SLACK_RATIO = 1.01
+BBOX_SLACK_METERS = 5
+
+
+def meters_to_degrees(latitude, meters):
+    lat_delta = meters / METERS_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    lng_delta = meters / (METERS_PER_DEGREE * cos_lat)
+    return lat_delta, lng_delta
+
+
+class BlackDotIndex:
+
+    def __init__(self, blackdots=None, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.blackdots = {}
+        for blackdot in blackdots or []:
+            self.add(blackdot)
+
+    def __len__(self):
+        return len(self.blackdots)
+
+    def cell_of(self, latitude, longitude):
+        return (
+            int(math.floor(latitude / self.cell_size)),
+            int(math.floor(longitude / self.cell_size))
+        )
+
+    def add(self, blackdot):
+        radius = (blackdot['radius'] or 0) * BBOX_SLACK_RATIO + BBOX_SLACK_METERS
+        lat_delta, lng_delta = meters_to_degrees(blackdot['latitude'], radius)
+        bbox = (
+            blackdot['latitude'] - lat_delta,
+            blackdot['longitude'] - lng_delta,
+            blackdot['latitude'] + lat_delta,
+            blackdot['longitude'] + lng_delta
+        )
+        min_cell = self.cell_of(bbox[0], bbox[1])
+        max_cell = self.cell_of(bbox[2], bbox[3])
+
+        self.blackdots[blackdot['station_id']] = (blackdot, bbox)
+        for lat_cell in range(min_cell[0], max_cell[0] + 1):
+            for lng_cell in range(min_cell[1], max_cell[1] + 1):
+                self.cells.setdefault((lat_cell, lng_cell), []).append(
+                    blackdot['station_id']
+                )
+
+    def get(self, station_id):
+        item = self.blackdots.get(station_id)
+        return item[0] if item is not None else None
+
+    def candidates(self, latitude, longitude):
+        """
+        Return black dots whose bounding box contains the given position,
+        in the same order they were loaded from the database
+        """
+        ret = []
+        for station_id in self.cells.get(self.cell_of(latitude, longitude), []):
+            blackdot, bbox = self.blackdots[station_id]
+            if bbox[0] <= latitude <= bbox[2] and bbox[1] <= longitude <= bbox[3]:
+                ret.append(blackdot)
+
+        return ret
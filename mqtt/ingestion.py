@@ -0,0 +1,190 @@
+"""
+Batched ingestion of G7 stop, idle and ems events
+
+Events are buffered in memory and written to notification_g7mqttevent with a
+single COPY every FLUSH_ROWS rows or FLUSH_INTERVAL milliseconds, whichever
+comes first. The buffer is flushed on close(), which the bridges call on
+shutdown, so that no buffered event is lost.
+
+Plate number -> vehicle, driver and escort resolution is served from
+VehicleWorkerCache, which is reloaded only when django publishes a vehicle
+or vehicle worker change (see invalidation.py).
+"""
+import csv
+import io
+import logging
+import threading
+from datetime import datetime, timezone
+import psycopg2
+from invalidation import (
+    PendingInvalidations, INVALIDATION_RESET, INVALIDATION_VEHICLE, INVALIDATION_VEHICLE_WORKERS
+)
+
+
+FLUSH_ROWS = 500
+FLUSH_INTERVAL = 200
+
+# buffered rows are kept on a failed flush, up to this count
+MAX_PENDING_ROWS = 100000
+
+logger = logging.getLogger('mqtt.bridge')
+
+G7MQTTEVENT_COLUMNS = (
+    'event_type', 'push_time', 'vehicle_id', 'driver_id', 'escort_id',
+    'start_time', 'end_time', 'seconds', 'start_lng', 'start_lat',
+    'end_lng', 'end_lat', 'created', 'updated'
+)
+
+COPY_G7MQTTEVENT_QUERY = """
+    COPY notification_g7mqttevent ({}) FROM STDIN WITH (FORMAT csv)
+""".format(', '.join(G7MQTTEVENT_COLUMNS))
+
+VEHICLE_WORKERS_QUERY = """
+    SELECT vv.plate_num, vv.id, vvwb.worker_id
+    FROM vehicle_vehicle vv
+    LEFT JOIN vehicle_vehicleworkerbind vvwb
+    ON vv.id=vvwb.vehicle_id AND vvwb.get_off IS NULL
+    ORDER BY vv.plate_num, vvwb.worker_type
+"""
+
+
+class VehicleWorkerCache:
+    """
+    Map of plate number to (vehicle, driver, escort) ids
+    """
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+        self.invalidations = PendingInvalidations(
+            types=(INVALIDATION_VEHICLE, INVALIDATION_VEHICLE_WORKERS)
+        )
+        self.vehicles = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        vehicles = {}
+        with self.db_pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(VEHICLE_WORKERS_QUERY)
+            for plate_num, vehicle_id, worker_id in cursor.fetchall():
+                workers = vehicles.setdefault(plate_num, [vehicle_id])
+                if worker_id is not None:
+                    workers.append(worker_id)
+            cursor.close()
+
+        with self.lock:
+            self.vehicles = {
+                plate_num: (
+                    workers[0],
+                    workers[1] if len(workers) > 1 else None,
+                    workers[2] if len(workers) > 2 else None
+                )
+                for plate_num, workers in vehicles.items()
+            }
+
+    def refresh_if_changed(self):
+        if self.invalidations:
+            # drain before loading so a change during load is not missed
+            self.invalidations.drain()
+            try:
+                self.load()
+            except psycopg2.Error:
+                self.invalidations({'type': INVALIDATION_RESET})
+                raise
+
+    def get(self, plate_num):
+        """
+        Return (vehicle, driver, escort) ids, or None if not registered
+        """
+        self.refresh_if_changed()
+        return self.vehicles.get(plate_num)
+
+    def get_cached(self, plate_num):
+        """
+        Same as get() without reloading the changes, e.g. if the db is down
+        """
+        return self.vehicles.get(plate_num)
+
+
+class EventBuffer:
+
+    def __init__(self, db_pool, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, debug=False):
+        self.db_pool = db_pool
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval / 1000
+        self.debug = debug
+        self.rows = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='event-buffer', daemon=True)
+        self.thread.start()
+
+    def add(self, row):
+        """
+        row is the tuple of G7MQTTEVENT_COLUMNS values except created and updated
+        """
+        with self.lock:
+            self.rows.append(row)
+            count = len(self.rows)
+
+        if count >= self.flush_rows:
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+
+            if not rows:
+                return
+
+            # with the utc offset, so it does not depend on the time zones
+            # of the bridge and of the db session
+            now = datetime.now(timezone.utc).isoformat()
+            data = io.StringIO()
+            writer = csv.writer(data)
+            for row in rows:
+                writer.writerow(
+                    ['' if value is None else value for value in row] + [now, now]
+                )
+            data.seek(0)
+
+            try:
+                with self.db_pool.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.copy_expert(COPY_G7MQTTEVENT_QUERY, data)
+                    connection.commit()
+                    cursor.close()
+
+                if self.debug:
+                    print(f'[Ingestion]: {len(rows)} events saved')
+            except psycopg2.Error as e:
+                logger.warning('[Ingestion]: %s events not saved: %s', len(rows), e)
+                if self.debug:
+                    print(f'[Ingestion]: {e}')
+
+                # keep the rows for the next flush
+                with self.lock:
+                    self.rows = (rows + self.rows)[-MAX_PENDING_ROWS:]
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+
+        # the rows are kept on a failed flush, retry once before losing them
+        for _ in range(2):
+            self.flush()
+            if not self.rows:
+                return
+
+        logger.error('[Ingestion]: %s events lost on close', len(self.rows))
+        if self.debug:
+            print(f'[Ingestion]: {len(self.rows)} events lost on close')
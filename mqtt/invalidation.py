@@ -0,0 +1,98 @@
+"""
+Cache invalidation messages published by django signals
+
+Django publishes typed json messages on INVALIDATION_CHANNEL when stations,
+jobs, vehicles or vehicle worker binds change (see tms/core/redis.py).
+InvalidationSubscriber listens on a background thread and hands every message
+to the registered listeners, so the bridges do not query redis per message.
+
+Listeners are called on the subscriber thread and are expected to only record
+the change; the bridge applies it to its in-memory cache on the next message.
+"""
+import json
+import time
+import threading
+import redis
+
+
+INVALIDATION_CHANNEL = 'asgimqtt:invalidation'
+
+INVALIDATION_RESET = 'reset'
+INVALIDATION_STATION = 'station'
+INVALIDATION_JOB = 'job'
+INVALIDATION_VEHICLE = 'vehicle'
+INVALIDATION_VEHICLE_WORKERS = 'vehicle_workers'
+
+
+class InvalidationSubscriber(threading.Thread):
+
+    def __init__(self, redis_client, retry_interval=3, debug=False):
+        super().__init__(name='invalidation-subscriber', daemon=True)
+        self.redis = redis_client
+        self.retry_interval = retry_interval
+        self.debug = debug
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Register listener; it receives a reset message at once because
+        everything may have changed before it was registered
+        """
+        self.listeners.append(listener)
+        listener({'type': INVALIDATION_RESET})
+
+    def notify(self, message):
+        for listener in self.listeners:
+            listener(message)
+
+    def run(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+
+                # messages published before subscribing are lost
+                self.notify({'type': INVALIDATION_RESET})
+
+                for message in pubsub.listen():
+                    try:
+                        data = json.loads(message['data'])
+                    except (TypeError, ValueError):
+                        continue
+
+                    if self.debug:
+                        print('[Invalidation]: ', data)
+
+                    self.notify(data)
+            except redis.RedisError as e:
+                if self.debug:
+                    print(f'[Invalidation]: {e}')
+
+                time.sleep(self.retry_interval)
+
+
+class PendingInvalidations:
+    """
+    Thread safe list of invalidation messages, usable as a listener
+    """
+    def __init__(self, types=None):
+        self.types = types
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, message):
+        if self.types is not None and message.get('type') not in self.types \
+           and message.get('type') != INVALIDATION_RESET:
+            return
+
+        with self.lock:
+            self.messages.append(message)
+
+    def __bool__(self):
+        return bool(self.messages)
+
+    def drain(self):
+        with self.lock:
+            messages, self.messages = self.messages, []
+
+        return messages
@@ -0,0 +1,19 @@
+"""
+Per user notification counters of django
+
+The counters are kept by django (see tms/notification/counters.py) and
+incremented by the bridge for the notifications it inserts. The key and
+INCREMENT_SCRIPT are copies of the django ones in tms/core/redis.py, keep
+them the same: the script only increments an existing hash, incrementing a
+missing one would create it with partial counts.
+"""
+
+
+COUNTS_KEY = 'notification:counts:{}'
+
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'unread', ARGV[1])
+    redis.call('HINCRBY', KEYS[1], 'read', ARGV[2])
+end
+"""
@@ -0,0 +1,602 @@
+"""
+Replay harness and throughput benchmark for the G7 bridges
+
+Recorded or synthesized G7 position, stop, idle and ems payloads are fed to
+the same handlers g7bridge.py runs, without a G7 broker:
+ - db access goes to a throwaway schema, cloned from the public tables and
+   seeded with a synthetic fleet, which is dropped afterwards
+ - the channel layer is a local stand-in which only counts the messages;
+   notifications are only queued in the outbox table
+
+Frames/sec, p50/p99 per frame latency, db queries per frame and memory
+growth are reported per topic.
+
+    # record live payloads
+    python mqtt/g7bridge.py --settings .env --record g7.jsonl config.asgi:channel_layer
+
+    # replay them at 10 frames/sec
+    python mqtt/replay.py --settings .env --input g7.jsonl --rate 10
+
+    # synthesized fleet of 500 vehicles and 1000 stations, as fast as possible
+    python mqtt/replay.py --settings .env --vehicles 500 --stations 1000 --frames 300
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+import psycopg2
+import psycopg2.extensions
+from dbpool import DatabasePool, PooledConnection
+from g7events import EventHandler, EVENT_STOP, EVENT_IDLE, EVENT_EMS
+from ingestion import EventBuffer, VehicleWorkerCache
+from invalidation import InvalidationSubscriber
+import asgimqtt_v3
+
+
+TOPIC_NAMES = ('position', 'stop', 'idle', 'ems')
+
+# tables used by the bridges, cloned into the replay schema
+REPLAY_TABLES = (
+    'account_user', 'info_station', 'vehicle_vehicle', 'vehicle_vehicleworkerbind',
+    'order_order', 'order_job', 'order_jobstation',
+    'notification_notification', 'notification_notificationoutbox', 'notification_g7mqttevent',
+    'vehicle_vehicletrack',
+)
+
+STATION_TYPE_LOADING = 0
+STATION_TYPE_UNLOADING = 1
+STATION_TYPE_BLACK_DOT = 5
+VEHICLE_STATUS_UNDER_WHEEL = 3
+JOB_PROGRESS_TO_LOADING_STATION = 2
+
+
+class PayloadRecorder:
+    """
+    Append received payloads to a json lines file, see read_recording()
+    """
+    def __init__(self, filepath):
+        self.file = open(filepath, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def __call__(self, topic, payload):
+        line = json.dumps({
+            'topic': topic,
+            'time': time.time(),
+            'payload': payload.decode('utf-8'),
+        }, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_recording(filepath):
+    payloads = []
+    with open(filepath, 'r', encoding='utf-8') as fd:
+        for line in fd:
+            if line.strip():
+                record = json.loads(line)
+                payloads.append((record['topic'], record['payload'].encode('utf-8')))
+
+    return payloads
+
+
+class QueryCounter:
+    """
+    Count of executed queries, in total and on the current thread
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.total = 0
+
+    def add(self):
+        with self.lock:
+            self.total += 1
+        self.local.count = self.thread_count() + 1
+
+    def thread_count(self):
+        return getattr(self.local, 'count', 0)
+
+
+query_counter = QueryCounter()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+
+    def execute(self, query, vars=None):
+        query_counter.add()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        query_counter.add()
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(PooledConnection):
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+
+class ReplayChannelLayer:
+    """
+    Channel layer stand-in which counts and discards the messages
+    """
+    def __init__(self):
+        self.sent = 0
+        self.group_sent = 0
+
+    async def send(self, channel, message):
+        self.sent += 1
+
+    async def group_send(self, group, message):
+        self.group_sent += 1
+
+
+def synthesize_fleet(vehicles, stations, plates=None, center=(39.9, 116.4), spread=0.5,
+                     blackdot_ratio=0.2, seed=0):
+    """
+    Stations scattered around center and vehicles with in progress jobs.
+    Every vehicle drives from its start towards its loading station, and
+    black dots are dropped on the way of the vehicles.
+    """
+    rng = random.Random(seed)
+    plates = list(plates or [f'REPLAY{i:05d}' for i in range(vehicles)])
+    blackdot_count = int(stations * blackdot_ratio)
+
+    def random_point():
+        return (
+            center[0] + rng.uniform(-spread, spread),
+            center[1] + rng.uniform(-spread, spread)
+        )
+
+    fleet = {'stations': [], 'vehicles': []}
+    for station_id in range(1, stations - blackdot_count + 1):
+        lat, lng = random_point()
+        fleet['stations'].append({
+            'id': station_id,
+            'station_type': rng.choice((STATION_TYPE_LOADING, STATION_TYPE_UNLOADING)),
+            'latitude': lat,
+            'longitude': lng,
+            'radius': rng.randint(100, 500),
+        })
+
+    work_stations = fleet['stations']
+    for i, plate_num in enumerate(plates):
+        vehicle_id = i + 1
+        loading_station, unloading_station = rng.sample(work_stations, 2)
+        fleet['vehicles'].append({
+            'id': vehicle_id,
+            'plate_num': plate_num,
+            'driver_id': vehicle_id * 2 - 1,
+            'escort_id': vehicle_id * 2,
+            'order_id': vehicle_id,
+            'job_id': vehicle_id,
+            'route': (loading_station, unloading_station),
+            'start': random_point(),
+        })
+
+    for i in range(blackdot_count):
+        vehicle = fleet['vehicles'][i % len(fleet['vehicles'])]
+        target = vehicle['route'][0]
+        progress = rng.uniform(0.2, 0.8)
+        fleet['stations'].append({
+            'id': stations - blackdot_count + i + 1,
+            'station_type': STATION_TYPE_BLACK_DOT,
+            'latitude': vehicle['start'][0] + (target['latitude'] - vehicle['start'][0]) * progress,
+            'longitude': vehicle['start'][1] + (target['longitude'] - vehicle['start'][1]) * progress,
+            'radius': rng.randint(50, 300),
+        })
+
+    return fleet
+
+
+def synthesize_payloads(fleet, frames, events_per_frame=5, seed=0):
+    """
+    Position frame of the whole fleet per frame, plus random stop, idle and
+    ems events. Vehicles overshoot their loading station so that both enter
+    and exit are triggered.
+    """
+    rng = random.Random(seed)
+    event_topics = (('stop', 'endlng', 'endlat'), ('idle', 'endLng', 'endLat'), ('ems', 'endLng', 'endLat'))
+    payloads = []
+    started = int(time.time() * 1000)
+    for frame in range(frames):
+        push_time = started + frame * 1000
+        t = 1.2 * frame / max(frames - 1, 1)
+        positions = []
+        for vehicle in fleet['vehicles']:
+            target = vehicle['route'][0]
+            lat = vehicle['start'][0] + (target['latitude'] - vehicle['start'][0]) * t
+            lng = vehicle['start'][1] + (target['longitude'] - vehicle['start'][1]) * t
+            positions.append({
+                'plateNum': vehicle['plate_num'],
+                'lat': round(lat + rng.gauss(0, 0.00005), 6),
+                'lng': round(lng + rng.gauss(0, 0.00005), 6),
+                'speed': rng.randint(1, 80),
+                'gpstime': push_time,
+            })
+
+        payloads.append(('position', json.dumps({'data': positions, 'pushTime': push_time}).encode('utf-8')))
+
+        for _ in range(events_per_frame):
+            vehicle = rng.choice(fleet['vehicles'])
+            topic, end_lng_key, end_lat_key = rng.choice(event_topics)
+            lat, lng = vehicle['start']
+            seconds = rng.randint(60, 3600)
+            payloads.append((topic, json.dumps({
+                'pushTime': push_time,
+                'data': {
+                    'plateNum': vehicle['plate_num'],
+                    'startTime': push_time - seconds * 1000,
+                    'endTime': push_time,
+                    'seconds': seconds,
+                    'startLng': lng,
+                    'startLat': lat,
+                    end_lng_key: lng,
+                    end_lat_key: lat,
+                }
+            }).encode('utf-8')))
+
+    return payloads
+
+
+def recording_fleet_args(payloads):
+    """
+    Plate numbers and center of the recorded positions
+    """
+    plates = set()
+    lats, lngs = [], []
+    for topic, payload in payloads:
+        data = json.loads(payload.decode('utf-8')).get('data') or []
+        if isinstance(data, dict):
+            data = [data]
+
+        for item in data:
+            plates.add(item['plateNum'])
+            if topic == 'position':
+                lats.append(float(item['lat']))
+                lngs.append(float(item['lng']))
+
+    center = (sum(lats) / len(lats), sum(lngs) / len(lngs)) if lats else (39.9, 116.4)
+    spread = max(max(lats) - min(lats), max(lngs) - min(lngs)) / 2 if lats else 0.5
+    return sorted(plates), center, max(spread, 0.01)
+
+
+class ReplaySchema:
+    """
+    Throwaway schema with empty copies of REPLAY_TABLES
+    """
+    def __init__(self, dsn, name=None):
+        self.dsn = dsn
+        self.name = name or f'replay_{os.getpid()}'
+
+    @property
+    def replay_dsn(self):
+        return psycopg2.extensions.make_dsn(self.dsn, options=f'-c search_path={self.name}')
+
+    def create(self):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f'CREATE SCHEMA {self.name}')
+            for table in REPLAY_TABLES:
+                cursor.execute(f"""
+                    CREATE TABLE {self.name}.{table}
+                    (LIKE public.{table} INCLUDING DEFAULTS INCLUDING INDEXES)
+                """)
+                cursor.execute(f'CREATE SEQUENCE {self.name}.{table}_id_seq')
+                cursor.execute(f"""
+                    ALTER TABLE {self.name}.{table}
+                    ALTER COLUMN id SET DEFAULT nextval('{self.name}.{table}_id_seq')
+                """)
+
+            # only the columns used by the bridges are seeded
+            cursor.execute("""
+                SELECT table_name, column_name
+                FROM information_schema.columns
+                WHERE table_schema=%s AND is_nullable='NO' AND column_name != 'id'
+            """, (self.name, ))
+            for table, column in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE {self.name}.{table} ALTER COLUMN {column} DROP NOT NULL')
+
+            connection.commit()
+        finally:
+            connection.close()
+
+    def seed(self, fleet):
+        connection = psycopg2.connect(self.replay_dsn)
+        try:
+            cursor = connection.cursor()
+            for station in fleet['stations']:
+                cursor.execute("""
+                    INSERT INTO info_station
+                    (id, name, station_type, latitude, longitude, gps_latitude, gps_longitude,
+                     radius, notification_message)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    station['id'], f"station {station['id']}", station['station_type'],
+                    station['latitude'], station['longitude'], station['latitude'], station['longitude'],
+                    station['radius'],
+                    'Replay black dot' if station['station_type'] == STATION_TYPE_BLACK_DOT else ''
+                ))
+
+            for vehicle in fleet['vehicles']:
+                for worker_id in (vehicle['driver_id'], vehicle['escort_id']):
+                    cursor.execute("""
+                        INSERT INTO account_user (id, username, device_token)
+                        VALUES (%s, %s, %s)
+                    """, (worker_id, f'replay{worker_id}', f'token{worker_id}'))
+
+                cursor.execute("""
+                    INSERT INTO vehicle_vehicle (id, plate_num, status) VALUES (%s, %s, %s)
+                """, (vehicle['id'], vehicle['plate_num'], VEHICLE_STATUS_UNDER_WHEEL))
+                cursor.execute("""
+                    INSERT INTO vehicle_vehicleworkerbind (vehicle_id, worker_id, worker_type)
+                    VALUES (%s, %s, 'D'), (%s, %s, 'E')
+                """, (vehicle['id'], vehicle['driver_id'], vehicle['id'], vehicle['escort_id']))
+                cursor.execute("""
+                    INSERT INTO order_order (id, is_same_station) VALUES (%s, FALSE)
+                """, (vehicle['order_id'], ))
+                cursor.execute("""
+                    INSERT INTO order_job (id, order_id, vehicle_id, progress) VALUES (%s, %s, %s, %s)
+                """, (vehicle['job_id'], vehicle['order_id'], vehicle['id'], JOB_PROGRESS_TO_LOADING_STATION))
+                for step, station in enumerate(vehicle['route']):
+                    cursor.execute("""
+                        INSERT INTO order_jobstation (job_id, station_id, step, is_completed)
+                        VALUES (%s, %s, %s, FALSE)
+                    """, (vehicle['job_id'], station['id'], step))
+
+            for table in REPLAY_TABLES:
+                cursor.execute(f"""
+                    SELECT setval('{table}_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, FALSE)
+                """)
+
+            connection.commit()
+        finally:
+            connection.close()
+
+    def drop(self):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f'DROP SCHEMA IF EXISTS {self.name} CASCADE')
+            connection.commit()
+        finally:
+            connection.close()
+
+
+def current_rss():
+    """
+    Resident memory in bytes, peak resident memory if unknown
+    """
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def replay(payloads, handlers, rate=0, warmup=10, trace_memory=False):
+    stats = {topic: {'latencies': [], 'queries': 0, 'failed': 0} for topic in TOPIC_NAMES}
+    memory = {}
+
+    def measure_memory():
+        if trace_memory:
+            return tracemalloc.get_traced_memory()[0]
+        return current_rss()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    memory['start'] = measure_memory()
+    started = time.perf_counter()
+    for i, (topic, payload) in enumerate(payloads):
+        if i == warmup:
+            memory['warm'] = measure_memory()
+
+        handler = handlers.get(topic)
+        if handler is None:
+            continue
+
+        queries = query_counter.thread_count()
+        frame_started = time.perf_counter()
+        try:
+            handler(payload)
+        except Exception as e:
+            stats[topic]['failed'] += 1
+            print(f'[Replay]: {topic} {e}')
+
+        stats[topic]['latencies'].append(time.perf_counter() - frame_started)
+        stats[topic]['queries'] += query_counter.thread_count() - queries
+
+        if rate:
+            delay = started + (i + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    elapsed = time.perf_counter() - started
+    memory['end'] = measure_memory()
+    memory.setdefault('warm', memory['start'])
+    if trace_memory:
+        memory['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return stats, elapsed, memory
+
+
+def print_report(stats, elapsed, memory, channel_layer, background_queries, trace_memory):
+    print(f"{'topic':<10}{'frames':>8}{'fps':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}{'failed':>8}")
+    total = 0
+    for topic, stat in stats.items():
+        frames = len(stat['latencies'])
+        if not frames:
+            continue
+
+        total += frames
+        busy = sum(stat['latencies'])
+        print(
+            f"{topic:<10}{frames:>8}{frames / busy if busy else 0:>10.1f}"
+            f"{percentile(stat['latencies'], 50) * 1000:>10.2f}"
+            f"{percentile(stat['latencies'], 99) * 1000:>10.2f}"
+            f"{stat['queries'] / frames:>10.2f}{stat['failed']:>8}"
+        )
+
+    print(f'\n{total} frames in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.1f} frames/sec')
+    print(f'background queries (event buffer flushes): {background_queries}')
+    print(f'channel layer: {channel_layer.group_sent} group sends, {channel_layer.sent} sends')
+
+    kind = 'python heap' if trace_memory else 'rss'
+    print(
+        f"memory ({kind}): {memory['start'] / 2**20:.1f} MB at start, "
+        f"{(memory['end'] - memory['warm']) / 2**20:+.1f} MB after warmup"
+        + (f", {memory['peak'] / 2**20:.1f} MB peak" if 'peak' in memory else '')
+    )
+
+
+def read_database_url(filename):
+    with open(filename, 'r') as fd:
+        for line in fd:
+            key_value = line.split('=', 1)
+            if key_value[0] == 'DATABASE_URL':
+                return key_value[1].strip()
+
+    return ''
+
+
+if __name__ == '__main__':
+
+    ap = argparse.ArgumentParser(description='Replay G7 payloads through the bridge handlers')
+    ap.add_argument(
+        '-s', '--settings', help='Location to django env file, .env, for DATABASE_URL'
+    )
+    ap.add_argument(
+        '--dsn', help='Database to create the replay schema in, overrides --settings'
+    )
+    ap.add_argument(
+        '-i', '--input', help='Recorded payloads, see g7bridge.py --record'
+    )
+    ap.add_argument(
+        '--vehicles', help='Number of synthesized vehicles', type=int, default=100
+    )
+    ap.add_argument(
+        '--stations', help='Number of synthesized stations, including black dots', type=int, default=200
+    )
+    ap.add_argument(
+        '--frames', help='Number of synthesized position frames', type=int, default=100
+    )
+    ap.add_argument(
+        '--events-per-frame', help='Number of synthesized stop, idle & ems events per frame',
+        type=int, default=5
+    )
+    ap.add_argument(
+        '--save', help='Save synthesized payloads to replay later with --input'
+    )
+    ap.add_argument(
+        '--rate', help='Frames/sec to replay at, 0 for as fast as possible', type=float, default=0
+    )
+    ap.add_argument(
+        '--topics', help='Comma separated topics to replay', default=','.join(TOPIC_NAMES)
+    )
+    ap.add_argument(
+        '--warmup', help='Frames before measuring memory growth', type=int, default=10
+    )
+    ap.add_argument(
+        '--trace-memory', help='Measure python heap with tracemalloc instead of rss, slower',
+        action='store_true'
+    )
+    ap.add_argument(
+        '--keep-schema', help='Do not drop the replay schema', action='store_true'
+    )
+    ap.add_argument(
+        '--seed', help='Random seed of synthesized data', type=int, default=0
+    )
+    args = ap.parse_args()
+
+    dsn = args.dsn or (read_database_url(args.settings) if args.settings else '')
+    if not dsn:
+        ap.error('--dsn or --settings with DATABASE_URL is required')
+
+    if args.input:
+        payloads = read_recording(args.input)
+        plates, center, spread = recording_fleet_args(payloads)
+        fleet = synthesize_fleet(
+            len(plates), args.stations, plates=plates, center=center, spread=spread, seed=args.seed
+        )
+    else:
+        fleet = synthesize_fleet(args.vehicles, args.stations, seed=args.seed)
+        payloads = synthesize_payloads(fleet, args.frames, args.events_per_frame, seed=args.seed)
+        if args.save:
+            recorder = PayloadRecorder(args.save)
+            for topic, payload in payloads:
+                recorder(topic, payload)
+            recorder.close()
+
+    topics = [topic for topic in args.topics.split(',') if topic]
+    payloads = [(topic, payload) for topic, payload in payloads if topic in topics]
+
+    schema = ReplaySchema(dsn)
+    schema.create()
+    db_pool = None
+    try:
+        schema.seed(fleet)
+        print(f"[Replay]: {len(fleet['vehicles'])} vehicles, {len(fleet['stations'])} stations, "
+              f"{len(payloads)} frames in schema {schema.name}")
+
+        db_pool = DatabasePool(schema.replay_dsn, connection_factory=CountingConnection)
+        channel_layer = ReplayChannelLayer()
+
+        # never started, add_listener() only queues the initial reset
+        subscriber = InvalidationSubscriber(None)
+        vehicle_workers = VehicleWorkerCache(db_pool)
+        subscriber.add_listener(vehicle_workers.invalidations)
+        event_buffer = EventBuffer(db_pool)
+
+        handlers = {
+            'stop': EventHandler(EVENT_STOP, 'stopEvent', channel_layer, vehicle_workers, event_buffer),
+            'idle': EventHandler(EVENT_IDLE, 'idleEvent', channel_layer, vehicle_workers, event_buffer),
+            'ems': EventHandler(EVENT_EMS, 'emsEvent', channel_layer, vehicle_workers, event_buffer),
+        }
+        if 'position' in topics:
+            # the station enter & exit path is measured too
+            asgimqtt_v3.Config.STATION_CHECK = True
+            asgimqtt_v3.setup(channel_layer, db_pool, subscriber)
+            handlers['position'] = asgimqtt_v3.handle_message
+
+        foreground_queries = query_counter.total
+        stats, elapsed, memory = replay(
+            payloads, handlers, rate=args.rate, warmup=args.warmup, trace_memory=args.trace_memory
+        )
+        event_buffer.close()
+        asgimqtt_v3.record_tracks([], flush=True)
+        background_queries = query_counter.total - foreground_queries - sum(
+            stat['queries'] for stat in stats.values()
+        )
+
+        print_report(
+            stats, elapsed, memory, channel_layer, background_queries, args.trace_memory
+        )
+    finally:
+        if db_pool is not None:
+            db_pool.closeall()
+
+        if args.keep_schema:
+            print(f'[Replay]: schema {schema.name} is kept')
+        else:
+            schema.drop()
@@ -0,0 +1,179 @@
+"""
+Sharded geofence processing of G7 position frames
+
+Plate numbers are hashed to N worker processes. Every worker runs the
+position bridge state (asgimqtt_v3.Config.vehicles) and geofence evaluation
+for its own shard only, so enter & exit events scale with the number of cores.
+
+The dispatcher, in the bridge process, sends the whole frame to the monitor
+group once and then splits the frame's vehicles by shard. Each worker reads
+its own queue in order, so every vehicle's frames are processed in order by
+the same worker.
+
+A worker behind its queue never blocks the bridge nor the other shards: its
+part is kept pending and the next frames are coalesced into it, keeping the
+latest position of every plate, until the queue has room again. Coalesced
+positions are counted and logged when the shard catches up.
+
+Workers are spawned rather than forked because the bridge process already
+runs threads (paho, invalidation subscriber, log writer). Each worker opens
+its own db pool and invalidation subscriber.
+"""
+import argparse
+import logging
+import queue
+import signal
+import zlib
+import multiprocessing
+import bridgelog
+from dbpool import DatabasePool
+from invalidation import InvalidationSubscriber
+
+
+# bridge arguments passed on to the workers
+WORKER_OPTIONS = (
+    'settings', 'debug', 'test', 'fence', 'channel_layer', 'log', 'log_level',
+    'log_max_bytes', 'log_backup_count', 'log_rotate_when',
+)
+
+logger = logging.getLogger('mqtt.position')
+
+
+def shard_of(plate_num, shards):
+    """
+    Stable across processes and restarts unlike hash()
+    """
+    return zlib.crc32(plate_num.encode('utf-8')) % shards
+
+
+def run_worker(index, shards, options, frames):
+    # the bridge process handles ctrl-c and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import asgimqtt_v3 as position
+
+    options = argparse.Namespace(**options)
+    if options.log:
+        options.log = f'{options.log}.shard{index}'
+    bridgelog.configure_from_args(options)
+
+    position.Config.DEBUG = options.debug
+    position.Config.LOG_FILEPATH = options.log
+    position.Config.TEST_MODE = options.test
+    position.Config.STATION_CHECK = options.fence
+    position.Config.SHARD_INDEX = index
+    position.Config.SHARD_COUNT = shards
+    position.Config.read_env(options.settings)
+
+    subscriber = InvalidationSubscriber(position.r, debug=options.debug)
+    position.setup(
+        position.get_channel_layer(options.channel_layer),
+        DatabasePool(position.Config.DB_URL),
+        subscriber
+    )
+    subscriber.start()
+
+    while True:
+        vehicles = frames.get()
+        if vehicles is None:
+            break
+
+        try:
+            position.process_geofences(vehicles)
+        except Exception as e:
+            position.logger.exception('[Shard %s]: %s', index, e)
+            if options.debug:
+                print(f'[Shard {index}]: {e}')
+
+    position.record_tracks([], flush=True)
+    position.Config.db_pool.closeall()
+
+
+class ShardDispatcher:
+
+    def __init__(self, shards, options, queue_size=100, debug=False):
+        self.shards = shards
+        self.options = {key: options.get(key) for key in WORKER_OPTIONS}
+        self.queue_size = queue_size
+        self.debug = debug
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue(queue_size) for _ in range(shards)]
+        self.workers = [None] * shards
+        # plate number -> latest vehicle not queued yet, by shard
+        self.pending = [{} for _ in range(shards)]
+        # positions replaced by a later one while pending, by shard
+        self.coalesced = [0] * shards
+
+    def start_worker(self, index):
+        worker = self.context.Process(
+            target=run_worker, name=f'geofence-shard-{index}',
+            args=(index, self.shards, self.options, self.queues[index]),
+            daemon=True
+        )
+        worker.start()
+        self.workers[index] = worker
+
+    def start(self):
+        for index in range(self.shards):
+            self.start_worker(index)
+
+    def dispatch(self, vehicles):
+        """
+        Split the frame by shard and queue every part to its worker
+        """
+        parts = [[] for _ in range(self.shards)]
+        for vehicle in vehicles:
+            parts[shard_of(vehicle['plateNum'], self.shards)].append(vehicle)
+
+        for index, part in enumerate(parts):
+            if not part:
+                continue
+
+            if not self.workers[index].is_alive():
+                if self.debug:
+                    print(f'[Shard {index}]: Restarting worker')
+                self.start_worker(index)
+
+            pending = self.pending[index]
+            if pending:
+                for vehicle in part:
+                    if vehicle['plateNum'] in pending:
+                        self.coalesced[index] += 1
+                    pending[vehicle['plateNum']] = vehicle
+                part = list(pending.values())
+
+            try:
+                self.queues[index].put_nowait(part)
+            except queue.Full:
+                # worker is behind, keep the latest positions for its next frame
+                # rather than blocking the other shards
+                if not pending:
+                    logger.warning('[Shard %s]: Queue is full, coalescing frames', index)
+                    if self.debug:
+                        print(f'[Shard {index}]: Queue is full, coalescing frames')
+                    self.pending[index] = {vehicle['plateNum']: vehicle for vehicle in part}
+                continue
+
+            if pending:
+                logger.warning(
+                    '[Shard %s]: Caught up, %s positions coalesced', index, self.coalesced[index]
+                )
+                if self.debug:
+                    print(f'[Shard {index}]: Caught up, {self.coalesced[index]} positions coalesced')
+                self.pending[index] = {}
+                self.coalesced[index] = 0
+
+    def stop(self, timeout=10):
+        for pending, frames in zip(self.pending, self.queues):
+            try:
+                if pending:
+                    frames.put(list(pending.values()), timeout=timeout)
+                frames.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+
+        for worker in self.workers:
+            if worker is not None:
+                worker.join(timeout)
+                if worker.is_alive():
+                    worker.terminate()
@@ -0,0 +1,90 @@
+"""
+Authoritative last known vehicle positions for dashboard sockets
+
+Every monitor position message of the bridge (see fanout.py) gets the next
+sequence number and is recorded in redis:
+ - POSITION_SNAPSHOT_KEY: hash of plate number -> last position, speed,
+   motion status, update time and sequence number
+ - POSITION_DELTAS_KEY: sorted set of the last MAX_DELTAS messages by sequence
+ - POSITION_SEQ_KEY: last sequence number
+
+A new PositionConsumer connection gets the snapshot as its first frame; a
+reconnecting one resumes from its last sequence number with the deltas
+(tms/core/redis.py reads these keys).
+
+The snapshot records every vehicle of the frames, stopped ones included,
+while the messages only carry the moving ones, see fanout.py. A keyframe
+replaces the whole snapshot, which drops vehicles gone stale.
+"""
+import json
+import time
+import redis
+
+
+POSITION_SNAPSHOT_KEY = 'position:snapshot'
+POSITION_DELTAS_KEY = 'position:deltas'
+POSITION_SEQ_KEY = 'position:seq'
+
+MAX_DELTAS = 1000
+
+VEHICLE_MOVING = 'moving'
+VEHICLE_STOPPED = 'stopped'
+
+
+class PositionSnapshot:
+
+    def __init__(self, redis_client, max_deltas=MAX_DELTAS, debug=False):
+        self.redis = redis_client
+        self.max_deltas = max_deltas
+        self.debug = debug
+        # sequence number of the last message published
+        self.seq = 0
+
+    def publish(self, message, positions=()):
+        """
+        Record monitor position message, or None if the frame has none, with
+        the positions of the whole frame, stopped vehicles included, and set
+        its sequence number; the message is returned without a sequence
+        number if redis is down
+        """
+        try:
+            if message is not None:
+                self.seq = self.redis.incr(POSITION_SEQ_KEY)
+
+            updated = int(time.time() * 1000)
+            snapshot = {}
+            for position in (message['data'] if message is not None else []) + list(positions):
+                snapshot[position['plateNum']] = json.dumps({
+                    'plateNum': position['plateNum'],
+                    'lnglat': position['lnglat'],
+                    'speed': position['speed'],
+                    'status': VEHICLE_MOVING if float(position['speed']) > 0 else VEHICLE_STOPPED,
+                    'updated': updated,
+                    'seq': self.seq,
+                })
+
+            if message is None:
+                if snapshot:
+                    self.redis.hmset(POSITION_SNAPSHOT_KEY, snapshot)
+                return None
+
+            # messages without fan-out stage have no delta flag, merge them
+            delta = message.get('delta', True)
+            pipe = self.redis.pipeline()
+            if not delta:
+                pipe.delete(POSITION_SNAPSHOT_KEY)
+            if snapshot:
+                pipe.hmset(POSITION_SNAPSHOT_KEY, snapshot)
+            pipe.zadd(POSITION_DELTAS_KEY, {
+                json.dumps({'seq': self.seq, 'delta': delta, 'data': message['data']}): self.seq
+            })
+            pipe.zremrangebyrank(POSITION_DELTAS_KEY, 0, -self.max_deltas - 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            if self.debug:
+                print(f'[Snapshot]: {e}')
+            return message
+
+        message['seq'] = self.seq
+        message['delta'] = delta
+        return message
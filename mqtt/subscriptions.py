@@ -0,0 +1,155 @@
+"""
+Viewport scoped position subscriptions of the dashboard sockets
+
+A socket may subscribe to a bounding box and/or a set of plate numbers; django
+keeps the subscriptions in redis (see tms/core/redis.py):
+ - SUBSCRIPTIONS_KEY: hash of channel name -> {'bbox': [min lng, min lat,
+   max lng, max lat], 'plates': [...]}
+ - SUBSCRIPTIONS_VERSION_KEY: incremented on every change
+
+Sockets without subscription are in POSITION_GROUP and get every position
+message. Subscribed sockets leave the group and the bridge sends each of them
+only its own vehicles, i.e. the ones inside the bounding box or in the plate
+numbers.
+
+Bounding boxes are indexed in a grid of CELL_SIZE degrees, so matching a
+message costs a lookup per vehicle plus the matched subscriptions instead of
+checking every vehicle against every socket. Boxes covering more than
+MAX_CELLS cells, i.e. zoomed out views, are checked against every vehicle.
+"""
+import json
+import math
+
+
+POSITION_GROUP = 'monitor-position'
+SUBSCRIPTIONS_KEY = 'position:subscriptions'
+SUBSCRIPTIONS_VERSION_KEY = 'position:subscriptions:version'
+
+CELL_SIZE = 0.25
+MAX_CELLS = 4096
+
+
+def in_bbox(lnglat, bbox):
+    lng, lat = float(lnglat[0]), float(lnglat[1])
+    return bbox[0] <= lng <= bbox[2] and bbox[1] <= lat <= bbox[3]
+
+
+class SubscriptionIndex:
+
+    def __init__(self, cell_size=CELL_SIZE, max_cells=MAX_CELLS):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.subscriptions = {}
+        self.cells = {}
+        self.wide = set()
+        self.plates = {}
+        self.version = None
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def cell_of(self, lng, lat):
+        return math.floor(lng / self.cell_size), math.floor(lat / self.cell_size)
+
+    def cells_of(self, bbox):
+        """
+        Cells overlapped by the bounding box, or None if there are too many
+        """
+        min_x, min_y = self.cell_of(bbox[0], bbox[1])
+        max_x, max_y = self.cell_of(bbox[2], bbox[3])
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > self.max_cells:
+            return None
+
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+    def add(self, channel_name, bbox=None, plates=None):
+        self.remove(channel_name)
+
+        bbox = tuple(float(value) for value in bbox) if bbox else None
+        plates = set(plates or [])
+        self.subscriptions[channel_name] = (bbox, plates)
+
+        if bbox is not None:
+            cells = self.cells_of(bbox)
+            if cells is None:
+                self.wide.add(channel_name)
+            else:
+                for cell in cells:
+                    self.cells.setdefault(cell, set()).add(channel_name)
+
+        for plate_num in plates:
+            self.plates.setdefault(plate_num, set()).add(channel_name)
+
+    def remove(self, channel_name):
+        subscription = self.subscriptions.pop(channel_name, None)
+        if subscription is None:
+            return
+
+        bbox, plates = subscription
+        if bbox is not None:
+            self.wide.discard(channel_name)
+            for cell in self.cells_of(bbox) or []:
+                channel_names = self.cells.get(cell)
+                if channel_names is not None:
+                    channel_names.discard(channel_name)
+                    if not channel_names:
+                        del self.cells[cell]
+
+        for plate_num in plates:
+            channel_names = self.plates.get(plate_num)
+            if channel_names is not None:
+                channel_names.discard(channel_name)
+                if not channel_names:
+                    del self.plates[plate_num]
+
+    def match(self, positions):
+        """
+        Return channel name -> positions of its subscription
+        """
+        matched = {}
+        for position in positions:
+            lng, lat = float(position['lnglat'][0]), float(position['lnglat'][1])
+            candidates = self.cells.get(self.cell_of(lng, lat), set()) | self.wide
+            channel_names = {
+                channel_name for channel_name in candidates
+                if in_bbox((lng, lat), self.subscriptions[channel_name][0])
+            }
+            channel_names.update(self.plates.get(position['plateNum'], ()))
+            for channel_name in channel_names:
+                matched.setdefault(channel_name, []).append(position)
+
+        return matched
+
+    def refresh(self, redis_client):
+        """
+        Reload the subscriptions if django changed them
+        """
+        version = redis_client.get(SUBSCRIPTIONS_VERSION_KEY)
+        if version is not None and version == self.version:
+            return
+
+        subscriptions = redis_client.hgetall(SUBSCRIPTIONS_KEY)
+        self.subscriptions = {}
+        self.cells = {}
+        self.wide = set()
+        self.plates = {}
+        for channel_name, subscription in subscriptions.items():
+            try:
+                subscription = json.loads(subscription)
+            except ValueError:
+                continue
+
+            self.add(channel_name.decode('utf-8'), subscription.get('bbox'), subscription.get('plates'))
+
+        self.version = version
+
+    def expire(self, redis_client, channel_name):
+        """
+        Forget the subscription of a socket which is gone, e.g. its server
+        was killed before it could unsubscribe
+        """
+        self.remove(channel_name)
+        pipe = redis_client.pipeline()
+        pipe.hdel(SUBSCRIPTIONS_KEY, channel_name)
+        pipe.incr(SUBSCRIPTIONS_VERSION_KEY)
+        pipe.execute()
@@ -0,0 +1,6 @@
+"""
+Tests of the G7 bridge helpers, which are imported by plain module name as
+the bridges do, so they are run from the mqtt directory:
+
+    python -m unittest discover -s mqtt/tests -t mqtt
+"""
@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from aiobridge import AsyncBridge
+
+
+class AsyncBridgeTest(unittest.TestCase):
+
+    def test_frames_are_fanned_out_in_order(self):
+        sent = []
+        processed = []
+
+        async def fan_out(frame):
+            # earlier frames are slower to send
+            await asyncio.sleep((10 - frame) * 0.001)
+            sent.append(frame)
+
+        bridge = AsyncBridge(lambda payload: payload, fan_out, processed.append, workers=4)
+
+        async def run():
+            for frame in range(10):
+                bridge.queue.put(0, frame)
+            bridge.tasks = [bridge.loop.create_task(bridge.worker()) for _ in range(bridge.workers)]
+            while len(sent) < 10 or len(processed) < 10:
+                await asyncio.sleep(0.01)
+            for task in bridge.tasks:
+                task.cancel()
+
+        bridge.loop.run_until_complete(run())
+        bridge.processor.shutdown()
+        self.assertEqual(sent, list(range(10)))
+        self.assertEqual(processed, list(range(10)))
+
+    def test_failed_frames_are_counted(self):
+        async def fan_out(frame):
+            raise ValueError(frame)
+
+        bridge = AsyncBridge(lambda payload: payload, fan_out, lambda frame: None, workers=1)
+
+        async def run():
+            bridge.queue.put(0, 1)
+            task = bridge.loop.create_task(bridge.worker())
+            while not bridge.metrics.failed:
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        with self.assertLogs('mqtt.position', 'ERROR'):
+            bridge.loop.run_until_complete(run())
+        bridge.processor.shutdown()
+        self.assertEqual(bridge.metrics.failed, 1)
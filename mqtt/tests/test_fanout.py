@@ -0,0 +1,58 @@
+import unittest
+
+from fanout import PositionFanout, moved_distance
+
+
+def position(plate_num, lng, lat, speed=30):
+    return {'plateNum': plate_num, 'lnglat': [lng, lat], 'speed': speed}
+
+
+class MovedDistanceTest(unittest.TestCase):
+
+    def test_distance(self):
+        self.assertEqual(moved_distance([120.0, 30.0], [120.0, 30.0]), 0)
+        self.assertAlmostEqual(moved_distance([120.0, 30.0], [120.0, 30.001]), 111.2, places=1)
+
+
+class PositionFanoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fanout = PositionFanout(window=1, threshold=10, keyframe_interval=60, stale_after=300)
+        # first frame is a keyframe
+        self.fanout.add([position('A', 120.0, 30.0), position('B', 121.0, 31.0, speed=0)], now=100)
+
+    def test_first_frame_is_keyframe(self):
+        fanout = PositionFanout()
+        message = fanout.add([position('A', 120.0, 30.0)], now=100)
+        self.assertFalse(message['delta'])
+        self.assertEqual([p['plateNum'] for p in message['data']], ['A'])
+
+    def test_frames_are_coalesced_over_window(self):
+        self.assertIsNone(self.fanout.add([position('A', 120.001, 30.0)], now=100.5))
+
+        message = self.fanout.add([position('A', 120.002, 30.0)], now=101)
+        self.assertTrue(message['delta'])
+        self.assertEqual(message['data'], [position('A', 120.002, 30.0)])
+
+    def test_delta_skips_vehicles_under_threshold(self):
+        message = self.fanout.add([position('A', 120.00001, 30.0), position('C', 122.0, 32.0)], now=101)
+        self.assertEqual([p['plateNum'] for p in message['data']], ['C'])
+
+        self.assertIsNone(self.fanout.add([position('A', 120.00002, 30.0)], now=102))
+
+    def test_delta_skips_stopped_vehicles(self):
+        self.assertIsNone(self.fanout.add([position('B', 121.1, 31.0, speed=0)], now=101))
+
+    def test_keyframe_has_stopped_vehicles_and_drops_stale_ones(self):
+        message = self.fanout.add([position('A', 120.0, 30.0)], now=160)
+        self.assertFalse(message['delta'])
+        self.assertEqual(sorted(p['plateNum'] for p in message['data']), ['A', 'B'])
+
+        message = self.fanout.add([position('A', 120.0, 30.0)], now=500)
+        self.assertEqual([p['plateNum'] for p in message['data']], ['A'])
+
+    def test_counters(self):
+        self.fanout.add([position('A', 120.01, 30.0)], now=101)
+        self.assertEqual(self.fanout.frames, 2)
+        self.assertEqual(self.fanout.received, 3)
+        self.assertEqual(self.fanout.delivered, 3)
@@ -0,0 +1,37 @@
+import unittest
+
+from geodistance import distance_matrix, pairwise_distances
+
+
+# haversine length of one degree on the mean earth radius
+METERS_PER_DEGREE = 111195.08
+
+
+class GeoDistanceTest(unittest.TestCase):
+
+    def test_one_degree_of_latitude(self):
+        distances = pairwise_distances([30.0], [120.0], [31.0], [120.0])
+        self.assertAlmostEqual(distances[0], METERS_PER_DEGREE, delta=1)
+
+    def test_one_degree_of_longitude_on_equator(self):
+        distances = pairwise_distances([0.0], [120.0], [0.0], [121.0])
+        self.assertAlmostEqual(distances[0], METERS_PER_DEGREE, delta=1)
+
+    def test_same_position(self):
+        distances = pairwise_distances([30.5, 40.1], [120.2, 116.3], [30.5, 40.1], [120.2, 116.3])
+        self.assertEqual(list(distances), [0, 0])
+
+    def test_matrix_of_positions_and_targets(self):
+        matrix = distance_matrix([30.0, 31.0], [120.0, 120.0], [30.0, 31.0, 32.0], [120.0, 120.0, 120.0])
+        self.assertEqual(matrix.shape, (2, 3))
+        self.assertAlmostEqual(matrix[0, 0], 0)
+        self.assertAlmostEqual(matrix[0, 2], 2 * METERS_PER_DEGREE, delta=2)
+        self.assertAlmostEqual(matrix[1, 0], matrix[0, 1])
+
+    def test_matrix_matches_pairwise(self):
+        lats, lngs = [30.1, 35.2, 39.9], [110.5, 115.0, 119.8]
+        target_lats, target_lngs = [31.0, 30.0, 38.0], [111.0, 118.0, 119.0]
+        matrix = distance_matrix(lats, lngs, target_lats, target_lngs)
+        distances = pairwise_distances(lats, lngs, target_lats, target_lngs)
+        for i in range(3):
+            self.assertAlmostEqual(matrix[i, i], distances[i])
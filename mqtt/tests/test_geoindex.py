@@ -0,0 +1,49 @@
+import unittest
+
+from geoindex import BlackDotIndex, meters_to_degrees
+
+
+def blackdot(station_id, latitude, longitude, radius):
+    return {'station_id': station_id, 'latitude': latitude, 'longitude': longitude, 'radius': radius}
+
+
+class MetersToDegreesTest(unittest.TestCase):
+
+    def test_longitude_degrees_widen_with_latitude(self):
+        lat_delta, lng_delta = meters_to_degrees(0, 1000)
+        self.assertAlmostEqual(lat_delta, lng_delta)
+
+        lat_delta, lng_delta = meters_to_degrees(60, 1000)
+        self.assertAlmostEqual(lng_delta, lat_delta * 2, places=4)
+
+
+class BlackDotIndexTest(unittest.TestCase):
+
+    def test_candidates_of_position_in_bbox(self):
+        index = BlackDotIndex([blackdot(1, 30.0, 120.0, 100)])
+        self.assertEqual([b['station_id'] for b in index.candidates(30.0005, 120.0005)], [1])
+
+    def test_no_candidates_of_position_out_of_bbox(self):
+        index = BlackDotIndex([blackdot(1, 30.0, 120.0, 100)])
+        self.assertEqual(index.candidates(30.01, 120.0), [])
+        self.assertEqual(index.candidates(30.0, 121.0), [])
+
+    def test_blackdot_spanning_cells(self):
+        # on the corner of four cells
+        index = BlackDotIndex([blackdot(1, 30.0, 120.0, 500)], cell_size=0.01)
+        for latitude, longitude in ((29.999, 119.999), (29.999, 120.001), (30.001, 119.999), (30.001, 120.001)):
+            self.assertEqual(len(index.candidates(latitude, longitude)), 1)
+
+    def test_candidates_keep_load_order(self):
+        index = BlackDotIndex([
+            blackdot(3, 30.0, 120.0, 200),
+            blackdot(1, 30.0001, 120.0001, 200),
+            blackdot(2, 30.0002, 120.0002, 200),
+        ])
+        self.assertEqual([b['station_id'] for b in index.candidates(30.0001, 120.0001)], [3, 1, 2])
+
+    def test_get(self):
+        index = BlackDotIndex([blackdot(1, 30.0, 120.0, None)])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.get(1)['latitude'], 30.0)
+        self.assertIsNone(index.get(2))
@@ -0,0 +1,103 @@
+import json
+import unittest
+
+from snapshot import (
+    PositionSnapshot, POSITION_SNAPSHOT_KEY, POSITION_DELTAS_KEY, VEHICLE_MOVING, VEHICLE_STOPPED
+)
+
+
+class MemoryRedis:
+    """
+    The redis commands PositionSnapshot runs, in memory
+    """
+    def __init__(self):
+        self.data = {}
+
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def expire(self, key, ttl):
+        pass
+
+    def hmset(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zremrangebyrank(self, key, start, end):
+        members = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        del members[start:len(members) + end + 1]
+        self.data[key] = dict(members)
+
+    def pipeline(self):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+def position(plate_num, speed):
+    return {'plateNum': plate_num, 'lnglat': [120.0, 30.0], 'speed': speed}
+
+
+def message(positions, delta):
+    return {'type': 'notify_monitor', 'notification_type': 'position', 'delta': delta, 'data': positions}
+
+
+class PositionSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = MemoryRedis()
+        self.snapshot = PositionSnapshot(self.redis, max_deltas=2)
+
+    def get_snapshot(self):
+        return {
+            plate_num: json.loads(value)
+            for plate_num, value in self.redis.data.get(POSITION_SNAPSHOT_KEY, {}).items()
+        }
+
+    def test_messages_are_sequenced(self):
+        first = self.snapshot.publish(message([position('A', 30)], True), [position('A', 30)])
+        second = self.snapshot.publish(message([position('A', 40)], True), [position('A', 40)])
+        self.assertEqual((first['seq'], second['seq']), (1, 2))
+        self.assertEqual(self.get_snapshot()['A']['seq'], 2)
+
+    def test_stopped_vehicles_of_frame_are_recorded(self):
+        frame = [position('A', 30), position('B', 0)]
+        self.snapshot.publish(message([position('A', 30)], True), frame)
+
+        snapshot = self.get_snapshot()
+        self.assertEqual(snapshot['A']['status'], VEHICLE_MOVING)
+        self.assertEqual(snapshot['B']['status'], VEHICLE_STOPPED)
+
+    def test_frame_without_message_is_recorded(self):
+        self.assertIsNone(self.snapshot.publish(None, [position('B', 0)]))
+        self.assertIn('B', self.get_snapshot())
+        self.assertNotIn(POSITION_DELTAS_KEY, self.redis.data)
+
+    def test_keyframe_replaces_snapshot(self):
+        self.snapshot.publish(message([position('A', 30)], True), [position('A', 30)])
+        self.snapshot.publish(message([position('B', 0), position('C', 20)], False), [position('C', 20)])
+        self.assertEqual(sorted(self.get_snapshot()), ['B', 'C'])
+
+    def test_last_deltas_are_kept(self):
+        for speed in (10, 20, 30):
+            self.snapshot.publish(message([position('A', speed)], True), [position('A', speed)])
+
+        deltas = sorted(self.redis.data[POSITION_DELTAS_KEY].values())
+        self.assertEqual(deltas, [2, 3])
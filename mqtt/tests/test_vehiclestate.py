@@ -0,0 +1,24 @@
+import unittest
+
+from vehiclestate import VehicleStateStore, VEHICLE_STATE_KEY
+from tests.test_snapshot import MemoryRedis
+
+
+class VehicleStateStoreTest(unittest.TestCase):
+
+    def test_update(self):
+        """
+         - fields of the frame are set
+         - fields the frame does not carry, e.g. merged from G7, are kept
+        """
+        redis = MemoryRedis()
+        key = VEHICLE_STATE_KEY.format('A')
+        redis.hmset(key, {'address': 'address', 'acc': 1, 'lng': 119.0})
+
+        VehicleStateStore(redis).update([{'plateNum': 'A', 'lng': 120.0, 'lat': 30.0, 'speed': 40}])
+
+        state = redis.data[key]
+        self.assertEqual((state['lng'], state['lat'], state['speed']), (120.0, 30.0, 40))
+        self.assertEqual((state['address'], state['acc']), ('address', 1))
+        self.assertNotIn('gps', state)
+        self.assertIn('updated', state)
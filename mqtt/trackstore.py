@@ -0,0 +1,112 @@
+"""
+Vehicle track recording of the position bridge
+
+The points of the position frames are recorded in the track of the vehicle
+of the day, vehicle_vehicletrack rows by plate number & day holding the
+points as fixed-width records (see tms/vehicle/tracks.py for the format).
+
+A point is kept every TRACK_INTERVAL seconds at most. Points are buffered by
+plate & day and inserted as a new row of the track every FLUSH_INTERVAL
+seconds, so a flush never rewrites the points already stored; the tracks of
+the past days are replaced by the G7 ones when they are first played back,
+so a bridge downtime leaves no gap in them.
+"""
+import logging
+import pytz
+import struct
+import time
+from datetime import datetime
+from geodistance import pairwise_distances
+
+
+# time, lng, lat, speed, course, distance since the previous point in cm
+POINT_FORMAT = struct.Struct('<IiiHHI')
+COORDINATE_SCALE = 1000000
+
+TRACK_INTERVAL = 10
+FLUSH_INTERVAL = 60
+
+# days are cut in the TIME_ZONE of django, as tms/vehicle/tracks.py reads them
+TIME_ZONE = pytz.timezone('Asia/Shanghai')
+
+logger = logging.getLogger('mqtt.position')
+
+
+class TrackBuffer:
+
+    def __init__(self, interval=TRACK_INTERVAL, flush_interval=FLUSH_INTERVAL, debug=False):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.debug = debug
+        self.last_points = {}
+        self.points = {}
+        self.last_flushed = time.monotonic()
+
+    def add(self, vehicles):
+        """
+        Buffer the points of the position frame
+        """
+        added = []
+        for vehicle in vehicles:
+            point_time = int(vehicle.get('gpstime') or time.time() * 1000) // 1000
+            last_point = self.last_points.get(vehicle['plateNum'])
+            if last_point is not None and point_time - last_point[0] < self.interval:
+                continue
+
+            added.append((vehicle, point_time, last_point))
+
+        if not added:
+            return
+
+        distances = pairwise_distances(
+            [float(vehicle['lat']) for vehicle, point_time, last_point in added],
+            [float(vehicle['lng']) for vehicle, point_time, last_point in added],
+            [last_point[2] if last_point else float(vehicle['lat']) for vehicle, point_time, last_point in added],
+            [last_point[1] if last_point else float(vehicle['lng']) for vehicle, point_time, last_point in added]
+        )
+        for (vehicle, point_time, last_point), distance in zip(added, distances):
+            lng, lat = float(vehicle['lng']), float(vehicle['lat'])
+            day = datetime.fromtimestamp(point_time, TIME_ZONE).date()
+            self.last_points[vehicle['plateNum']] = (point_time, lng, lat)
+            self.points.setdefault((vehicle['plateNum'], day), []).append(POINT_FORMAT.pack(
+                point_time,
+                int(round(lng * COORDINATE_SCALE)),
+                int(round(lat * COORDINATE_SCALE)),
+                min(int(round(float(vehicle['speed']))), 0xffff),
+                int(float(vehicle.get('course') or 0)) % 360,
+                int(round(distance * 100)) if last_point is not None else 0
+            ))
+
+    def is_due(self):
+        return time.monotonic() - self.last_flushed >= self.flush_interval
+
+    def flush(self, db_pool):
+        """
+        Append the buffered points to the tracks; they are dropped if the
+        db is down, the playback fetches the missing spans from G7
+        """
+        self.last_flushed = time.monotonic()
+        points, self.points = self.points, {}
+        if not points:
+            return
+
+        connection = None
+        try:
+            connection = db_pool.getconn()
+            cursor = connection.cursor()
+            for (plate_num, day), day_points in points.items():
+                db_pool.execute(cursor, 'append_track', (
+                    plate_num, day, POINT_FORMAT.unpack(day_points[0])[0], b''.join(day_points)
+                ))
+            connection.commit()
+        except Exception as e:
+            if connection is not None:
+                connection.rollback()
+            logger.warning(
+                '[Track]: %s points of %s tracks dropped: %s',
+                sum(len(day_points) for day_points in points.values()), len(points), e
+            )
+            if self.debug:
+                print(f'[Track]: {e}')
+        finally:
+            db_pool.putconn(connection)
@@ -0,0 +1,73 @@
+"""
+Live state of every vehicle for the vehicle & order position apis
+
+The bridge records the last position frame of every vehicle in the redis
+hash VEHICLE_STATE_KEY of its plate number:
+ - lng, lat, speed, course: last position
+ - acc, gps: ACC & GPS status, if the frame carries them
+ - time, gpsno, address: gps time, device number and address, if the frame
+   carries them
+ - updated: unix time the bridge received the frame
+
+Only the fields of the frame are set, the other ones, e.g. the address got
+from G7, are kept. The apis read the hash and call G7 for the vehicles
+without a state or whose state is older than VEHICLE_STATE_MAX_AGE, merging
+the G7 result back unless the bridge recorded a later frame meanwhile (see
+tms/g7/states.py). The key and ttl are copies of the django ones in
+tms/core/redis.py, keep them the same.
+"""
+import time
+import redis
+
+
+VEHICLE_STATE_KEY = 'vehicle:state:{}'
+
+# states of vehicles not sending positions anymore are dropped
+VEHICLE_STATE_TTL = 24 * 60 * 60
+
+# frame field -> state field
+STATE_FIELDS = {
+    'lng': 'lng',
+    'lat': 'lat',
+    'speed': 'speed',
+    'course': 'course',
+    'acc': 'acc',
+    'gps': 'gps',
+    'gpstime': 'time',
+    'gpsno': 'gpsno',
+    'address': 'address',
+}
+
+
+class VehicleStateStore:
+
+    def __init__(self, redis_client, ttl=VEHICLE_STATE_TTL, debug=False):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.debug = debug
+
+    def get_state(self, vehicle, updated):
+        state = {}
+        for frame_field, field in STATE_FIELDS.items():
+            if vehicle.get(frame_field) is not None:
+                state[field] = vehicle[frame_field]
+
+        state['updated'] = updated
+        return state
+
+    def update(self, vehicles):
+        """
+        Record the vehicles of the position frame, the frame is skipped if
+        redis is down
+        """
+        updated = time.time()
+        try:
+            pipe = self.redis.pipeline()
+            for vehicle in vehicles:
+                key = VEHICLE_STATE_KEY.format(vehicle['plateNum'])
+                pipe.hmset(key, self.get_state(vehicle, updated))
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            if self.debug:
+                print(f'[VehicleState]: {e}')
@@ -1,21 +1,16 @@
-import json
 from django.dispatch import receiver
 from django.db.models.signals import post_save
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 # constants
 from ..core import constants as c
 
 # models
 from . import models as m
+from ..notification.outbox import enqueue
 
 # serializers
 
 
-channel_layer = get_channel_layer()
-
-
 @receiver(post_save, sender=m.VehicleRepairRequest)
 def notify_vehicle_request(sender, instance, created, **kwargs):
     if created:
@@ -25,18 +20,10 @@ def notify_vehicle_request(sender, instance, created, **kwargs):
             instance.vehicle.plate_num,
         )
 
-        for approver in instance.request.approvers.all():
-            if approver.channel_name:
-                async_to_sync(channel_layer.send)(
-                    approver.channel_name,
-                    {
-                        'type': 'notify',
-                        'data': json.dumps({
-                            'msg_type': message_type,
-                            'message': message
-                        })
-                    }
-                )
+        enqueue(instance.request.approvers.values_list('id', flat=True), {
+            'msg_type': message_type,
+            'message': message
+        })
 
 
 @receiver(post_save, sender=m.RestRequest)
@@ -51,19 +38,10 @@ def notify_rest_request(sender, instance, created, **kwargs):
         )
         print(message)
 
-        for approver in instance.request.approvers.all():
-            if approver.channel_name:
-                print(approver.channel_name)
-                async_to_sync(channel_layer.send)(
-                    approver.channel_name,
-                    {
-                        'type': 'notify',
-                        'data': json.dumps({
-                            'msg_type': message_type,
-                            'message': message
-                        })
-                    }
-                )
+        enqueue(instance.request.approvers.values_list('id', flat=True), {
+            'msg_type': message_type,
+            'message': message
+        })
 
 
 # @receiver(post_save, sender=m.ParkingRequest)
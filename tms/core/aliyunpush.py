@@ -1,15 +1,75 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from aliyunsdkpush.request.v20160801 import PushRequest
 from aliyunsdkcore import client
+from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
 from django.conf import settings
 
 
+# devices per push request, aliyun accepts up to 1000 comma joined device ids
+PUSH_BATCH_SIZE = 1000
+PUSH_WORKERS = 4
+PUSH_RETRIES = 3
+PUSH_RETRY_DELAY = 1
+
 aliyun_client = client.AcsClient(
     settings.ALIYUN_ACCESS_KEY_ID,
     settings.ALIYUN_ACCESS_KEY_SECRET,
     'cn-hangzhou'
 )
-aliyun_request = PushRequest.PushRequest()
-aliyun_request.set_AppKey(settings.ALIYUN_MOBILE_PUSH_APP_KEY)
-aliyun_request.set_Target('ALL')
-aliyun_request.set_DeviceType('ANDROID')
-aliyun_request.set_PushType('NOTICE')
+
+# threads are started on the first push, i.e. after celery forked its workers
+push_executor = ThreadPoolExecutor(max_workers=PUSH_WORKERS)
+
+
+def new_push_request(title, body, device_tokens):
+    """
+    Requests are not shared between pushes as they run concurrently
+    """
+    request = PushRequest.PushRequest()
+    request.set_AppKey(settings.ALIYUN_MOBILE_PUSH_APP_KEY)
+    request.set_Target('DEVICE')
+    request.set_TargetValue(','.join(device_tokens))
+    request.set_DeviceType('ANDROID')
+    request.set_PushType('NOTICE')
+    request.set_Title(title)
+    request.set_Body(body)
+    return request
+
+
+def push(title, body, device_tokens):
+    for attempt in range(PUSH_RETRIES):
+        try:
+            return aliyun_client.do_action_with_exception(
+                new_push_request(title, body, device_tokens)
+            )
+        except (ClientException, ServerException):
+            if attempt == PUSH_RETRIES - 1:
+                raise
+
+            time.sleep(PUSH_RETRY_DELAY * 2 ** attempt)
+
+
+def submit_push_notifications(title, body, device_tokens):
+    """
+    Push to the devices on the push threads with a request per
+    PUSH_BATCH_SIZE devices, return the futures of the requests
+    """
+    device_tokens = list(device_tokens)
+    return [
+        push_executor.submit(push, str(title), str(body), device_tokens[i:i + PUSH_BATCH_SIZE])
+        for i in range(0, len(device_tokens), PUSH_BATCH_SIZE)
+    ]
+
+
+def wait_push_notifications(futures):
+    """
+    Return the errors of the requests which failed every retry once all of
+    them are done
+    """
+    done, _ = wait(futures)
+    return [future.exception() for future in done if future.exception() is not None]
+
+
+def push_notifications(title, body, device_tokens):
+    return wait_push_notifications(submit_push_notifications(title, body, device_tokens))
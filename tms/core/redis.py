@@ -1,7 +1,124 @@
+import json
 import redis
+from django.db import transaction
 
 
 r = redis.StrictRedis(host='localhost', port=6379, db=15)
-r.set('blackdot', 'updated')
-# r.set('vehicle', 'updated')
-r.set('is_jobs', 'updated')
+
+# G7 MQTT bridges subscribe to this channel to keep their in-memory caches
+# up to date, see mqtt/invalidation.py
+INVALIDATION_CHANNEL = 'asgimqtt:invalidation'
+
+INVALIDATION_STATION = 'station'
+INVALIDATION_JOB = 'job'
+INVALIDATION_VEHICLE = 'vehicle'
+INVALIDATION_VEHICLE_WORKERS = 'vehicle_workers'
+
+
+def publish_invalidation(invalidation_type, **kwargs):
+    """
+    Publish the invalidation once the current transaction is committed, so
+    the bridges never reload the data before the change is visible to them
+    """
+    kwargs['type'] = invalidation_type
+    message = json.dumps(kwargs)
+    transaction.on_commit(lambda: r.publish(INVALIDATION_CHANNEL, message))
+
+
+# G7 position bridge records the positions sent to the monitor group,
+# see mqtt/snapshot.py
+POSITION_SNAPSHOT_KEY = 'position:snapshot'
+POSITION_DELTAS_KEY = 'position:deltas'
+POSITION_SEQ_KEY = 'position:seq'
+
+
+def get_position_snapshot():
+    """
+    Return the last sequence number and last known position of the vehicles
+    """
+    pipe = r.pipeline()
+    pipe.get(POSITION_SEQ_KEY)
+    pipe.hvals(POSITION_SNAPSHOT_KEY)
+    seq, positions = pipe.execute()
+    return int(seq or 0), [json.loads(position) for position in positions]
+
+
+def get_position_deltas(since):
+    """
+    Return the position messages after since, or None if any of them is
+    not kept anymore
+    """
+    pipe = r.pipeline()
+    pipe.get(POSITION_SEQ_KEY)
+    pipe.zrange(POSITION_DELTAS_KEY, 0, 0, withscores=True)
+    pipe.zrangebyscore(POSITION_DELTAS_KEY, f'({since}', '+inf')
+    seq, oldest, deltas = pipe.execute()
+
+    seq = int(seq or 0)
+    if since > seq:
+        # sequence was reset, e.g. redis was flushed
+        return None
+
+    if since == seq:
+        return []
+
+    if not oldest or oldest[0][1] > since + 1:
+        return None
+
+    return [json.loads(delta) for delta in deltas]
+
+
+# viewport scoped position subscriptions of the sockets, see mqtt/subscriptions.py
+POSITION_SUBSCRIPTIONS_KEY = 'position:subscriptions'
+POSITION_SUBSCRIPTIONS_VERSION_KEY = 'position:subscriptions:version'
+
+
+def set_position_subscription(channel_name, bbox=None, plates=None):
+    pipe = r.pipeline()
+    pipe.hset(
+        POSITION_SUBSCRIPTIONS_KEY, channel_name,
+        json.dumps({'bbox': bbox, 'plates': plates})
+    )
+    pipe.incr(POSITION_SUBSCRIPTIONS_VERSION_KEY)
+    pipe.execute()
+
+
+def delete_position_subscription(channel_name):
+    pipe = r.pipeline()
+    pipe.hdel(POSITION_SUBSCRIPTIONS_KEY, channel_name)
+    pipe.incr(POSITION_SUBSCRIPTIONS_VERSION_KEY)
+    pipe.execute()
+
+
+# live vehicle states recorded by the G7 position bridge and merged with the
+# G7 ones by g7/states.py, see mqtt/vehiclestate.py
+VEHICLE_STATE_KEY = 'vehicle:state:{}'
+VEHICLE_STATE_TTL = 24 * 60 * 60
+
+
+# per user notification counters, see notification/counters.py; the G7
+# position bridge increments them with the same INCREMENT_SCRIPT, see
+# mqtt/notificationcounts.py
+NOTIFICATION_COUNTS_KEY = 'notification:counts:{}'
+NOTIFICATION_COUNTS_TTL = 24 * 60 * 60
+
+# only increments an existing hash; incrementing a missing one would create
+# it with partial counts
+NOTIFICATION_COUNTS_INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'unread', ARGV[1])
+    redis.call('HINCRBY', KEYS[1], 'read', ARGV[2])
+end
+"""
+
+# stores the counts got from the db only if the hash is still missing, so it
+# never overwrites increments applied meanwhile; KEYS are the counters, ARGV
+# the ttl then the unread & read counts of each
+NOTIFICATION_COUNTS_STORE_SCRIPT = """
+for index, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('HMSET', key, 'unread', ARGV[index * 2], 'read', ARGV[index * 2 + 1])
+        redis.call('EXPIRE', key, ARGV[1])
+    end
+end
+"""
@@ -0,0 +1,193 @@
+"""
+Shared cache of the G7 api responses
+
+Responses of the apis in CACHE_TTLS are kept in redis for their ttl, so the
+users opening the same pages share them. Queries of a closed time range,
+i.e. whose 'to' is older than CLOSED_RANGE_DELAY, never change and are kept
+for CLOSED_RANGE_TTL.
+
+Identical calls are coalesced: the first caller takes the lock of the call
+and calls G7, the others wait for its response until WAIT_TIMEOUT and call
+G7 themselves if it is not there by then.
+
+Track queries are not cached, the tracks are stored in the db, see
+tms/vehicle/tracks.py.
+
+Hits (coalesced calls included), misses, coalesced calls, upstream calls &
+errors, and the total upstream time in ms are counted by api in the
+STATS_KEY hash:
+
+    python manage.py g7_cache_stats
+"""
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from redis import RedisError
+
+from ..core.redis import r
+
+
+CACHE_KEY = 'g7:cache:{}:{}'
+LOCK_KEY = 'g7:cache:lock:{}:{}'
+STATS_KEY = 'g7:cache:stats'
+
+# api name -> seconds the responses are cached
+CACHE_TTLS = {
+    'VEHICLE_STATUS_INQUIRY': 10,
+    'BULK_VEHICLE_STATUS_INQUIRY': 10,
+    'VEHICLE_STATUS_BY_GPS': 10,
+    'BULK_VEHICLE_STATUS_BY_GPS': 10,
+    'VEHICLE_GPS_TOTAL_MILEAGE_INQUIRY': 60,
+    'VEHICLE_GPS_DAILY_MILEAGE_INQUIRY': 60,
+}
+
+# G7 may receive the points of a time range some minutes late
+CLOSED_RANGE_DELAY = timedelta(minutes=10)
+CLOSED_RANGE_TTL = 24 * 60 * 60
+
+# seconds the lock of a call is held at most, i.e. G7 timeout
+LOCK_TIMEOUT = 30
+
+# seconds a coalesced call waits for the response before calling G7 itself;
+# waiters hold a thread of the bulk executor, so it is kept short
+WAIT_TIMEOUT = 2
+WAIT_INTERVAL = 0.05
+
+STAT_FIELDS = ('hits', 'misses', 'coalesced', 'upstream_calls', 'upstream_errors', 'upstream_ms')
+
+
+def get_call_hash(body, queries):
+    return hashlib.sha1(
+        json.dumps([body, queries], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def is_closed_range(body, queries):
+    for params in (queries, body):
+        if isinstance(params, dict) and params.get('to'):
+            try:
+                to = datetime.strptime(params['to'], '%Y-%m-%d %H:%M:%S')
+            except (TypeError, ValueError):
+                return False
+
+            return to < datetime.now() - CLOSED_RANGE_DELAY
+
+    return False
+
+
+def get_ttl(api_name, body, queries):
+    """
+    Return seconds to cache the response of the call, or None
+    """
+    if api_name not in CACHE_TTLS:
+        return None
+
+    if is_closed_range(body, queries):
+        return CLOSED_RANGE_TTL
+
+    return CACHE_TTLS[api_name]
+
+
+def count(api_name, field, amount=1):
+    try:
+        r.hincrby(STATS_KEY, f'{api_name}:{field}', amount)
+    except RedisError:
+        pass
+
+
+def call_upstream(api_name, call):
+    started = time.time()
+    try:
+        return call()
+    except Exception:
+        count(api_name, 'upstream_errors')
+        raise
+    finally:
+        pipe = r.pipeline()
+        pipe.hincrby(STATS_KEY, f'{api_name}:upstream_calls', 1)
+        pipe.hincrby(STATS_KEY, f'{api_name}:upstream_ms', int((time.time() - started) * 1000))
+        try:
+            pipe.execute()
+        except RedisError:
+            pass
+
+
+def wait_response(key, lock_key):
+    """
+    Return the cached response once the lock holder stored it, or None if
+    the lock is released without it or WAIT_TIMEOUT is over
+    """
+    deadline = time.time() + WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        pipe = r.pipeline()
+        pipe.get(key)
+        pipe.exists(lock_key)
+        response, locked = pipe.execute()
+        if response is not None:
+            return response
+        if not locked:
+            return None
+
+    return None
+
+
+def cached_call(api_name, body, queries, call):
+    """
+    Return the response of call() of the api, cached if the api has a ttl
+    """
+    ttl = get_ttl(api_name, body, queries)
+    if ttl is None:
+        return call()
+
+    call_hash = get_call_hash(body, queries)
+    key = CACHE_KEY.format(api_name, call_hash)
+    lock_key = LOCK_KEY.format(api_name, call_hash)
+    locked = False
+    try:
+        response = r.get(key)
+        if response is None:
+            locked = r.set(lock_key, 1, nx=True, ex=LOCK_TIMEOUT)
+            if not locked:
+                response = wait_response(key, lock_key)
+                if response is not None:
+                    count(api_name, 'coalesced')
+    except RedisError:
+        return call_upstream(api_name, call)
+
+    if response is not None:
+        count(api_name, 'hits')
+        return json.loads(response)
+
+    count(api_name, 'misses')
+    try:
+        data = call_upstream(api_name, call)
+        if data is not None:
+            r.set(key, json.dumps(data), ex=ttl)
+    except RedisError:
+        pass
+    finally:
+        if locked:
+            try:
+                r.delete(lock_key)
+            except RedisError:
+                pass
+
+    return data
+
+
+def get_stats():
+    """
+    Return api name -> counters
+    """
+    stats = {}
+    for field, value in r.hgetall(STATS_KEY).items():
+        api_name, field = field.decode('utf-8').rsplit(':', 1)
+        stats.setdefault(api_name, dict.fromkeys(STAT_FIELDS, 0))[field] = int(value)
+
+    return stats
+
+
+def reset_stats():
+    r.delete(STATS_KEY)
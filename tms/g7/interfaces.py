@@ -1,44 +1,90 @@
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from django.conf import settings
 
 from com.chinawayltd.api.gateway.sdk import client
 from com.chinawayltd.api.gateway.sdk.http import request
+from com.chinawayltd.api.gateway.sdk.http.pool import ConnectionPool
 from com.chinawayltd.api.gateway.sdk.common import constant
 
+from . import cache
 from .endpoints import G7_HTTP_ENDPOINTS
 
 
+# keep-alive connections to G7 shared by the clients of all threads
+g7_connection_pool = ConnectionPool(max_size=settings.G7_HTTP_POOL_SIZE)
+
 vehicle_basic_client = client.DefaultClient(
     app_key=settings.G7_HTTP_VEHICLE_BASIC_ACCESS_ID,
-    app_secret=settings.G7_HTTP_VEHICLE_BASIC_SECRET
+    app_secret=settings.G7_HTTP_VEHICLE_BASIC_SECRET,
+    pool=g7_connection_pool
 )
 
 vehicle_data_client = client.DefaultClient(
     app_key=settings.G7_HTTP_VEHICLE_DATA_ACCESS_ID,
-    app_secret=settings.G7_HTTP_VEHICLE_DATA_SECRET
+    app_secret=settings.G7_HTTP_VEHICLE_DATA_SECRET,
+    pool=g7_connection_pool
 )
 
+G7_HTTP_CLIENTS = {
+    'VEHICLE_BASIC': vehicle_basic_client,
+    'VEHICLE_DATA': vehicle_data_client,
+}
+
+# api name -> (client, endpoint)
+G7_HTTP_APIS = {
+    name: (G7_HTTP_CLIENTS[module_name], api)
+    for module_name, module in G7_HTTP_ENDPOINTS.items()
+    for name, api in module.items()
+    if module_name in G7_HTTP_CLIENTS
+}
+
+# bulk apis accept up to 100 plate numbers per call
+BULK_CHUNK_SIZE = 100
+BULK_WORKERS = 8
+BULK_RETRIES = 2
+BULK_RETRY_DELAY = 0.5
+
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_WORKERS)
+
+
+class G7BulkResult:
+    """
+    Merged data of the chunk calls of a bulk api, and the plate numbers &
+    errors of the chunks which failed every retry
+    """
+    def __init__(self):
+        self.data = {}
+        self.chunks = 0
+        self.failed_plate_nums = []
+        self.errors = []
+
+    @property
+    def is_partial(self):
+        return len(self.errors) > 0
+
 
 class G7Interface:
 
     @staticmethod
     def call_g7_http_interface(api_name, body=None, queries=None):
-        cli = None
-        api_call = None
-
-        for module_name, module in G7_HTTP_ENDPOINTS.items():
-            for name, api in module.items():
-                if name == api_name:
-                    if module_name == 'VEHICLE_BASIC':
-                        cli = vehicle_basic_client
-                    elif module_name == 'VEHICLE_DATA':
-                        cli = vehicle_data_client
-                    api_call = api
-                    break
-
-        if cli is None or api_call is None:
+        if api_name not in G7_HTTP_APIS:
             return
 
+        return cache.cached_call(
+            api_name, body, queries,
+            partial(G7Interface.request_g7_http_interface, api_name, body, queries)
+        )
+
+    @staticmethod
+    def request_g7_http_interface(api_name, body=None, queries=None):
+        """
+        Call the api without the cache
+        """
+        cli, api_call = G7_HTTP_APIS[api_name]
+
         req = request.Request(
             host=settings.G7_HTTP_HOST,
             protocol=constant.HTTP,
@@ -72,3 +118,46 @@ class G7Interface:
         except Exception:
             raise
             # TODO: logging
+
+    @staticmethod
+    def call_g7_chunk_interface(api_name, body, retries):
+        for attempt in range(retries + 1):
+            try:
+                return G7Interface.call_g7_http_interface(api_name, body=body)
+            except Exception:
+                if attempt == retries:
+                    raise
+
+                time.sleep(BULK_RETRY_DELAY * 2 ** attempt)
+
+    @staticmethod
+    def call_g7_bulk_interface(api_name, plate_nums, body=None,
+                               chunk_size=BULK_CHUNK_SIZE, retries=BULK_RETRIES):
+        """
+        Call the bulk api with the plate numbers by chunk_size concurrently,
+        each chunk is retried on its own; return G7BulkResult
+        """
+        plate_nums = list(plate_nums)
+        chunks = [plate_nums[i:i + chunk_size] for i in range(0, len(plate_nums), chunk_size)]
+        futures = [
+            bulk_executor.submit(
+                G7Interface.call_g7_chunk_interface,
+                api_name, dict(body or {}, plate_nums=chunk), retries
+            )
+            for chunk in chunks
+        ]
+
+        result = G7BulkResult()
+        result.chunks = len(chunks)
+        for chunk, future in zip(chunks, futures):
+            try:
+                data = future.result()
+            except Exception as e:
+                result.failed_plate_nums += chunk
+                result.errors.append(e)
+                continue
+
+            if data:
+                result.data.update(data)
+
+        return result
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from tms.g7 import cache
+
+
+class Command(BaseCommand):
+    help = 'Show the G7 response cache counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Reset the counters after showing them'
+        )
+
+    def handle(self, *args, **options):
+        for api_name, stats in sorted(cache.get_stats().items()):
+            calls = stats['hits'] + stats['misses']
+            hit_ratio = stats['hits'] / calls * 100 if calls else 0
+            upstream_ms = stats['upstream_ms'] / stats['upstream_calls'] if stats['upstream_calls'] else 0
+            self.stdout.write(
+                '{}: {} hits, {} misses ({:.1f}% hits), {} coalesced, '
+                '{} upstream calls ({} errors, {:.0f}ms avg)'.format(
+                    api_name, stats['hits'], stats['misses'], hit_ratio, stats['coalesced'],
+                    stats['upstream_calls'], stats['upstream_errors'], upstream_ms
+                )
+            )
+
+        if options['reset']:
+            cache.reset_stats()
+            self.stdout.write('Reset the counters')
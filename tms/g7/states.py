@@ -0,0 +1,185 @@
+"""
+Live vehicle states recorded by the G7 position bridge, see mqtt/vehiclestate.py
+
+The vehicle & order position apis read the states instead of calling G7.
+Vehicles without a state, whose state is older than VEHICLE_STATE_MAX_AGE
+seconds or lacks a field the api needs, e.g. the address, are asked to G7
+and the result is merged back so the next calls read it.
+"""
+import json
+import time
+from django.conf import settings
+from redis import RedisError
+
+from .interfaces import G7Interface
+from ..core.redis import r, VEHICLE_STATE_KEY, VEHICLE_STATE_TTL
+
+LOC_FIELDS = ('lng', 'lat', 'speed', 'course', 'address')
+STATUS_FIELDS = ('acc', 'gps')
+
+POSITION_FIELDS = ('lng', 'lat', 'speed')
+
+# merges the G7 state into the stored one unless the stored one has a later
+# gps time, e.g. written by the bridge meanwhile; its missing fields are
+# filled in then
+STORE_SCRIPT = """
+for index, key in ipairs(KEYS) do
+    local state = cjson.decode(ARGV[index + 2])
+    local stored_time = tonumber(redis.call('HGET', key, 'time'))
+    local state_time = tonumber(state['time'])
+    if stored_time ~= nil and (state_time == nil or stored_time > state_time) then
+        for field, value in pairs(state) do
+            redis.call('HSETNX', key, field, value)
+        end
+    else
+        for field, value in pairs(state) do
+            redis.call('HSET', key, field, value)
+        end
+        redis.call('HSET', key, 'updated', ARGV[1])
+    end
+    redis.call('EXPIRE', key, ARGV[2])
+end
+"""
+
+store_script = r.register_script(STORE_SCRIPT)
+
+
+def decode_state(state):
+    state = {key.decode('utf-8'): value.decode('utf-8') for key, value in state.items()}
+    for field in ('lng', 'lat', 'speed', 'course', 'updated'):
+        if field in state:
+            state[field] = float(state[field])
+    for field in STATUS_FIELDS:
+        if field in state:
+            state[field] = int(float(state[field]))
+
+    return state
+
+
+def get_states(plate_nums, required=POSITION_FIELDS):
+    """
+    Return plate number -> state of the vehicles with an up to date state
+    having the required fields
+    """
+    plate_nums = list(plate_nums)
+    try:
+        pipe = r.pipeline(transaction=False)
+        for plate_num in plate_nums:
+            pipe.hgetall(VEHICLE_STATE_KEY.format(plate_num))
+        states = pipe.execute()
+    except RedisError:
+        return {}
+
+    oldest = time.time() - settings.VEHICLE_STATE_MAX_AGE
+    ret = {}
+    for plate_num, state in zip(plate_nums, states):
+        if not state:
+            continue
+
+        state = decode_state(state)
+        if state['updated'] >= oldest and all(field in state for field in required):
+            ret[plate_num] = state
+
+    return ret
+
+
+def store_states(states):
+    """
+    Merge back the plate number -> state of the vehicles got from G7
+    """
+    if not states:
+        return
+
+    try:
+        store_script(
+            keys=[VEHICLE_STATE_KEY.format(plate_num) for plate_num in states],
+            args=[time.time(), VEHICLE_STATE_TTL] + [
+                json.dumps({field: str(value) for field, value in state.items()})
+                for state in states.values()
+            ]
+        )
+    except RedisError:
+        pass
+
+
+def state_from_g7(data):
+    """
+    State of the vehicle status data of G7
+    """
+    state = {}
+    for field in LOC_FIELDS:
+        if (data.get('loc') or {}).get(field) is not None:
+            state[field] = data['loc'][field]
+    for field in STATUS_FIELDS:
+        if (data.get('status') or {}).get(field) is not None:
+            state[field] = data['status'][field]
+    for field in ('gpsno', 'time'):
+        if data.get(field) is not None:
+            state[field] = data[field]
+
+    return state
+
+
+def state_to_g7(state):
+    """
+    Vehicle status data of G7 of the state
+    """
+    data = {
+        'loc': {field: state[field] for field in LOC_FIELDS if field in state},
+        'status': {field: state[field] for field in STATUS_FIELDS if field in state},
+    }
+    for field in ('gpsno', 'time'):
+        if field in state:
+            data[field] = state[field]
+
+    return data
+
+
+def get_vehicles_status(plate_nums, required=POSITION_FIELDS, fields=('loc', 'status')):
+    """
+    Return the vehicle status of the vehicles as G7BulkResult whose data is
+    plate number -> {'code', 'plate_num', 'data'} as BULK_VEHICLE_STATUS_INQUIRY
+    returns
+    """
+    plate_nums = list(plate_nums)
+    states = get_states(plate_nums, required)
+    missing = [plate_num for plate_num in plate_nums if plate_num not in states]
+    result = G7Interface.call_g7_bulk_interface(
+        'BULK_VEHICLE_STATUS_INQUIRY', missing, body={'fields': list(fields)}
+    )
+
+    g7_states = {}
+    for value in result.data.values():
+        if value['code'] == 0 and value.get('data'):
+            g7_states[value['plate_num']] = state_from_g7(value['data'])
+
+    if g7_states:
+        store_states(g7_states)
+
+    for plate_num, state in states.items():
+        result.data[plate_num] = {'code': 0, 'plate_num': plate_num, 'data': state_to_g7(state)}
+
+    return result
+
+
+def get_vehicle_status(plate_num, required=POSITION_FIELDS):
+    """
+    Return the vehicle status of the vehicle as VEHICLE_STATUS_INQUIRY does
+    with the address, or None
+    """
+    state = get_states([plate_num], required).get(plate_num)
+    if state is not None:
+        return state_to_g7(state)
+
+    data = G7Interface.call_g7_http_interface(
+        'VEHICLE_STATUS_INQUIRY',
+        queries={
+            'plate_num': plate_num,
+            'fields': 'loc',
+            'addr_required': True,
+        }
+    )
+    if data is not None:
+        store_states({plate_num: state_from_g7(data)})
+
+    return data
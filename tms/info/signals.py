@@ -3,15 +3,14 @@ from django.db.models.signals import post_save, post_delete
 
 from . import models as m
 from ..route.models import Route
-from ..core.redis import r
-from ..core import constants as c
+from ..core.redis import publish_invalidation, INVALIDATION_STATION
 
 
 @receiver([post_save, post_delete], sender=m.Station)
 def notify_asgimqtt_of_station_changes(sender, instance, **kwargs):
-    if instance.station_type == c.STATION_TYPE_BLACK_DOT and\
-       r.get('blackdot') != b'updated':
-        r.set('blackdot', 'updated')
+    publish_invalidation(
+        INVALIDATION_STATION, id=instance.id, station_type=instance.station_type
+    )
 
 
 @receiver(post_delete, sender=m.Station)
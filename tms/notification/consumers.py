@@ -1,27 +1,95 @@
+import asyncio
 import json
+import logging
+from urllib.parse import parse_qs
+from redis import RedisError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
 # models
 from ..account.models import User
 from ..order.models import Order
 from ..core.constants import USER_TYPE_GUEST_DRIVER, USER_TYPE_GUEST_ESCORT
+from . import presence
+from .frames import get_position_encoder, MSGPACK_SUBPROTOCOL
+from ..core.redis import (
+    get_position_snapshot, get_position_deltas, set_position_subscription,
+    delete_position_subscription
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def in_bbox(lnglat, bbox):
+    lng, lat = float(lnglat[0]), float(lnglat[1])
+    return bbox[0] <= lng <= bbox[2] and bbox[1] <= lat <= bbox[3]
+
+
+def parse_subscription(content):
+    """
+    Return the bounding box and plate numbers of subscribe message, or None
+    if it is invalid
+    """
+    bbox = content.get('bbox')
+    plates = content.get('plates') or []
+    if bbox is not None:
+        try:
+            bbox = [float(value) for value in bbox]
+        except (TypeError, ValueError):
+            return None
+
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return None
+
+    if not isinstance(plates, list) or not all(isinstance(plate, str) for plate in plates):
+        return None
+
+    if bbox is None and not plates:
+        return None
+
+    return bbox, plates
 
 
 class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    The socket channel is registered in the user's presence, see presence.py
+    """
     async def connect(self):
-        try:
-            self.user_pk = self.scope['url_route']['kwargs']['user_pk']
-            user = User.objects.get(pk=self.user_pk)
-            user.channel_name = self.channel_name
-            user.save()
-            await self.accept()
-        except User.DoesNotExist:
+        self.refresh_task = None
+        self.user_pk = self.scope['url_route']['kwargs']['user_pk']
+        if not await database_sync_to_async(User.objects.filter(pk=self.user_pk).exists)():
             await self.close()
+            return
+
+        try:
+            await presence.async_add_channel(self.user_pk, self.channel_name)
+        except RedisError as e:
+            # registered by the next presence refresh
+            logger.warning('Presence of user %s not registered: %s', self.user_pk, e)
+
+        self.refresh_task = asyncio.ensure_future(self.refresh_presence())
+        await self.accept()
+
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(presence.PRESENCE_REFRESH_INTERVAL)
+            try:
+                await presence.async_add_channel(self.user_pk, self.channel_name)
+            except RedisError:
+                pass
 
     async def disconnect(self, close_code):
-        user = User.objects.get(pk=self.user_pk)
-        user.channel_name = ''
-        user.save()
+        if self.refresh_task is None:
+            return
+
+        self.refresh_task.cancel()
+        try:
+            await presence.async_remove_channel(self.user_pk, self.channel_name)
+        except RedisError:
+            pass
 
     def receive(self, text_data):
         pass
@@ -33,7 +101,32 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
 
 
 class PositionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    The first frame is the snapshot of the last known vehicle positions, then
+    position deltas follow with their sequence numbers. Reconnecting with
+    ?since=<seq> resumes with the missed deltas instead of the snapshot.
+
+    Positions are sent at most every MONITOR_POSITION_INTERVAL seconds per
+    socket; positions received in between are merged by plate number
+
+    A client may limit the positions to its map viewport and/or some vehicles,
+    a snapshot of the subscription follows:
+        {"type": "subscribe", "bbox": [min lng, min lat, max lng, max lat], "plates": [...]}
+        {"type": "unsubscribe"}
+    Subscribed sockets leave the monitor-position group and the bridge sends
+    them only their own vehicles, see mqtt/subscriptions.py
+
+    Clients asking for the tms.msgpack subprotocol get binary frames, see
+    frames.PositionFrameEncoder
+    """
     async def connect(self):
+        self.seq = 0
+        self.encoder = get_position_encoder(self.scope)
+        self.subscription = None
+        self.pending_positions = {}
+        self.pending_delta = True
+        self.last_position_sent = 0
+        self.flush_task = None
         try:
             user_pk = self.scope['url_route']['kwargs']['user_pk']
             self.user = User.objects.get(pk=user_pk)
@@ -41,71 +134,238 @@ class PositionConsumer(AsyncJsonWebsocketConsumer):
                 'monitor',
                 self.channel_name
             )
+            await self.channel_layer.group_add(
+                'monitor-position',
+                self.channel_name
+            )
 
-            await self.accept()
+            await self.accept(MSGPACK_SUBPROTOCOL if self.encoder is not None else None)
+            await self.send_initial_positions()
         except User.DoesNotExist:
             await self.close()
 
+    async def send_json(self, content, close=False):
+        if self.encoder is None:
+            await super().send_json(content, close=close)
+        else:
+            await self.send(bytes_data=self.encoder.encode(content), close=close)
+
+    async def send_initial_positions(self):
+        # messages are queued on the channel until connect returns, so any
+        # message newer than the snapshot is delivered afterwards
+        since = parse_qs(self.scope['query_string'].decode()).get('since')
+        deltas = None
+        try:
+            if since and since[0].isdigit():
+                deltas = await sync_to_async(get_position_deltas)(int(since[0]))
+
+            if deltas is not None:
+                for delta in deltas:
+                    await self.send_json({
+                        'notification_type': 'position',
+                        'delta': delta['delta'],
+                        'seq': delta['seq'],
+                        'content': delta['data']
+                    })
+                self.seq = deltas[-1]['seq'] if deltas else int(since[0])
+            else:
+                await self.send_snapshot()
+        except RedisError:
+            pass
+
+    async def send_snapshot(self):
+        self.seq, positions = await sync_to_async(get_position_snapshot)()
+        await self.send_json({
+            'notification_type': 'snapshot',
+            'seq': self.seq,
+            'content': self.subscribed_positions(positions)
+        })
+
+    def subscribed_positions(self, positions):
+        if self.subscription is None:
+            return positions
+
+        bbox, plates = self.subscription
+        return [
+            position for position in positions
+            if position['plateNum'] in plates or (bbox is not None and in_bbox(position['lnglat'], bbox))
+        ]
+
     async def disconnect(self, close_code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+
+        if self.subscription is not None:
+            try:
+                await sync_to_async(delete_position_subscription)(self.channel_name)
+            except RedisError:
+                pass
+
         await self.channel_layer.group_discard(
             'monitor',
             self.channel_name
         )
+        await self.channel_layer.group_discard(
+            'monitor-position',
+            self.channel_name
+        )
 
-    async def receive(self, text_data):
-        pass
+    async def receive_json(self, content):
+        if content.get('type') == 'subscribe':
+            subscription = parse_subscription(content)
+            if subscription is not None:
+                await self.subscribe(*subscription)
+        elif content.get('type') == 'unsubscribe':
+            await self.unsubscribe()
+
+    async def subscribe(self, bbox, plates):
+        try:
+            await sync_to_async(set_position_subscription)(self.channel_name, bbox, plates)
+        except RedisError:
+            return
+
+        if self.subscription is None:
+            await self.channel_layer.group_discard(
+                'monitor-position',
+                self.channel_name
+            )
+
+        # positions pending for the former subscription are replaced by the snapshot
+        self.subscription = (bbox, set(plates))
+        self.pending_positions = {}
+        self.pending_delta = True
+        try:
+            await self.send_snapshot()
+        except RedisError:
+            pass
+
+    async def unsubscribe(self):
+        if self.subscription is None:
+            return
+
+        self.subscription = None
+        await self.channel_layer.group_add(
+            'monitor-position',
+            self.channel_name
+        )
+        try:
+            await sync_to_async(delete_position_subscription)(self.channel_name)
+            await self.send_snapshot()
+        except RedisError:
+            pass
 
     async def notify_monitor(self, event):
+        if event['notification_type'] != 'position':
+            await self.send_json({
+                'notification_type': event['notification_type'],
+                'content': event['data']
+            })
+            return
+
+        # already sent with the snapshot or resumed deltas
+        seq = event.get('seq')
+        if seq is not None:
+            if seq <= self.seq:
+                return
+            self.seq = seq
+
+        # guest vehicle positions are sent to the monitor group
+        positions = self.subscribed_positions(event['data'])
+        if not positions:
+            return
+
+        # the merged positions are a delta only if every merged message is,
+        # messages without delta are single vehicle updates, e.g. of guests
+        self.pending_delta = self.pending_delta and event.get('delta', True)
+        for position in positions:
+            self.pending_positions[position['plateNum']] = position
+
+        if self.flush_task is not None:
+            return
+
+        wait = self.last_position_sent + settings.MONITOR_POSITION_INTERVAL - asyncio.get_event_loop().time()
+        if wait > 0:
+            self.flush_task = asyncio.ensure_future(self.flush_positions_later(wait))
+        else:
+            await self.flush_positions()
+
+    async def flush_positions_later(self, wait):
+        await asyncio.sleep(wait)
+        self.flush_task = None
+        await self.flush_positions()
+
+    async def flush_positions(self):
+        positions = list(self.pending_positions.values())
+        delta = self.pending_delta
+        self.pending_positions = {}
+        self.pending_delta = True
+        if not positions:
+            return
+
+        self.last_position_sent = asyncio.get_event_loop().time()
         await self.send_json({
-            'notification_type': event['notification_type'],
-            'content': event['data']
+            'notification_type': 'position',
+            'delta': delta,
+            'seq': self.seq,
+            'content': positions
         })
 
 
 class CustomerJobPositionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Positions of the order's vehicles, the position bridge sends them to the
+    order-<id> group while their jobs are in progress
+
+    Clients asking for the tms.msgpack subprotocol get binary frames, see
+    frames.PositionFrameEncoder
+    """
     async def connect(self):
-        try:
-            user_pk = self.scope['url_route']['kwargs']['user_pk']
-            self.user = User.objects.get(pk=user_pk)
-        except User.DoesNotExist:
+        self.group_name = None
+        self.encoder = get_position_encoder(self.scope)
+        order = await self.get_order(
+            self.scope['url_route']['kwargs']['user_pk'],
+            self.scope['url_route']['kwargs']['order_pk']
+        )
+        if order is None:
             await self.close()
+            return
 
-        try:
-            order_pk = self.scope['url_route']['kwargs']['order_pk']
-            order = Order.availables.get(pk=order_pk)
+        self.group_name = f'order-{order.pk}'
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
 
-            self.vehicles = order.jobs.filter(progress__gt=1).values_list(
-                'vehicle__plate_num', flat=True
-            )
+        await self.accept(MSGPACK_SUBPROTOCOL if self.encoder is not None else None)
 
-            await self.channel_layer.group_add(
-                'position',
-                self.channel_name
-            )
+    @database_sync_to_async
+    def get_order(self, user_pk, order_pk):
+        if not User.objects.filter(pk=user_pk).exists():
+            return None
 
-            await self.accept()
-        except Order.DoesNotExist:
-            await self.close()
+        return Order.availables.filter(pk=order_pk).first()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            'position',
-            self.channel_name
-        )
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
 
     async def receive(self, text_data):
         pass
 
-    async def notify_position(self, event):
-        data = event['data']
-        for vehicle in data:
-            if vehicle['plateNum'] not in self.vehicles:
-                data.remove(vehicle)
+    async def notify_order(self, event):
+        if self.encoder is not None:
+            await self.send(bytes_data=self.encoder.encode({
+                'notification_type': 'position',
+                'content': event['data']
+            }))
+            return
 
-        if len(data) > 0:
-            await self.send_json({
-                'content': json.dumps(data)
-            })
+        await self.send_json({
+            'content': json.dumps(event['data'])
+        })
 
 
 class GuestVehicleConsumer(AsyncJsonWebsocketConsumer):
@@ -127,6 +387,7 @@ class GuestVehicleConsumer(AsyncJsonWebsocketConsumer):
             {
                 'type': 'notify_monitor',
                 'notification_type': 'position',
+                'delta': True,
                 'data': [
                     {
                         'plateNum': content['plateNum'],
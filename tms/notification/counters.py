@@ -0,0 +1,166 @@
+"""
+Per user unread & read notification counters
+
+Counts are kept in a redis hash per user so that the count endpoints do not
+count the notifications. A missing hash is rebuilt from the db on the next
+read and expires after COUNTS_TTL, so any drift is corrected daily.
+
+Every change is applied with the increment script, which only increments an
+existing hash, and counts are stored with the store script, which only
+creates a missing one, see core/redis.py; the MQTT bridge increments them
+with the same script.
+
+    python manage.py notification_counts           # rebuild every counter
+    python manage.py notification_counts --check   # compare them with the db
+"""
+from django.db.models import Count, Q
+from redis import RedisError
+
+from .models import Notification
+from ..core.redis import (
+    r, NOTIFICATION_COUNTS_KEY as COUNTS_KEY, NOTIFICATION_COUNTS_TTL as COUNTS_TTL,
+    NOTIFICATION_COUNTS_INCREMENT_SCRIPT, NOTIFICATION_COUNTS_STORE_SCRIPT
+)
+
+
+UNREAD = 'unread'
+READ = 'read'
+
+increment_script = r.register_script(NOTIFICATION_COUNTS_INCREMENT_SCRIPT)
+store_script = r.register_script(NOTIFICATION_COUNTS_STORE_SCRIPT)
+
+
+def get_state(notification):
+    """
+    Counter of the notification, deleted ones are not counted
+    """
+    if notification.is_deleted:
+        return None
+
+    return READ if notification.is_read else UNREAD
+
+
+def count_from_db(user_ids):
+    """
+    Return user id -> {'unread': n, 'read': n} counted in the db
+    """
+    rows = Notification.objects.filter(
+        is_deleted=False, user_id__in=user_ids
+    ).values('user_id').annotate(
+        unread=Count('id', filter=Q(is_read=False)),
+        read=Count('id', filter=Q(is_read=True))
+    )
+    counts = {user_id: {UNREAD: 0, READ: 0} for user_id in user_ids}
+    for row in rows:
+        counts[row['user_id']] = {UNREAD: row['unread'], READ: row['read']}
+
+    return counts
+
+
+def store_counts(counts):
+    """
+    Store the counts of the users whose counter is missing; an existing one
+    already holds the increments applied since the counts were read
+    """
+    if not counts:
+        return
+
+    args = [COUNTS_TTL]
+    for user_counts in counts.values():
+        args += [user_counts[UNREAD], user_counts[READ]]
+
+    store_script(keys=[COUNTS_KEY.format(user_id) for user_id in counts], args=args)
+
+
+def get_counts(user_id):
+    """
+    Return {'unread': n, 'read': n} of the user
+    """
+    try:
+        counts = r.hgetall(COUNTS_KEY.format(user_id))
+    except RedisError:
+        return count_from_db([user_id])[user_id]
+
+    if counts:
+        return {
+            UNREAD: int(counts.get(UNREAD.encode(), 0)),
+            READ: int(counts.get(READ.encode(), 0))
+        }
+
+    counts = count_from_db([user_id])
+    try:
+        store_counts(counts)
+    except RedisError:
+        pass
+
+    return counts[user_id]
+
+
+def increment(user_id, unread=0, read=0):
+    try:
+        increment_script(keys=[COUNTS_KEY.format(user_id)], args=[unread, read])
+    except RedisError:
+        pass
+
+
+def change_state(user_id, old_state, new_state):
+    """
+    Move a notification from old_state counter to new_state one, either
+    may be None for created or deleted notifications
+    """
+    if old_state == new_state:
+        return
+
+    deltas = {UNREAD: 0, READ: 0}
+    if old_state is not None:
+        deltas[old_state] -= 1
+    if new_state is not None:
+        deltas[new_state] += 1
+
+    increment(user_id, deltas[UNREAD], deltas[READ])
+
+
+def rebuild(user_ids=None):
+    """
+    Recount the counters of the users, or every user with notifications
+    """
+    if user_ids is None:
+        user_ids = Notification.objects.values_list('user_id', flat=True).distinct()
+
+    user_ids = list(user_ids)
+    # deleted before counting, a change committed after the count is applied
+    # to the new counter, or rebuilds it on the next read
+    if user_ids:
+        r.delete(*[COUNTS_KEY.format(user_id) for user_id in user_ids])
+    store_counts(count_from_db(user_ids))
+    return len(user_ids)
+
+
+def check(user_ids=None):
+    """
+    Return user id -> (counter, db counts) of the counters which differ
+    from the db; missing counters are not checked as they are rebuilt on
+    the next read
+    """
+    if user_ids is None:
+        user_ids = Notification.objects.values_list('user_id', flat=True).distinct()
+
+    user_ids = list(user_ids)
+    pipe = r.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.hgetall(COUNTS_KEY.format(user_id))
+
+    db_counts = count_from_db(user_ids)
+    mismatches = {}
+    for user_id, counts in zip(user_ids, pipe.execute()):
+        if not counts:
+            continue
+
+        counts = {
+            UNREAD: int(counts.get(UNREAD.encode(), 0)),
+            READ: int(counts.get(READ.encode(), 0))
+        }
+        if counts != db_counts[user_id]:
+            mismatches[user_id] = (counts, db_counts[user_id])
+
+    return mismatches
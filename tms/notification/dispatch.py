@@ -0,0 +1,40 @@
+"""
+Notification dispatch: store the notifications of the receivers and queue
+them in the outbox, with two queries; outbox.py sends them to the open
+sockets and pushes them to the devices
+"""
+from django.db import transaction
+
+from . import counters
+from .models import Notification, NotificationOutbox
+from .serializers import NotificationSerializer
+
+
+def send_notifications(users, message, message_type):
+    users = [user for user in users if user is not None]
+    if not users:
+        return []
+
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create([
+            Notification(user=user, message=message, msg_type=message_type)
+            for user in users
+        ])
+
+        NotificationOutbox.objects.bulk_create([
+            NotificationOutbox(
+                user_id=notification.user_id,
+                data=NotificationSerializer(notification).data,
+                push_title=str(message_type),
+                push_body=str(message_type)
+            )
+            for notification in notifications
+        ])
+
+        def count_unread():
+            for user in users:
+                counters.increment(user.id, unread=1)
+
+        transaction.on_commit(count_unread)
+
+    return notifications
@@ -0,0 +1,70 @@
+import msgpack
+
+
+# opt-in binary websocket subprotocol of the position consumers
+MSGPACK_SUBPROTOCOL = 'tms.msgpack'
+
+# coordinates are sent as ints of 1e-6 degree, about 0.1m
+COORDINATE_SCALE = 1000000
+
+# position fields packed in the position list, the others follow as a map
+POSITION_FIELDS = ('plateNum', 'lnglat', 'speed')
+
+
+class PositionFrameEncoder:
+    """
+    Encode the messages of a position socket as msgpack frames
+
+    Every position is sent as [plate id, lng, lat, speed], lng & lat being
+    fixed-point ints, followed by a map of its other fields if it has any,
+    e.g. the status & updated of the snapshot ones, so the frames carry the
+    same fields as the json ones. Plate ids are numbered per connection; the
+    first frame a plate appears in carries its number in 'plates':
+    {id: plate number}. Other messages are packed as they are.
+    """
+    def __init__(self):
+        self.plate_ids = {}
+
+    def plate_id(self, plate_num, new_plates):
+        plate_id = self.plate_ids.get(plate_num)
+        if plate_id is None:
+            plate_id = len(self.plate_ids)
+            self.plate_ids[plate_num] = plate_id
+            new_plates[plate_id] = plate_num
+
+        return plate_id
+
+    def encode_positions(self, positions):
+        new_plates = {}
+        content = []
+        for position in positions:
+            packed = [
+                self.plate_id(position['plateNum'], new_plates),
+                int(round(float(position['lnglat'][0]) * COORDINATE_SCALE)),
+                int(round(float(position['lnglat'][1]) * COORDINATE_SCALE)),
+                int(round(float(position['speed'])))
+            ]
+            fields = {key: value for key, value in position.items() if key not in POSITION_FIELDS}
+            if fields:
+                packed.append(fields)
+
+            content.append(packed)
+
+        return new_plates, content
+
+    def encode(self, message):
+        if message.get('notification_type') in ('position', 'snapshot'):
+            message = dict(message)
+            message['plates'], message['content'] = self.encode_positions(message['content'])
+
+        return msgpack.packb(message, use_bin_type=True)
+
+
+def get_position_encoder(scope):
+    """
+    Return the encoder if the client asked for the msgpack subprotocol
+    """
+    if MSGPACK_SUBPROTOCOL in scope.get('subprotocols', []):
+        return PositionFrameEncoder()
+
+    return None
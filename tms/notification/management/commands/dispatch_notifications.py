@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from tms.notification import outbox
+
+
+class Command(BaseCommand):
+    help = 'Dispatch the notification outbox continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=1,
+            help='Seconds to wait when the outbox is empty'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=outbox.BATCH_SIZE,
+            help='Notifications claimed at once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            latencies = outbox.dispatch(batch_size=options['batch_size'])
+            if not latencies:
+                time.sleep(options['interval'])
+                continue
+
+            if options['verbosity'] > 1:
+                self.stdout.write('Dispatched {} notifications, latency avg {:.2f}s max {:.2f}s'.format(
+                    len(latencies), sum(latencies) / len(latencies), max(latencies)
+                ))
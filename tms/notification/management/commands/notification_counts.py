@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from tms.notification import counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the unread & read notification counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only compare the counters with the db'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            users = counters.rebuild()
+            self.stdout.write('Rebuilt the counters of {} users'.format(users))
+            return
+
+        mismatches = counters.check()
+        for user_id, (counts, db_counts) in mismatches.items():
+            self.stdout.write('User {}: counter {}, db {}'.format(user_id, counts, db_counts))
+
+        self.stdout.write('{} counters differ from the db'.format(len(mismatches)))
@@ -41,6 +41,16 @@ class AvailableNotificationManager(models.Manager):
         )
 
 
+class PendingOutboxManager(models.Manager):
+    """
+    Notifications not dispatched yet
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            dispatched_on__isnull=True
+        )
+
+
 class ProcessedEventManager(models.Manager):
     """
     Pending Job Manager
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notification', '0011_auto_20191205_2324'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', jsonfield.fields.JSONField()),
+                ('push_title', models.CharField(blank=True, max_length=100)),
+                ('push_body', models.CharField(blank=True, max_length=100)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('sent_on', models.DateTimeField(blank=True, null=True)),
+                ('latency', models.FloatField(blank=True, null=True)),
+                ('dispatched_on', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notificationoutbox',
+            index=models.Index(condition=models.Q(dispatched_on__isnull=True), fields=['id'], name='notification_outbox_pending'),
+        ),
+    ]
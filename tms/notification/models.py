@@ -53,6 +53,80 @@ class Notification(models.Model):
         )
 
 
+class NotificationOutbox(models.Model):
+    """
+    Notification waiting to be sent to the user's sockets and device,
+    see outbox.py
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='outbox'
+    )
+
+    data = JSONField()
+
+    push_title = models.CharField(
+        max_length=100,
+        blank=True
+    )
+
+    push_body = models.CharField(
+        max_length=100,
+        blank=True
+    )
+
+    created_on = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    # not claimed by the dispatchers until then, see outbox.py
+    claimed_until = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    # sent to the sockets, the push may still be retried
+    sent_on = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    # seconds from created_on to sent_on
+    latency = models.FloatField(
+        null=True,
+        blank=True
+    )
+
+    dispatched_on = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    attempts = models.PositiveIntegerField(
+        default=0
+    )
+
+    last_error = models.TextField(
+        blank=True
+    )
+
+    objects = models.Manager()
+    pendings = managers.PendingOutboxManager()
+
+    class Meta:
+        ordering = (
+            'id',
+        )
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='notification_outbox_pending',
+                condition=models.Q(dispatched_on__isnull=True)
+            )
+        ]
+
+
 class Event(models.Model):
 
     event_type = models.PositiveIntegerField(
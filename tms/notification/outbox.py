@@ -0,0 +1,192 @@
+"""
+Notification outbox
+
+Producers only insert NotificationOutbox rows with enqueue(), the MQTT bridge
+inserts them with sql. A dispatcher delivers them in three steps:
+
+ - claim: a short transaction takes a batch of pending rows with
+   SELECT ... FOR UPDATE SKIP LOCKED and sets their claimed_until to
+   CLAIM_TIMEOUT later, so that any number of dispatchers may run at once
+   and the rows of a killed dispatcher are taken again after it
+ - deliver: out of any transaction, the batch is sent to the users' open
+   sockets at once and pushed to the devices on the push threads, see
+   core/aliyunpush.py
+ - record: sent rows get their sent_on & latency and are not sent to the
+   sockets again; rows whose delivery failed get their error and are retried
+   RETRY_DELAY later until MAX_ATTEMPTS, the others are dispatched
+
+The dispatcher runs as the tms.notification.tasks.dispatch_notification_outbox
+celery beat task, or as a service:
+
+    python manage.py dispatch_notifications
+"""
+import json
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import presence
+from .models import NotificationOutbox
+from ..core.aliyunpush import submit_push_notifications, PUSH_BATCH_SIZE
+
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+
+# longer than the push retries of a batch
+CLAIM_TIMEOUT = timedelta(minutes=5)
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def enqueue(user_ids, data, push_title='', push_body=''):
+    """
+    Queue the notification data to the users, it is pushed to their devices
+    too if push_title is given
+    """
+    return NotificationOutbox.objects.bulk_create([
+        NotificationOutbox(user_id=user_id, data=data, push_title=push_title, push_body=push_body)
+        for user_id in user_ids
+    ])
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Claim a batch of pending notifications, return them
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        notifications = list(
+            NotificationOutbox.pendings.select_related('user').select_for_update(
+                skip_locked=True, of=('self', )
+            ).filter(
+                Q(claimed_until__isnull=True) | Q(claimed_until__lt=now),
+                attempts__lt=MAX_ATTEMPTS
+            )[:batch_size]
+        )
+        if notifications:
+            NotificationOutbox.objects.filter(
+                id__in=[notification.id for notification in notifications]
+            ).update(claimed_until=now + CLAIM_TIMEOUT, attempts=F('attempts') + 1)
+
+    return notifications
+
+
+def send(notifications):
+    """
+    Send the notifications not sent yet to the sockets, return them
+    """
+    notifications = [notification for notification in notifications if notification.sent_on is None]
+    if notifications:
+        presence.notify_users([
+            (notification.user_id, json.dumps(notification.data))
+            for notification in notifications
+        ])
+
+    return notifications
+
+
+def push(notifications):
+    """
+    Push the notifications to the devices, return notification id -> error
+    of the notifications whose push failed
+    """
+    groups = {}
+    for notification in notifications:
+        if notification.push_title and notification.user.device_token:
+            groups.setdefault(
+                (notification.push_title, notification.push_body), []
+            ).append(notification)
+
+    # a request per chunk of devices, so that only the notifications of the
+    # failed requests are pushed again
+    futures = []
+    for (title, body), group in groups.items():
+        for i in range(0, len(group), PUSH_BATCH_SIZE):
+            chunk = group[i:i + PUSH_BATCH_SIZE]
+            tokens = [notification.user.device_token for notification in chunk]
+            for future in submit_push_notifications(title, body, tokens):
+                futures.append((future, chunk))
+
+    errors = {}
+    for future, chunk in futures:
+        error = future.exception()
+        if error is not None:
+            for notification in chunk:
+                errors[notification.id] = error
+
+    return errors
+
+
+def retry_later(notifications, errors):
+    retry_on = timezone.now() + RETRY_DELAY
+    for notification in notifications:
+        notification.claimed_until = retry_on
+        notification.last_error = repr(errors[notification.id])
+
+    NotificationOutbox.objects.bulk_update(notifications, ['claimed_until', 'last_error'])
+
+
+def deliver(notifications):
+    """
+    Deliver the claimed notifications and record the results, return the
+    dispatched ones
+    """
+    try:
+        sent = send(notifications)
+    except Exception as e:
+        # none of them is recorded as sent, so all of them are sent again
+        retry_later(notifications, {notification.id: e for notification in notifications})
+        return []
+
+    sent_on = timezone.now()
+    for notification in sent:
+        notification.sent_on = sent_on
+        notification.latency = (sent_on - notification.created_on).total_seconds()
+    NotificationOutbox.objects.bulk_update(sent, ['sent_on', 'latency'])
+
+    errors = push(notifications)
+    retry_later([notification for notification in notifications if notification.id in errors], errors)
+
+    dispatched = [notification for notification in notifications if notification.id not in errors]
+    dispatched_on = timezone.now()
+    NotificationOutbox.objects.filter(
+        id__in=[notification.id for notification in dispatched]
+    ).update(dispatched_on=dispatched_on, claimed_until=None, last_error='')
+    for notification in dispatched:
+        notification.dispatched_on = dispatched_on
+
+    return dispatched
+
+
+def dispatch_batch(batch_size=BATCH_SIZE):
+    """
+    Claim and deliver a batch of pending notifications, return the
+    dispatched ones, or None if there was nothing to claim
+    """
+    notifications = claim(batch_size)
+    if not notifications:
+        return None
+
+    return deliver(notifications)
+
+
+def dispatch(batch_size=BATCH_SIZE, max_batches=None):
+    """
+    Dispatch pending notifications until there is none left, return the
+    latencies in seconds of the notifications sent to the sockets
+    """
+    latencies = []
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        notifications = dispatch_batch(batch_size)
+        if notifications is None:
+            break
+
+        latencies += [
+            notification.latency for notification in notifications
+            if notification.latency is not None
+        ]
+        batches += 1
+
+    return latencies
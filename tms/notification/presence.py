@@ -0,0 +1,109 @@
+"""
+Presence of the users' notification sockets
+
+A user may have several sockets open at once, e.g. on the web and the app.
+Every socket channel is kept in the user's sorted set scored by its expiry
+time. Sockets refresh their entry every PRESENCE_REFRESH_INTERVAL seconds, so
+the channels of sockets whose server died expire after PRESENCE_TTL.
+"""
+import asyncio
+import time
+from redis import RedisError
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+
+from ..core.redis import r
+
+
+PRESENCE_KEY = 'presence:{}'
+PRESENCE_TTL = 120
+PRESENCE_REFRESH_INTERVAL = 60
+
+channel_layer = get_channel_layer()
+
+
+def add_channel(user_id, channel_name):
+    """
+    Register or refresh the socket channel of the user
+    """
+    key = PRESENCE_KEY.format(user_id)
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.zadd(key, {channel_name: now + PRESENCE_TTL})
+    pipe.expire(key, PRESENCE_TTL)
+    pipe.execute()
+
+
+def remove_channel(user_id, channel_name):
+    r.zrem(PRESENCE_KEY.format(user_id), channel_name)
+
+
+def get_users_channels(user_ids):
+    """
+    Return user id -> channel names of the users with open sockets
+    """
+    user_ids = list(user_ids)
+    now = time.time()
+    pipe = r.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zrangebyscore(PRESENCE_KEY.format(user_id), now, '+inf')
+
+    return {
+        user_id: [channel_name.decode('utf-8') for channel_name in channel_names]
+        for user_id, channel_names in zip(user_ids, pipe.execute()) if channel_names
+    }
+
+
+def get_channels(user_id):
+    return get_users_channels([user_id]).get(user_id, [])
+
+
+async_add_channel = sync_to_async(add_channel)
+async_remove_channel = sync_to_async(remove_channel)
+async_get_channels = sync_to_async(get_channels)
+
+
+async def send_notify_messages(messages):
+    """
+    Send (user id, channel name, data) notify messages concurrently, return
+    the user id & channel name of the channels which are full
+    """
+    results = await asyncio.gather(*[
+        channel_layer.send(channel_name, {'type': 'notify', 'data': data})
+        for user_id, channel_name, data in messages
+    ], return_exceptions=True)
+
+    full_channels = []
+    for (user_id, channel_name, data), result in zip(messages, results):
+        if isinstance(result, ChannelFull):
+            full_channels.append((user_id, channel_name))
+        elif isinstance(result, Exception):
+            raise result
+
+    return full_channels
+
+
+def notify_users(notifications):
+    """
+    Send (user id, data) notify messages to every open socket of the users
+    in one batch
+    """
+    notifications = list(notifications)
+    try:
+        channels = get_users_channels({user_id for user_id, data in notifications})
+    except RedisError:
+        return
+
+    messages = [
+        (user_id, channel_name, data)
+        for user_id, data in notifications
+        for channel_name in channels.get(user_id, [])
+    ]
+    if not messages:
+        return
+
+    # nobody reads the full channels anymore
+    for user_id, channel_name in async_to_sync(send_notify_messages)(messages):
+        remove_channel(user_id, channel_name)
@@ -2,9 +2,15 @@ from datetime import date
 from config.celery import app
 from ..core import constants as c
 from . import models as m
+from . import outbox
 from ..info.models import BasicSetting
 
 
+@app.task
+def dispatch_notification_outbox():
+    outbox.dispatch()
+
+
 @app.task
 def remind_expires_events():
     bs = BasicSetting.objects.first()
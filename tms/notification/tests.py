@@ -0,0 +1,345 @@
+import asyncio
+import msgpack
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from rest_framework.test import APITestCase
+
+from ..core import constants
+from ..core.redis import r
+from . import counters, outbox
+from .consumers import GuestVehicleConsumer, PositionConsumer
+from .frames import PositionFrameEncoder, get_position_encoder, MSGPACK_SUBPROTOCOL
+from .models import Notification, NotificationOutbox
+
+
+UserModel = get_user_model()
+
+
+def get_future(error=None):
+    future = Future()
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+    return future
+
+
+class PositionFrameEncoderTest(SimpleTestCase):
+
+    def decode(self, frame):
+        return msgpack.unpackb(frame, raw=False)
+
+    def test_get_position_encoder(self):
+        """
+         - encoder of the sockets asking for the msgpack subprotocol
+         - no encoder for the others
+        """
+        self.assertIsInstance(get_position_encoder({'subprotocols': [MSGPACK_SUBPROTOCOL]}), PositionFrameEncoder)
+        self.assertIsNone(get_position_encoder({'subprotocols': []}))
+        self.assertIsNone(get_position_encoder({}))
+
+    def test_encode_positions(self):
+        """
+         - positions are packed as [plate id, lng, lat, speed] with fixed-point coordinates
+         - plate numbers are sent with the first frame they appear in only
+        """
+        encoder = PositionFrameEncoder()
+        frame = self.decode(encoder.encode({
+            'notification_type': 'position',
+            'content': [
+                {'plateNum': 'A', 'lnglat': ['120.123456', 30.5], 'speed': 30.4},
+                {'plateNum': 'B', 'lnglat': [121.0, 31.0], 'speed': 0},
+            ]
+        }))
+        self.assertEqual(frame['plates'], {0: 'A', 1: 'B'})
+        self.assertEqual(frame['content'], [[0, 120123456, 30500000, 30], [1, 121000000, 31000000, 0]])
+
+        frame = self.decode(encoder.encode({
+            'notification_type': 'position',
+            'content': [
+                {'plateNum': 'B', 'lnglat': [121.0, 31.0], 'speed': 10},
+                {'plateNum': 'C', 'lnglat': [122.0, 32.0], 'speed': 20},
+            ]
+        }))
+        self.assertEqual(frame['plates'], {2: 'C'})
+        self.assertEqual([position[0] for position in frame['content']], [1, 2])
+
+    def test_encode_snapshot(self):
+        """
+         - other fields of the positions follow them as a map
+        """
+        frame = self.decode(PositionFrameEncoder().encode({
+            'notification_type': 'snapshot',
+            'seq': 3,
+            'content': [
+                {'plateNum': 'A', 'lnglat': [120.0, 30.0], 'speed': 0, 'status': 'stopped', 'updated': 1000, 'seq': 3},
+            ]
+        }))
+        self.assertEqual(frame['seq'], 3)
+        self.assertEqual(
+            frame['content'], [[0, 120000000, 30000000, 0, {'status': 'stopped', 'updated': 1000, 'seq': 3}]]
+        )
+
+    def test_encode_other_messages(self):
+        """
+         - messages other than positions & snapshots are packed as they are
+        """
+        message = {'notification_type': 'stopEvent', 'content': {'plateNum': 'A'}}
+        self.assertEqual(self.decode(PositionFrameEncoder().encode(message)), message)
+
+
+class MessageRecorder:
+    """
+    Records the messages sent by a consumer
+    """
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, content, close=False):
+        self.messages.append(content)
+
+    async def group_send(self, group, message):
+        self.messages.append(message)
+
+
+class PositionConsumerTest(SimpleTestCase):
+
+    def get_consumer(self):
+        consumer = PositionConsumer({'type': 'websocket', 'query_string': b''})
+        consumer.seq = 0
+        consumer.encoder = None
+        consumer.subscription = None
+        consumer.pending_positions = {}
+        consumer.pending_delta = True
+        consumer.flush_task = None
+        return consumer
+
+    def test_merge_guest_position(self):
+        """
+         - guest position merged with a bridge delta is flushed as a delta
+        """
+        layer = MessageRecorder()
+        guest = GuestVehicleConsumer({'type': 'websocket'})
+        guest.channel_layer = layer
+
+        sent = MessageRecorder()
+        consumer = self.get_consumer()
+        consumer.send_json = sent.send_json
+
+        async def receive():
+            consumer.last_position_sent = asyncio.get_event_loop().time()
+            await consumer.notify_monitor({
+                'type': 'notify_monitor',
+                'notification_type': 'position',
+                'delta': True,
+                'seq': 1,
+                'data': [{'plateNum': 'A', 'lnglat': [120.0, 30.0], 'speed': 30}]
+            })
+            await guest.receive_json({'plateNum': 'B', 'lng': 121.0, 'lat': 31.0, 'speed': 20})
+            await consumer.notify_monitor(layer.messages[0])
+
+            consumer.flush_task.cancel()
+            await consumer.flush_positions()
+
+        asyncio.get_event_loop().run_until_complete(receive())
+        self.assertEqual(sent.messages, [{
+            'notification_type': 'position',
+            'delta': True,
+            'seq': 1,
+            'content': [
+                {'plateNum': 'A', 'lnglat': [120.0, 30.0], 'speed': 30},
+                {'plateNum': 'B', 'lnglat': [121.0, 31.0], 'speed': 20},
+            ]
+        }])
+
+
+class NotificationOutboxTest(TestCase):
+    def setUp(self):
+        self.driver = UserModel.objects.create(
+            username='driver',
+            mobile='789',
+            password='gibupjo127',
+            user_type=constants.USER_TYPE_DRIVER,
+            device_token='token'
+        )
+
+        patcher = mock.patch.object(outbox.presence, 'notify_users')
+        self.notify_users = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(outbox, 'submit_push_notifications', return_value=[get_future()])
+        self.submit_push_notifications = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        outbox.enqueue([self.driver.id], {'message': 'hello'}, 'title', 'body')
+
+    def get_notification(self):
+        return NotificationOutbox.objects.get(user=self.driver)
+
+    def test_dispatch(self):
+        """
+         - notification is sent to the sockets, pushed and dispatched
+         - its latency is recorded
+        """
+        latencies = outbox.dispatch()
+
+        self.notify_users.assert_called_once_with([(self.driver.id, '{"message": "hello"}')])
+        self.submit_push_notifications.assert_called_once_with('title', 'body', ['token'])
+        notification = self.get_notification()
+        self.assertIsNotNone(notification.dispatched_on)
+        self.assertIsNotNone(notification.sent_on)
+        self.assertIsNone(notification.claimed_until)
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(latencies, [notification.latency])
+        self.assertIsNone(outbox.dispatch_batch())
+
+    def test_claim(self):
+        """
+         - claimed notifications are not claimed again until their claim expires
+         - notifications out of attempts are not claimed
+        """
+        self.assertEqual(len(outbox.claim()), 1)
+        self.assertEqual(outbox.claim(), [])
+
+        NotificationOutbox.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(outbox.claim()), 1)
+
+        NotificationOutbox.objects.update(
+            claimed_until=None, attempts=outbox.MAX_ATTEMPTS
+        )
+        self.assertEqual(outbox.claim(), [])
+
+    def test_retry_failed_push(self):
+        """
+         - notification whose push failed is retried after RETRY_DELAY
+         - it is not sent to the sockets again
+        """
+        self.submit_push_notifications.return_value = [get_future(ValueError('push failed'))]
+        self.assertEqual(outbox.dispatch(), [])
+
+        notification = self.get_notification()
+        self.assertIsNone(notification.dispatched_on)
+        self.assertIsNotNone(notification.sent_on)
+        self.assertIn('push failed', notification.last_error)
+        self.assertGreater(notification.claimed_until, timezone.now())
+        self.assertIsNone(outbox.dispatch_batch())
+
+        NotificationOutbox.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.submit_push_notifications.return_value = [get_future()]
+        self.assertEqual(len(outbox.dispatch_batch()), 1)
+
+        self.notify_users.assert_called_once()
+        notification = self.get_notification()
+        self.assertIsNotNone(notification.dispatched_on)
+        self.assertEqual(notification.attempts, 2)
+        self.assertEqual(notification.last_error, '')
+
+    def test_retry_failed_push_chunk(self):
+        """
+         - only the notifications of the failed push request are retried
+        """
+        escort = UserModel.objects.create(
+            username='escort',
+            mobile='790',
+            password='gibupjo127',
+            user_type=constants.USER_TYPE_ESCORT,
+            device_token='escort token'
+        )
+        outbox.enqueue([escort.id], {'message': 'hello'}, 'title', 'body')
+        self.submit_push_notifications.side_effect = [[get_future()], [get_future(ValueError('push failed'))]]
+
+        with mock.patch.object(outbox, 'PUSH_BATCH_SIZE', 1):
+            self.assertEqual(len(outbox.dispatch_batch()), 1)
+
+        self.assertEqual(
+            [call[0][2] for call in self.submit_push_notifications.call_args_list],
+            [['token'], ['escort token']]
+        )
+        self.assertIsNotNone(self.get_notification().dispatched_on)
+        notification = NotificationOutbox.objects.get(user=escort)
+        self.assertIsNone(notification.dispatched_on)
+        self.assertIn('push failed', notification.last_error)
+
+    def test_retry_failed_send(self):
+        """
+         - notification is not recorded as sent if the sockets send failed
+        """
+        self.notify_users.side_effect = ValueError('send failed')
+        self.assertEqual(outbox.dispatch_batch(), [])
+
+        notification = self.get_notification()
+        self.assertIsNone(notification.sent_on)
+        self.assertIsNone(notification.dispatched_on)
+        self.assertIn('send failed', notification.last_error)
+        self.submit_push_notifications.assert_not_called()
+
+
+class NotificationCountersTest(APITestCase):
+    def setUp(self):
+        self.driver = UserModel.objects.create(
+            username='driver',
+            mobile='789',
+            password='gibupjo127',
+            user_type=constants.USER_TYPE_DRIVER
+        )
+        self.key = counters.COUNTS_KEY.format(self.driver.id)
+        r.delete(self.key)
+        self.addCleanup(r.delete, self.key)
+
+        Notification.objects.create(user=self.driver, message={'text': 'unread'})
+        Notification.objects.create(user=self.driver, message={'text': 'read'}, is_read=True)
+        Notification.objects.create(user=self.driver, message={'text': 'deleted'}, is_deleted=True)
+
+    def test_get_counts(self):
+        """
+         - missing counter is rebuilt from the db
+         - increments are applied to the counter
+         - increments of a missing counter are dropped
+        """
+        self.assertEqual(counters.get_counts(self.driver.id), {counters.UNREAD: 1, counters.READ: 1})
+
+        counters.change_state(self.driver.id, counters.UNREAD, counters.READ)
+        counters.increment(self.driver.id, unread=2)
+        self.assertEqual(counters.get_counts(self.driver.id), {counters.UNREAD: 2, counters.READ: 2})
+
+        r.delete(self.key)
+        counters.increment(self.driver.id, unread=1)
+        self.assertFalse(r.exists(self.key))
+
+    def test_store_counts(self):
+        """
+         - counts are stored only if the counter is missing
+        """
+        counters.store_counts({self.driver.id: {counters.UNREAD: 5, counters.READ: 0}})
+        counters.store_counts({self.driver.id: {counters.UNREAD: 1, counters.READ: 1}})
+        self.assertEqual(counters.get_counts(self.driver.id), {counters.UNREAD: 5, counters.READ: 0})
+        self.assertGreater(r.ttl(self.key), 0)
+
+    def test_rebuild(self):
+        """
+         - rebuild replaces a drifted counter with the db counts
+         - check reports the counters differing from the db
+        """
+        counters.store_counts({self.driver.id: {counters.UNREAD: 5, counters.READ: 0}})
+        self.assertIn(self.driver.id, counters.check([self.driver.id]))
+
+        self.assertEqual(counters.rebuild([self.driver.id]), 1)
+        self.assertEqual(counters.get_counts(self.driver.id), {counters.UNREAD: 1, counters.READ: 1})
+        self.assertEqual(counters.check([self.driver.id]), {})
+
+    def test_create_notification(self):
+        """
+         - notification created with the api is counted
+        """
+        counters.get_counts(self.driver.id)
+        self.client.force_authenticate(user=self.driver)
+        response = self.client.post('/api/notifications', {'message': {'text': 'new'}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(counters.get_counts(self.driver.id), {counters.UNREAD: 2, counters.READ: 1})
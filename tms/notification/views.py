@@ -2,6 +2,7 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from . import counters
 from . import models as m
 from . import serializers as s
 from .permissions import IsMyNotification
@@ -14,6 +15,15 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return self.request.user.notifications.filter(is_deleted=False)
 
+    def perform_create(self, serializer):
+        instance = serializer.save(user=self.request.user)
+        counters.change_state(instance.user_id, None, counters.get_state(instance))
+
+    def perform_update(self, serializer):
+        old_state = counters.get_state(serializer.instance)
+        instance = serializer.save()
+        counters.change_state(instance.user_id, old_state, counters.get_state(instance))
+
     @action(detail=True, methods=['post'], url_path='read')
     def read_notification(self, request, pk=None):
         instance = self.get_object()
@@ -22,7 +32,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
             data=request.data
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        self.perform_update(serializer)
 
         return Response(
             serializer.data,
@@ -33,8 +43,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def unread_notification_count(self, request):
         return Response(
             {
-                'count':
-                request.user.notifications.filter(is_deleted=False, is_read=False).count()
+                'count': counters.get_counts(request.user.id)[counters.UNREAD]
             },
             status=status.HTTP_200_OK
         )
@@ -43,16 +52,17 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def read_notification_count(self, request):
         return Response(
             {
-                'count':
-                request.user.notifications.filter(is_deleted=False, is_read=True).count()
+                'count': counters.get_counts(request.user.id)[counters.READ]
             },
             status=status.HTTP_200_OK
         )
 
     def destroy(self, request, pk=None):
         job = self.get_object()
+        old_state = counters.get_state(job)
         job.is_deleted = True
         job.save()
+        counters.change_state(job.user_id, old_state, None)
 
         return Response(
             {
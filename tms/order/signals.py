@@ -1,23 +1,36 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete
 
 from ..core import constants as c
-from ..core.redis import r
+from ..core.redis import publish_invalidation, INVALIDATION_JOB
 
 # models
 from . import models as m
 
 
+@receiver(post_init, sender=m.Job)
+def loaded_job(sender, instance, **kwargs):
+    # vehicle of the job as stored, to invalidate it too on reassignment;
+    # not loaded if deferred
+    instance._stored_vehicle_id = instance.__dict__.get('vehicle_id')
+
+
 @receiver(post_save, sender=m.Job)
 def updated_job(sender, instance, created, **kwargs):
 
     if created:
         pass
 
-    if instance.progress > c.JOB_PROGRESS_NOT_STARTED:
-        # r.sadd('jobs', instance.id)
-        r.set('is_jobs', 'updated')
+    if instance.progress != c.JOB_PROGRESS_NOT_STARTED:
+        publish_invalidation(INVALIDATION_JOB, id=instance.id, vehicle=instance.vehicle_id)
+
+        previous_vehicle_id = getattr(instance, '_stored_vehicle_id', None)
+        if previous_vehicle_id is not None and previous_vehicle_id != instance.vehicle_id:
+            publish_invalidation(INVALIDATION_JOB, id=instance.id, vehicle=previous_vehicle_id)
 
+    instance._stored_vehicle_id = instance.vehicle_id
+
+    if instance.progress > c.JOB_PROGRESS_NOT_STARTED:
         # set order status to in-progress
         if instance.order.status == c.ORDER_STATUS_PENDING:
             instance.order.status = c.ORDER_STATUS_INPROGRESS
@@ -35,6 +48,11 @@ def updated_job(sender, instance, created, **kwargs):
     #     )
 
 
+@receiver(post_delete, sender=m.Job)
+def deleted_job(sender, instance, **kwargs):
+    publish_invalidation(INVALIDATION_JOB, id=instance.id, vehicle=instance.vehicle_id)
+
+
 # Job delete notifications; when the job is deleted, driver, escort should be notified of the changes
 # @receiver(pre_delete, sender=m.Job)
 # def job_deleted(sender, instance, **kwargs):
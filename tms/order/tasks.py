@@ -2,58 +2,21 @@
 todo: code optimization, sending notification logic was used in multiple places
 """
 import datetime
-import json
 import month
 from django.shortcuts import get_object_or_404
 from config.celery import app
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 from ..core import constants as c
-from ..core.aliyunpush import aliyun_client, aliyun_request
-from ..core.redis import r
 
 # models
 from . import models as m
 from ..core.utils import get_branches
 from ..hr.models import CustomerProfile
 from ..account.models import User
-from ..notification.models import Notification
 # from ..vehicle.models import Vehicle
 
-# serializers
-from ..notification.serializers import NotificationSerializer
-
-
-channel_layer = get_channel_layer()
-
-
-def send_notifications(users, message, message_type):
-
-    for user in users:
-        notification = Notification.objects.create(
-            user=user,
-            message=message,
-            msg_type=message_type
-        )
-
-        if user.channel_name:
-            async_to_sync(channel_layer.send)(
-                user.channel_name,
-                {
-                    'type': 'notify',
-                    'data': json.dumps(
-                        NotificationSerializer(notification).data
-                    )
-                }
-            )
-
-        # send push notification to driver
-        if user.device_token:
-            aliyun_request.set_Title(message_type)
-            aliyun_request.set_Body(message_type)
-            aliyun_request.set_TargetValue(user.device_token)
-            aliyun_client.do_action(aliyun_request)
+# other
+from ..notification.dispatch import send_notifications
 
 
 @app.task
@@ -346,14 +309,11 @@ def notify_of_job_deleted(context):
     """
     send notification when the job is deleted
     """
-    job_id = context['job']
     vehicle = context['vehicle']
     driver = get_object_or_404(User, id=context['driver'])
     escort = get_object_or_404(User, id=context['escort'])
     customer = get_object_or_404(CustomerProfile, id=context['customer'])
 
-    r.srem('jobs', job_id)
-
     # send notification
     # message = {
     #     "vehicle": vehicle,
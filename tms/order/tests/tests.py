@@ -1,9 +1,17 @@
+import json
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TransactionTestCase
 
 from rest_framework.test import APITestCase
 from rest_framework_jwt.settings import api_settings
 
 from ...core import constants
+from ...core.redis import publish_invalidation, INVALIDATION_JOB
+from .. import models as m
+from ..signals import updated_job
 
 
 UserModel = get_user_model()
@@ -130,3 +138,56 @@ class ProductViewSetTest(APITestCase):
          - retrieve order by customer - success
         """
         pass
+
+
+class JobInvalidationTest(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch('tms.core.redis.r')
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_published(self):
+        return [json.loads(call[0][1]) for call in self.redis.publish.call_args_list]
+
+    def test_publish_on_commit(self):
+        """
+         - invalidation is published once the transaction is committed
+         - invalidation is not published if it is rolled back
+        """
+        with transaction.atomic():
+            publish_invalidation(INVALIDATION_JOB, id=1, vehicle=2)
+            self.assertEqual(self.get_published(), [])
+
+        self.assertEqual(self.get_published(), [{'type': INVALIDATION_JOB, 'id': 1, 'vehicle': 2}])
+
+        try:
+            with transaction.atomic():
+                publish_invalidation(INVALIDATION_JOB, id=1, vehicle=3)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(len(self.get_published()), 1)
+
+    def test_reassigned_job(self):
+        """
+         - job in progress invalidates its vehicle
+         - job moved to another vehicle invalidates the previous one too
+         - job not started is not published
+        """
+        job = m.Job(
+            id=1, vehicle_id=2, progress=constants.JOB_PROGRESS_TO_LOADING_STATION,
+            order=m.Order(status=constants.ORDER_STATUS_INPROGRESS)
+        )
+        updated_job(m.Job, job, created=False)
+        self.assertEqual([message['vehicle'] for message in self.get_published()], [2])
+
+        job.vehicle_id = 3
+        updated_job(m.Job, job, created=False)
+        self.assertEqual([message['vehicle'] for message in self.get_published()], [2, 3, 2])
+
+        self.redis.reset_mock()
+        job.vehicle_id = 4
+        job.progress = constants.JOB_PROGRESS_NOT_STARTED
+        updated_job(m.Job, job, created=False)
+        self.assertEqual(self.get_published(), [])
@@ -1,6 +1,5 @@
-import json
 from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
 from pytz import timezone as tz
 import requests
 
@@ -16,9 +15,6 @@ from rest_framework.response import Response
 from drf_renderer_xlsx.mixins import XLSXFileMixin
 from drf_renderer_xlsx.renderers import XLSXRenderer
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
 # constants
 from ..core import constants as c
 from ..core.utils import get_branches
@@ -34,6 +30,7 @@ from ..account.models import User
 from ..info.models import Product, TransportationDistance
 from ..route.models import Route
 from ..vehicle.models import Vehicle, VehicleWorkerBind
+from ..notification.outbox import enqueue
 
 # serializers
 from . import serializers as s
@@ -44,6 +41,8 @@ from ..core.views import TMSViewSet
 
 # other
 from ..g7.interfaces import G7Interface
+from ..g7 import states
+from ..vehicle.tracks import get_track
 from .tasks import (
     notify_order_changes,
     notify_of_job_creation, notify_of_job_changes, notify_of_job_finish,
@@ -52,9 +51,6 @@ from .tasks import (
 )
 
 
-channel_layer = get_channel_layer()
-
-
 class OrderCartViewSet(TMSViewSet):
 
     queryset = m.OrderCart.objects.all()
@@ -878,16 +874,12 @@ class OrderViewSet(TMSViewSet):
                 {'job': 'Not job started'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        body = {
-            'plate_nums': list(plate_nums),
-            'fields': ['loc']
-        }
-        data = G7Interface.call_g7_http_interface(
-            'BULK_VEHICLE_STATUS_INQUIRY',
-            body=body
-        )
+        result = states.get_vehicles_status(plate_nums, fields=('loc', ))
+        if result.is_partial and not result.data:
+            raise result.errors[0]
+
         ret = []
-        for key, value in data.items():
+        for key, value in result.data.items():
             if value['code'] == 0:
                 ret.append(value)
 
@@ -1694,58 +1686,36 @@ class JobViewSet(TMSViewSet):
     def get_vehicle_playback_by_job(self, request, pk=None):
         job = self.get_object()
 
-        start_time = timezone.localtime(job.started_on).strftime(
-            '%Y-%m-%d %H:%M:%S'
-        )
-        finish_time = timezone.localtime(job.finished_on).strftime(
-            '%Y-%m-%d %H:%M:%S'
-        )
         results = {
             'total_distance': 0,
             'paths': [],
             'meta': []
         }
-        while True:
-            queries = {
-                'plate_num': job.vehicle.plate_num,
-                'from': start_time,
-                'to': finish_time,
-                'timeInterval': '10'
-            }
-            try:
-                data = G7Interface.call_g7_http_interface(
-                    'VEHICLE_HISTORY_TRACK_QUERY',
-                    queries=queries
+        try:
+            data = get_track(
+                job.vehicle.plate_num,
+                timezone.localtime(job.started_on).replace(tzinfo=None),
+                timezone.localtime(job.finished_on).replace(tzinfo=None),
+                interval=10
+            )
+            for x in data:
+                results['paths'].append([x.pop('lng'), x.pop('lat')])
+                results['total_distance'] += round(x['distance'] / 100)
+                x['distance'] = round(
+                    results['total_distance'] / 1000, 2
                 )
-                for x in data:
-                    results['paths'].append([x.pop('lng'), x.pop('lat')])
-                    results['total_distance'] += round(x['distance'] / 100)
-                    x['distance'] = round(
-                        results['total_distance'] / 1000, 2
-                    )
-                    x['time'] = datetime.fromtimestamp(
-                        int(x['time'])/1000, tz=tz('Asia/Shanghai')
-                    ).strftime('%Y-%m-%d %H:%M:%S')
-
-                results['meta'].extend(data)
+                x['time'] = datetime.fromtimestamp(
+                    int(x['time'])/1000, tz=tz('Asia/Shanghai')
+                ).strftime('%Y-%m-%d %H:%M:%S')
 
-                if len(data) == 1000:
-                    start_time = datetime.strptime(
-                        data[999]['time'], '%Y-%m-%d %H:%M:%S'
-                    )
-                    start_time = start_time + timedelta(seconds=1)
-                    start_time = start_time.strftime('%Y-%m-%d %H:%M:%S')
-
-                else:
-                    break
-            except Exception:
-                results = {
-                    'result': {
-                        'code': '1',
-                        'msg': 'g7 error'
-                    }
+            results['meta'].extend(data)
+        except Exception:
+            results = {
+                'result': {
+                    'code': '1',
+                    'msg': 'g7 error'
                 }
-                break
+            }
 
         if 'total_distance' in results:
             results['total_distance'] = round(
@@ -2080,17 +2050,10 @@ class JobViewSet(TMSViewSet):
         if len(meta_numbers):
             ret['meta_numbers'] = meta_numbers
 
-        if partner.channel_name:
-            async_to_sync(channel_layer.send)(
-                partner.channel_name,
-                {
-                    'type': 'notify',
-                    'data': json.dumps({
-                        'msg_type': c.DRIVER_NOTIFICATION_PROGRESS_SYNC,
-                        'message': 'job updated'
-                    })
-                }
-            )
+        enqueue([partner.id], {
+            'msg_type': c.DRIVER_NOTIFICATION_PROGRESS_SYNC,
+            'message': 'job updated'
+        })
 
         return Response(
             ret,
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0012_auto_20200519_1530'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleTrack',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plate_num', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('start', models.PositiveIntegerField(default=0)),
+                ('points', models.BinaryField(default=b'')),
+                ('is_complete', models.BooleanField(default=False)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('day', 'start', 'id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='vehicletrack',
+            index=models.Index(fields=['plate_num', 'day'], name='vehicle_track_day'),
+        ),
+    ]
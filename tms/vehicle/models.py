@@ -922,3 +922,44 @@ class VehicleViolation(models.Model):
     #     null=True,
     #     blank=True
     # )
+
+
+class VehicleTrack(models.Model):
+    """
+    Track points of the vehicle on a day as fixed-width records, see
+    tracks.py; the bridge inserts a row of points on every flush, complete
+    tracks are the G7 ones of the past days
+    """
+    plate_num = models.CharField(
+        max_length=100
+    )
+
+    day = models.DateField()
+
+    # unix time of the first point
+    start = models.PositiveIntegerField(
+        default=0
+    )
+
+    points = models.BinaryField(
+        default=b''
+    )
+
+    is_complete = models.BooleanField(
+        default=False
+    )
+
+    updated_on = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        ordering = (
+            'day', 'start', 'id'
+        )
+        indexes = [
+            models.Index(
+                fields=['plate_num', 'day'],
+                name='vehicle_track_day'
+            )
+        ]
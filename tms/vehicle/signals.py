@@ -2,11 +2,16 @@ from django.dispatch import receiver
 from django.db.models.signals import post_save, post_delete
 
 from . import models as m
-# from ..core.redis import r
+from ..core.redis import (
+    publish_invalidation, INVALIDATION_VEHICLE, INVALIDATION_VEHICLE_WORKERS
+)
 
 
 @receiver([post_save, post_delete], sender=m.Vehicle)
 def notify_asgimqtt_of_vehicle_changes(sender, instance, **kwargs):
-    pass
-    # if r.get('vehicle') != b'updated':
-    #     r.set('vehicle', 'updated')
+    publish_invalidation(INVALIDATION_VEHICLE, id=instance.id)
+
+
+@receiver([post_save, post_delete], sender=m.VehicleWorkerBind)
+def notify_asgimqtt_of_vehicle_worker_changes(sender, instance, **kwargs):
+    publish_invalidation(INVALIDATION_VEHICLE_WORKERS, vehicle=instance.vehicle_id)
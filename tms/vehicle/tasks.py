@@ -0,0 +1,8 @@
+from datetime import date, timedelta
+from config.celery import app
+from . import tracks
+
+
+@app.task
+def backfill_vehicle_tracks():
+    tracks.backfill_day(date.today() - timedelta(days=1))
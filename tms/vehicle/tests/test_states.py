@@ -0,0 +1,80 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ...core.redis import r
+from ...g7 import states
+from ...g7.interfaces import G7BulkResult
+
+
+def get_bulk_result(data):
+    result = G7BulkResult()
+    result.data = {
+        plate_num: {'code': 0, 'plate_num': plate_num, 'data': value}
+        for plate_num, value in data.items()
+    }
+    return result
+
+
+class VehicleStatesTest(SimpleTestCase):
+    def setUp(self):
+        self.plate_nums = ['TEST-A', 'TEST-B']
+        self.keys = [states.VEHICLE_STATE_KEY.format(plate_num) for plate_num in self.plate_nums]
+        r.delete(*self.keys)
+        self.addCleanup(r.delete, *self.keys)
+
+        patcher = mock.patch.object(states.G7Interface, 'call_g7_bulk_interface')
+        self.call_g7_bulk_interface = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_state(self, plate_num, updated=None, **state):
+        r.hmset(
+            states.VEHICLE_STATE_KEY.format(plate_num),
+            dict(state, updated=time.time() if updated is None else updated)
+        )
+
+    def test_get_vehicles_status(self):
+        """
+         - vehicles with an up to date state are not asked to G7
+         - the others are asked to G7 and their states are stored
+        """
+        self.set_state('TEST-A', lng=120.5, lat=30.5, speed=40, acc=1, gps=1, time=1000)
+        self.call_g7_bulk_interface.return_value = get_bulk_result({
+            'TEST-B': {'loc': {'lng': 121, 'lat': 31, 'speed': 0}, 'status': {'acc': 0}, 'time': 2000}
+        })
+
+        result = states.get_vehicles_status(self.plate_nums)
+
+        self.assertEqual(self.call_g7_bulk_interface.call_args[0][1], ['TEST-B'])
+        self.assertEqual(result.data['TEST-A']['data']['loc'], {'lng': 120.5, 'lat': 30.5, 'speed': 40})
+        self.assertEqual(result.data['TEST-A']['data']['status'], {'acc': 1, 'gps': 1})
+        self.assertEqual(result.data['TEST-B']['data']['loc']['lng'], 121)
+        self.assertEqual(states.get_states(['TEST-B'])['TEST-B']['lng'], 121)
+
+    def test_stale_or_incomplete_state(self):
+        """
+         - state older than VEHICLE_STATE_MAX_AGE is asked to G7
+         - state without a required field is asked to G7
+        """
+        self.set_state('TEST-A', lng=120, lat=30, speed=0, updated=time.time() - settings.VEHICLE_STATE_MAX_AGE - 1)
+        self.set_state('TEST-B', lng=121, lat=31, speed=0)
+        self.call_g7_bulk_interface.return_value = get_bulk_result({})
+
+        states.get_vehicles_status(self.plate_nums, required=states.POSITION_FIELDS + ('address', ))
+        self.assertEqual(self.call_g7_bulk_interface.call_args[0][1], self.plate_nums)
+
+    def test_store_states(self):
+        """
+         - G7 state is merged into the stored one
+         - older G7 state only fills in the missing fields
+        """
+        self.set_state('TEST-A', lng=120, lat=30, speed=10, acc=1, gps=1, time=2000)
+        states.store_states({'TEST-A': {'lng': 121, 'lat': 31, 'speed': 20, 'time': 3000}})
+        state = states.get_states(['TEST-A'])['TEST-A']
+        self.assertEqual((state['lng'], state['acc'], state['gps']), (121, 1, 1))
+
+        states.store_states({'TEST-A': {'lng': 122, 'address': 'address', 'time': 1000}})
+        state = states.get_states(['TEST-A'], required=('address', ))['TEST-A']
+        self.assertEqual((state['lng'], state['address']), (121, 'address'))
@@ -0,0 +1,126 @@
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import models as m
+from .. import tracks
+
+
+def get_point(point_on, lng=120.0, distance=0):
+    return {
+        'time': tracks.local_timestamp(point_on) * 1000,
+        'lng': lng,
+        'lat': 30.0,
+        'speed': 40,
+        'course': 90,
+        'distance': distance
+    }
+
+
+def get_points(start, count, step=5, distance=100):
+    return [
+        get_point(start + timedelta(seconds=index * step), 120 + index / 1000, distance)
+        for index in range(count)
+    ]
+
+
+class VehicleTrackTest(TestCase):
+    def setUp(self):
+        self.plate_num = 'TEST-A'
+        patcher = mock.patch.object(tracks, 'fetch_g7_track', return_value=[])
+        self.fetch_g7_track = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_backfill(self):
+        """
+         - past day without a complete track is fetched from G7 once
+        """
+        start = datetime(2019, 5, 1, 8)
+        self.fetch_g7_track.return_value = get_points(start, 3, step=10)
+
+        points = tracks.get_track(self.plate_num, start, start + timedelta(hours=1))
+        self.assertEqual(len(points), 3)
+        self.assertTrue(m.VehicleTrack.objects.get(plate_num=self.plate_num, day=start.date()).is_complete)
+
+        tracks.get_track(self.plate_num, start, start + timedelta(hours=1))
+        self.assertEqual(self.fetch_g7_track.call_count, 1)
+
+    def test_backfill_bridge_points(self):
+        """
+         - rows of the bridge points of a past day are replaced by the G7 track
+        """
+        start = datetime(2019, 5, 1, 8)
+        for points in (get_points(start, 2), get_points(start + timedelta(minutes=1), 2)):
+            m.VehicleTrack.objects.create(
+                plate_num=self.plate_num, day=start.date(), start=tracks.local_timestamp(start),
+                points=tracks.pack_g7_points(points)
+            )
+        self.fetch_g7_track.return_value = get_points(start, 3, step=10)
+
+        points = tracks.get_track(self.plate_num, start, start + timedelta(hours=1))
+        self.assertEqual(len(points), 3)
+        self.assertEqual(
+            list(m.VehicleTrack.objects.filter(plate_num=self.plate_num).values_list('is_complete', flat=True)),
+            [True]
+        )
+
+    def test_get_track(self):
+        """
+         - points of the days are stitched and cut to the start & finish
+         - one point per interval is kept, with the distances of the skipped ones
+        """
+        midnight = datetime(2019, 5, 2)
+        for day, points in (
+            (date(2019, 5, 1), get_points(midnight - timedelta(seconds=60), 12)),
+            (date(2019, 5, 2), get_points(midnight, 12)),
+        ):
+            m.VehicleTrack.objects.create(
+                plate_num=self.plate_num, day=day, points=tracks.pack_g7_points(points), is_complete=True
+            )
+
+        start, finish = midnight - timedelta(seconds=30), midnight + timedelta(seconds=30)
+        points = tracks.get_track(self.plate_num, start, finish, interval=10)
+
+        self.fetch_g7_track.assert_not_called()
+        self.assertEqual(
+            [point['time'] // 1000 for point in points],
+            [tracks.local_timestamp(start + timedelta(seconds=seconds)) for seconds in range(0, 61, 10)]
+        )
+        self.assertEqual(points[0]['distance'], 0)
+        self.assertTrue(all(point['distance'] == 200 for point in points[1:]))
+
+    def test_fill_gaps(self):
+        """
+         - spans longer than MAX_GAP without bridge points are fetched from G7
+         - distance of the bridge point after a gap is in the G7 points
+        """
+        start = datetime(2019, 5, 1, 8)
+        gap = tracks.MAX_GAP * 2
+        data = tracks.pack_g7_points(
+            get_points(start, 3) + [get_point(start + timedelta(seconds=gap), distance=5000)]
+        )
+        self.fetch_g7_track.return_value = [get_point(start + timedelta(seconds=gap // 2), distance=2500)]
+
+        filled = list(tracks.POINT_FORMAT.iter_unpack(
+            tracks.fill_gaps(self.plate_num, data, start, start + timedelta(seconds=gap + 60))
+        ))
+
+        self.fetch_g7_track.assert_called_once_with(
+            self.plate_num, start + timedelta(seconds=11), start + timedelta(seconds=gap - 1)
+        )
+        self.assertEqual(len(filled), 5)
+        self.assertEqual(filled[3][-1], 2500)
+        self.assertEqual(filled[4][-1], 0)
+
+    def test_fill_gaps_without_points(self):
+        """
+         - whole span is fetched from G7 without bridge points
+        """
+        start = datetime(2019, 5, 1, 8)
+        self.fetch_g7_track.return_value = get_points(start, 2)
+
+        filled = tracks.fill_gaps(self.plate_num, b'', start, start + timedelta(hours=1))
+
+        self.fetch_g7_track.assert_called_once_with(self.plate_num, start, start + timedelta(hours=1))
+        self.assertEqual(len(filled), 2 * tracks.POINT_FORMAT.size)
@@ -0,0 +1,214 @@
+"""
+Local store of the vehicle tracks for the playback apis
+
+The track of a vehicle on a day is held by VehicleTrack rows as POINT_FORMAT
+records: time in seconds, lng & lat in 1e-6 degrees, speed, course and
+distance since the previous point in cm. Days are cut in settings.TIME_ZONE.
+
+The position bridge inserts a row of the points it buffered on every flush,
+see mqtt/trackstore.py, and the rows of the day are concatenated when read.
+A past day is fetched from G7 once, the first time it is played back or by
+the backfill_vehicle_tracks task after midnight, and replaces the rows of
+the day by one complete row. Today is read from the bridge points, the spans
+they miss, e.g. before the bridge started or while it was down, are fetched
+from G7.
+"""
+import pytz
+import struct
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+
+from . import models as m
+from ..g7.interfaces import G7Interface
+
+
+POINT_FORMAT = struct.Struct('<IiiHHI')
+COORDINATE_SCALE = 1000000
+
+# interval of the points kept, the playback apis ask 10s or more
+TRACK_INTERVAL = 10
+
+# spans of today without bridge points longer than this are fetched from G7,
+# longer than the bridge flush interval
+MAX_GAP = 30 * TRACK_INTERVAL
+
+# VEHICLE_HISTORY_TRACK_QUERY returns up to 1000 points per call
+G7_PAGE_SIZE = 1000
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+TIME_ZONE = pytz.timezone(settings.TIME_ZONE)
+
+
+def local_timestamp(value):
+    """
+    Unix time of the naive datetime of settings.TIME_ZONE
+    """
+    return int(TIME_ZONE.localize(value).timestamp())
+
+
+def local_datetime(timestamp):
+    """
+    Naive datetime of settings.TIME_ZONE of the unix time
+    """
+    return datetime.fromtimestamp(timestamp, TIME_ZONE).replace(tzinfo=None)
+
+
+def pack_g7_points(points):
+    return b''.join(
+        POINT_FORMAT.pack(
+            int(point['time']) // 1000,
+            int(round(float(point['lng']) * COORDINATE_SCALE)),
+            int(round(float(point['lat']) * COORDINATE_SCALE)),
+            min(int(round(float(point['speed'] or 0))), 0xffff),
+            int(float(point.get('course') or 0)) % 360,
+            int(float(point.get('distance') or 0))
+        )
+        for point in points
+    )
+
+
+def fetch_g7_track(plate_num, start, finish, interval=TRACK_INTERVAL):
+    """
+    Return the G7 track points between the start & finish datetimes
+    """
+    points = []
+    while True:
+        data = G7Interface.call_g7_http_interface(
+            'VEHICLE_HISTORY_TRACK_QUERY',
+            queries={
+                'plate_num': plate_num,
+                'from': start.strftime(TIME_FORMAT),
+                'to': finish.strftime(TIME_FORMAT),
+                'timeInterval': str(interval)
+            }
+        )
+        points += data
+        if len(data) < G7_PAGE_SIZE:
+            return points
+
+        start = local_datetime(int(data[-1]['time']) // 1000) + timedelta(seconds=1)
+
+
+def backfill(plate_num, day):
+    """
+    Replace the track of the past day with the G7 one
+    """
+    start = datetime.combine(day, time.min)
+    points = pack_g7_points(fetch_g7_track(plate_num, start, start + timedelta(days=1, seconds=-1)))
+    with transaction.atomic():
+        m.VehicleTrack.objects.filter(plate_num=plate_num, day=day).delete()
+        track = m.VehicleTrack.objects.create(
+            plate_num=plate_num, day=day, start=local_timestamp(start), points=points, is_complete=True
+        )
+
+    return track
+
+
+def fill_gaps(plate_num, data, start, finish):
+    """
+    Return the bridge points of today between the start & finish datetimes
+    with the G7 points of the spans longer than MAX_GAP they miss
+    """
+    if start >= finish:
+        return data
+
+    start_time, finish_time = local_timestamp(start), local_timestamp(finish)
+    records = [
+        (point[0], data[index * POINT_FORMAT.size:(index + 1) * POINT_FORMAT.size])
+        for index, point in enumerate(POINT_FORMAT.iter_unpack(data))
+    ]
+    if not records:
+        return pack_g7_points(fetch_g7_track(plate_num, start, finish))
+
+    filled = b''
+    last_time = start_time
+    for point_time, record in records + [(finish_time, None)]:
+        gap_start, gap_finish = max(last_time, start_time), min(point_time, finish_time)
+        if gap_finish - gap_start > MAX_GAP:
+            filled += pack_g7_points(fetch_g7_track(
+                plate_num, local_datetime(gap_start + 1), local_datetime(gap_finish - 1)
+            ))
+            if record is not None:
+                # the distance since the bridge point before the gap is in the G7 points
+                record = POINT_FORMAT.pack(*POINT_FORMAT.unpack(record)[:-1], 0)
+
+        if record is not None:
+            filled += record
+        last_time = max(last_time, point_time)
+
+    return filled
+
+
+def get_track(plate_num, start, finish, interval=TRACK_INTERVAL):
+    """
+    Return the track points between the start & finish datetimes, one per
+    interval seconds at most, as VEHICLE_HISTORY_TRACK_QUERY returns them
+    """
+    now = datetime.now(TIME_ZONE).replace(tzinfo=None)
+    today = now.date()
+    tracks = {}
+    for track in m.VehicleTrack.objects.filter(plate_num=plate_num, day__range=(start.date(), finish.date())):
+        tracks.setdefault(track.day, []).append(track)
+
+    data = b''
+    day = start.date()
+    while day <= min(finish.date(), today):
+        day_tracks = tracks.get(day, [])
+        complete = [track for track in day_tracks if track.is_complete]
+        if day < today:
+            track = complete[0] if complete else backfill(plate_num, day)
+            data += bytes(track.points)
+        else:
+            data += fill_gaps(
+                plate_num, b''.join(bytes(track.points) for track in day_tracks),
+                max(start, datetime.combine(day, time.min)), min(finish, now)
+            )
+
+        day += timedelta(days=1)
+
+    start_time, finish_time = local_timestamp(start), local_timestamp(finish)
+    points = []
+    distance = 0
+    last_time = None
+    for point_time, lng, lat, speed, course, point_distance in POINT_FORMAT.iter_unpack(data):
+        if point_time < start_time or point_time > finish_time:
+            continue
+
+        # distances of the skipped points are added to the next kept one
+        distance += point_distance
+        if last_time is not None and point_time - last_time < interval:
+            continue
+
+        points.append({
+            'lng': lng / COORDINATE_SCALE,
+            'lat': lat / COORDINATE_SCALE,
+            'speed': speed,
+            'course': course,
+            'time': point_time * 1000,
+            'distance': distance if last_time is not None else 0
+        })
+        distance = 0
+        last_time = point_time
+
+    return points
+
+
+def backfill_day(day):
+    """
+    Fetch the tracks of every vehicle on the past day which are not complete,
+    return the number of tracks fetched
+    """
+    complete = m.VehicleTrack.objects.filter(day=day, is_complete=True).values_list('plate_num', flat=True)
+    plate_nums = m.Vehicle.objects.exclude(plate_num__in=complete).values_list('plate_num', flat=True)
+    backfilled = 0
+    for plate_num in plate_nums:
+        try:
+            backfill(plate_num, day)
+            backfilled += 1
+        except Exception:
+            # fetched on its first playback
+            continue
+
+    return backfilled
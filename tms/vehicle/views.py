@@ -1,5 +1,5 @@
 from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser
 from django.shortcuts import get_object_or_404
@@ -26,7 +26,8 @@ from ..finance.serializers import ETCCardBalanceSerializer, FuelCardBalanceSeria
 
 # views
 from ..core.views import TMSViewSet
-from ..g7.interfaces import G7Interface
+from ..g7 import states
+from . import tracks
 from ..core import utils
 
 
@@ -137,42 +138,26 @@ class VehicleViewSet(TMSViewSet):
             'paths': [],
             'meta': []
         }
-        while True:
-            queries = {
-                'plate_num': vehicle.plate_num,
-                'from': start_time,
-                'to': finish_time,
-                'timeInterval': '30'
-            }
-            try:
-                data = G7Interface.call_g7_http_interface(
-                    'VEHICLE_HISTORY_TRACK_QUERY',
-                    queries=queries
-                )
-                for x in data:
-                    results['paths'].append([x.pop('lng'), x.pop('lat')])
-                    results['total_distance'] += round(x['distance'] / 100)
-                    x['time'] = datetime.fromtimestamp(x['time']/1000).strftime('%Y-%m-%d %H:%M:%S')
-
-                results['meta'].extend(data)
-
-                if len(data) == 1000:
-                    start_time = datetime.strptime(
-                        data[999]['time'], '%Y-%m-%d %H:%M:%S'
-                    )
-                    start_time = start_time + timedelta(seconds=1)
-                    start_time = start_time.strftime('%Y-%m-%d %H:%M:%S')
-
-                else:
-                    break
-            except Exception:
-                results = {
-                    'result': {
-                        'code': '1',
-                        'msg': 'g7 error'
-                    }
+        try:
+            data = tracks.get_track(
+                vehicle.plate_num,
+                datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S'),
+                datetime.strptime(finish_time, '%Y-%m-%d %H:%M:%S'),
+                interval=30
+            )
+            for x in data:
+                results['paths'].append([x.pop('lng'), x.pop('lat')])
+                results['total_distance'] += round(x['distance'] / 100)
+                x['time'] = datetime.fromtimestamp(x['time']/1000).strftime('%Y-%m-%d %H:%M:%S')
+
+            results['meta'].extend(data)
+        except Exception:
+            results = {
+                'result': {
+                    'code': '1',
+                    'msg': 'g7 error'
                 }
-                break
+            }
 
         if 'total_distance' in results:
             results['total_distance'] = round(
@@ -197,37 +182,21 @@ class VehicleViewSet(TMSViewSet):
             'distance': 0,
             'path': []
         }
-        while True:
-            queries = {
-                'plate_num': vehicle.plate_num,
-                'from': start_time,
-                'to': finish_time,
-                'timeInterval': '30'
+        try:
+            data = tracks.get_track(
+                vehicle.plate_num,
+                datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S'),
+                datetime.strptime(finish_time, '%Y-%m-%d %H:%M:%S'),
+                interval=30
+            )
+            for x in data:
+                result['path'].append([x.pop('lng'), x.pop('lat')])
+                result['distance'] += round(x['distance'] / 100)
+        except Exception:
+            result = {
+                'code': '1',
+                'msg': 'g7 error'
             }
-            try:
-                data = G7Interface.call_g7_http_interface(
-                    'VEHICLE_HISTORY_TRACK_QUERY',
-                    queries=queries
-                )
-                for x in data:
-                    result['path'].append([x.pop('lng'), x.pop('lat')])
-                    result['distance'] += round(x['distance'] / 100)
-
-                if len(data) == 1000:
-                    start_time = datetime.fromtimestamp(
-                        int(data[999]['time'])/1000
-                    )
-                    start_time = start_time + timedelta(seconds=1)
-                    start_time = start_time.strftime('%Y-%m-%d %H:%M:%S')
-
-                else:
-                    break
-            except Exception:
-                result = {
-                    'code': '1',
-                    'msg': 'g7 error'
-                }
-                break
 
         if 'distance' in result:
             result['distance'] /= 1000
@@ -240,46 +209,40 @@ class VehicleViewSet(TMSViewSet):
     @action(detail=False, url_path="g7-status")
     def get_all_vehicle_g7_status(self, request):
         plate_nums = m.Vehicle.objects.values_list('plate_num', flat=True)
-        chunks = [plate_nums[i * 100:(i + 1) * 100] for i in range((len(plate_nums) + 100 - 1) // 100)]
+        result = states.get_vehicles_status(
+            plate_nums, required=states.POSITION_FIELDS + states.STATUS_FIELDS
+        )
         ret = []
-        for chunk in chunks:
-            body = {
-                'plate_nums': chunk,
-                'fields': ['loc', 'status']
-            }
-            try:
-                data = G7Interface.call_g7_http_interface(
-                    'BULK_VEHICLE_STATUS_INQUIRY',
-                    body=body
-                )
-
-                for key, value in data.items():
-                    if value['code'] == 0:
-                        item_data = value['data']
-                        speed = item_data['loc']['speed']
-                        acc = item_data['status']['acc']
-                        gps = item_data['status']['gps']
-                        if speed > 0:
-                            icon_status = 'moving'
+        for key, value in result.data.items():
+            if value['code'] == 0 and value.get('data') and value['data']['status']:
+                item_data = value['data']
+                speed = item_data['loc']['speed']
+                acc = item_data['status']['acc']
+                gps = item_data['status']['gps']
+                if speed > 0:
+                    icon_status = 'moving'
+                else:
+                    if acc > 0:
+                        icon_status = 'acc'
+                    else:
+                        if gps > 0:
+                            icon_status = 'gps'
                         else:
-                            if acc > 0:
-                                icon_status = 'acc'
-                            else:
-                                if gps > 0:
-                                    icon_status = 'gps'
-                                else:
-                                    icon_status = 'stop'
-                        ret.append({
-                            'plate_num': value['plate_num'],
-                            'status': icon_status
-                        })
-
-            except Exception:
-                pass
+                            icon_status = 'stop'
+                ret.append({
+                    'plate_num': value['plate_num'],
+                    'status': icon_status
+                })
 
+        # vehicles of the chunks G7 failed are left out
         return Response(
             s.VehicleG7StatusSerializer(ret, many=True).data,
-            status=status.HTTP_200_OK
+            status=status.HTTP_200_OK,
+            headers={
+                'X-G7-Chunks': str(result.chunks),
+                'X-G7-Failed-Chunks': str(len(result.errors)),
+                'X-G7-Failed-Vehicles': str(len(result.failed_plate_nums))
+            }
         )
 
     @action(detail=False, url_path='status')
@@ -343,16 +306,14 @@ class VehicleViewSet(TMSViewSet):
         vai web sockets, so this api is called only once.
         """
         plate_nums = m.Vehicle.objects.values_list('plate_num', flat=True)
-        body = {
-            'plate_nums': list(plate_nums),
-            'fields': ['loc', 'status']
-        }
-        data = G7Interface.call_g7_http_interface(
-            'BULK_VEHICLE_STATUS_INQUIRY',
-            body=body
+        result = states.get_vehicles_status(
+            plate_nums, required=states.POSITION_FIELDS + ('gps', )
         )
+        if result.is_partial and not result.data:
+            raise result.errors[0]
+
         ret = []
-        for key, value in data.items():
+        for key, value in result.data.items():
             if value['code'] == 0:
                 if value.get('data', None) and value['data']['status']['gps']:
                     ret.append(value)
@@ -373,16 +334,7 @@ class VehicleViewSet(TMSViewSet):
         This api will be called when the driver want to see the job route
         """
         plate_num = self.request.query_params.get('plate_num', None)
-        queries = {
-            'plate_num': plate_num,
-            'fields': 'loc',
-            'addr_required': True,
-        }
-
-        data = G7Interface.call_g7_http_interface(
-            'VEHICLE_STATUS_INQUIRY',
-            queries=queries
-        )
+        data = states.get_vehicle_status(plate_num)
 
         if data is None:
             raise s.serializers.ValidationError({
@@ -426,16 +378,7 @@ class VehicleViewSet(TMSViewSet):
             escort = '无押运员'
             escort_mobile = ''
 
-        queries = {
-            'plate_num': plate_num,
-            'fields': 'loc',
-            'addr_required': True,
-        }
-
-        data = G7Interface.call_g7_http_interface(
-            'VEHICLE_STATUS_INQUIRY',
-            queries=queries
-        )
+        data = states.get_vehicle_status(plate_num, required=states.POSITION_FIELDS + ('address', ))
         ret = {
             'plate_num': plate_num,
             'driver': driver,